@@ -1,2 +1,5 @@
+from rubymarshal.scanner import validate
+
 __author__ = "Matthieu Gallet"
 __version__ = "1.2.10"
+__all__ = ["validate"]
@@ -0,0 +1,130 @@
+"""Command-line interface: `python -m rubymarshal --help`"""
+
+import argparse
+import json
+import sys
+
+from rubymarshal.sizes import analyze
+from rubymarshal.transcode import (
+    BINARY_BASE64,
+    BINARY_LATIN1,
+    SYMBOLS_OBJECT,
+    SYMBOLS_STR,
+    json_to_marshal,
+    marshal_to_json,
+)
+
+__author__ = "Matthieu Gallet"
+
+
+def to_json(args):
+    marshal_to_json(
+        args.input,
+        args.output,
+        lines=args.lines,
+        symbols=args.symbols,
+        binary=args.binary,
+        class_key=args.class_key or None,
+    )
+
+
+def from_json(args):
+    json_to_marshal(
+        args.input,
+        args.output,
+        lines=args.lines,
+        class_key=args.class_key or None,
+        symbol_keys=args.symbol_keys,
+    )
+
+
+def sizes(args):
+    result = analyze(args.input.read())
+    if args.json:
+        json.dump(result.as_dict(), args.output, indent=2)
+        args.output.write("\n")
+    else:
+        args.output.write(result.report(limit=args.limit) + "\n")
+
+
+def main(argv=None):
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    parser = argparse.ArgumentParser(
+        prog="python -m rubymarshal", description="Read and write Ruby-marshalled data"
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    parser_to_json = subparsers.add_parser(
+        "to-json", help="convert Marshal documents to JSON Lines"
+    )
+    parser_to_json.add_argument(
+        "input", nargs="?", type=argparse.FileType("rb"), default=stdin
+    )
+    parser_to_json.add_argument(
+        "output", nargs="?", type=argparse.FileType("w"), default=sys.stdout
+    )
+    parser_to_json.add_argument(
+        "--lines",
+        action="store_true",
+        help="write each element of top-level arrays on its own line",
+    )
+    parser_to_json.add_argument(
+        "--symbols", choices=[SYMBOLS_STR, SYMBOLS_OBJECT], default=SYMBOLS_STR
+    )
+    parser_to_json.add_argument(
+        "--binary",
+        choices=[BINARY_BASE64, BINARY_LATIN1],
+        default=BINARY_BASE64,
+        help="mapping of strings without encoding",
+    )
+    parser_to_json.add_argument("--class-key", default="$class")
+    parser_to_json.set_defaults(func=to_json)
+
+    parser_from_json = subparsers.add_parser(
+        "from-json",
+        help="convert JSON Lines to Marshal documents (one document per line)",
+    )
+    parser_from_json.add_argument(
+        "input", nargs="?", type=argparse.FileType("r"), default=sys.stdin
+    )
+    parser_from_json.add_argument(
+        "output", nargs="?", type=argparse.FileType("wb"), default=stdout
+    )
+    parser_from_json.add_argument(
+        "--lines",
+        action="store_true",
+        help="write a single top-level array of all lines",
+    )
+    parser_from_json.add_argument("--class-key", default="$class")
+    parser_from_json.add_argument(
+        "--symbol-keys",
+        action="store_true",
+        help="convert keys of JSON objects to symbols",
+    )
+    parser_from_json.set_defaults(func=from_json)
+
+    parser_sizes = subparsers.add_parser(
+        "sizes", help="show which paths and classes take up the bytes of a document"
+    )
+    parser_sizes.add_argument(
+        "input", nargs="?", type=argparse.FileType("rb"), default=stdin
+    )
+    parser_sizes.add_argument(
+        "output", nargs="?", type=argparse.FileType("w"), default=sys.stdout
+    )
+    parser_sizes.add_argument(
+        "--limit", type=int, default=None, help="maximum number of displayed paths"
+    )
+    parser_sizes.add_argument(
+        "--json", action="store_true", help="write the complete report as JSON"
+    )
+    parser_sizes.set_defaults(func=sizes)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+    args.output.flush()
+
+
+if __name__ == "__main__":
+    main()
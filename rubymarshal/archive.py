@@ -0,0 +1,185 @@
+"""Indexed archives of Marshal records.
+
+An archive is made of three files:
+
+  * `path`: standard Marshal documents, concatenated (readable by :func:`rubymarshal.reader.iter_load`),
+  * `path + ".idx"`: the offset of each document, as little-endian 64-bit unsigned integers,
+  * `path + ".keys"` (optional): a Marshal hash mapping keys to record numbers.
+
+"""
+
+import array
+import mmap
+import os
+import struct
+import sys
+
+from rubymarshal.reader import loads, loads_from
+from rubymarshal.scanner import validate
+from rubymarshal.writer import Writer, writes
+
+__author__ = "Matthieu Gallet"
+
+INDEX_SUFFIX = ".idx"
+KEYS_SUFFIX = ".keys"
+
+
+def read_offsets(index_path):
+    offsets = array.array("Q")
+    if os.path.exists(index_path):
+        with open(index_path, "rb") as fd:
+            offsets.frombytes(fd.read())
+        if sys.byteorder == "big":
+            offsets.byteswap()
+    return offsets
+
+
+def read_keys(keys_path):
+    if not os.path.exists(keys_path):
+        return {}
+    with open(keys_path, "rb") as fd:
+        return loads(fd.read())
+
+
+class ArchiveWriter:
+    """append records to an archive (created if it does not exist)
+
+    :param path: path of the data file
+    :param cls: Writer class to use. Subclass it to serialize new Python classes
+    """
+
+    def __init__(self, path, cls=Writer):
+        self.path = path
+        self.cls = cls
+        if os.path.exists(path) and not os.path.exists(path + INDEX_SUFFIX):
+            rebuild_index(path)
+        self.count = len(read_offsets(path + INDEX_SUFFIX))
+        self.keys = read_keys(path + KEYS_SUFFIX)
+        self.keys_modified = False
+        self.fd = open(path, "ab")
+        self.index_fd = open(path + INDEX_SUFFIX, "ab")
+
+    def append(self, obj, key=None):
+        """write a new record and return its number
+
+        :param obj: the object to serialize
+        :param key: optional key to retrieve the record with :meth:`Archive.lookup`
+            (a key that is already used now refers to the new record)
+        """
+        # encode the record first, so that an unmarshable object leaves the archive unchanged
+        data = writes(obj, cls=self.cls)
+        offset = self.fd.tell()
+        self.fd.write(data)
+        self.index_fd.write(struct.pack("<Q", offset))
+        record = self.count
+        self.count += 1
+        if key is not None:
+            self.keys[key] = record
+            self.keys_modified = True
+        return record
+
+    def close(self):
+        self.fd.close()
+        self.index_fd.close()
+        if self.keys_modified:
+            with open(self.path + KEYS_SUFFIX, "wb") as fd:
+                fd.write(writes(self.keys, cls=self.cls))
+            self.keys_modified = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Archive:
+    """random access to the records of an archive, through `mmap`
+
+    :param path: path of the data file
+    :param registry: class registry to use instead of the global one
+    """
+
+    def __init__(self, path, registry=None):
+        self.path = path
+        self.registry = registry
+        self.offsets = read_offsets(path + INDEX_SUFFIX)
+        self._keys = None
+        with open(path, "rb") as fd:
+            if os.fstat(fd.fileno()).st_size:
+                self.buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.buffer = b""
+
+    def get(self, index):
+        """return the record `index` (negative indices are allowed)"""
+        return loads_from(self.buffer, self.offsets[index], registry=self.registry)[0]
+
+    def lookup(self, key):
+        """return the last record appended with this key"""
+        return self.get(self.keys()[key])
+
+    def keys(self):
+        """return the key index, as a dict mapping keys to record numbers"""
+        if self._keys is None:
+            self._keys = read_keys(self.path + KEYS_SUFFIX)
+        return self._keys
+
+    def __getitem__(self, index):
+        return self.get(index)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield loads_from(self.buffer, offset, registry=self.registry)[0]
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def rebuild_index(path, registry=None, key=None, cls=Writer):
+    """rebuild the offset index of a raw file of concatenated Marshal documents
+
+    Records are only decoded when `key` is provided: otherwise, they are skipped with
+    :func:`rubymarshal.scanner.validate`.
+
+    :param path: path of the data file
+    :param registry: class registry to use instead of the global one
+    :param key: optional callable returning the key of a record (the key index is rebuilt only if provided)
+    :param cls: Writer class used to serialize the key index
+    :return: the number of records
+    """
+    offsets = array.array("Q")
+    keys = {}
+    with open(path, "rb") as fd:
+        size = os.fstat(fd.fileno()).st_size
+        buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        try:
+            offset = 0
+            while offset < size:
+                offsets.append(offset)
+                if key is None:
+                    offset += validate(buffer, offset, trailing=True).size
+                    continue
+                obj, offset = loads_from(buffer, offset, registry=registry)
+                keys[key(obj)] = len(offsets) - 1
+        finally:
+            if size:
+                buffer.close()
+    if sys.byteorder == "big":
+        offsets.byteswap()
+    with open(path + INDEX_SUFFIX, "wb") as fd:
+        fd.write(offsets.tobytes())
+    if key is not None:
+        with open(path + KEYS_SUFFIX, "wb") as fd:
+            fd.write(writes(keys, cls=cls))
+    return len(offsets)
@@ -0,0 +1,158 @@
+"""Write Marshal documents token by token, without building the Python object graph.
+
+.. code-block:: python
+
+  from rubymarshal.builder import Builder
+  with open("records.bin", "wb") as fd:
+      builder = Builder(fd)
+      builder.begin_array(len(rows))
+      for row in rows:
+          builder.begin_object("Record", 2)
+          builder.symbol("@id")
+          builder.integer(row[0])
+          builder.symbol("@name")
+          builder.string(row[1])
+          builder.end()
+      builder.end()
+      builder.close()
+
+The symbol table and the link indices are shared with the underlying :class:`rubymarshal.writer.Writer`,
+so complete Python values can also be written with :meth:`Builder.value`.
+Identical Python objects are only linked inside a single :meth:`Builder.value` call:
+use :meth:`Builder.link` with the returned index to refer to a value written by a previous call.
+"""
+
+from rubymarshal.classes import Symbol
+from rubymarshal.constants import TYPE_ARRAY, TYPE_HASH, TYPE_LINK, TYPE_OBJECT
+from rubymarshal.writer import Writer
+
+__author__ = "Matthieu Gallet"
+
+_ARRAY = "array"
+_HASH = "hash"
+_OBJECT = "object"
+
+
+class Builder:
+    """event-driven writer
+
+    :param fd: the file descriptor
+    :param cls: Writer class to use. Subclass it to serialize new Python classes
+    :param header: write the `\\x04\\x08` header
+    """
+
+    def __init__(self, fd, cls=Writer, header=True):
+        self.fd = fd
+        self.writer = cls(fd)
+        # each frame is [kind, number of remaining values, total number of values]
+        self.stack = []
+        self.complete = False
+        if header:
+            fd.write(b"\x04\x08")
+
+    def begin_value(self, is_symbol=False):
+        if self.complete:
+            raise ValueError("the document is already complete")
+        if self.stack:
+            kind, remaining, total = self.stack[-1]
+            if remaining == 0:
+                raise ValueError("too many values in %s" % kind)
+            if kind == _OBJECT and (total - remaining) % 2 == 0 and not is_symbol:
+                raise ValueError("attribute names must be symbols")
+
+    def end_value(self):
+        if self.stack:
+            self.stack[-1][1] -= 1
+        else:
+            self.complete = True
+
+    def begin_container(self, kind, token, count, values):
+        self.begin_value()
+        object_index = self.writer.object_count
+        self.writer.count_object()
+        self.fd.write(token)
+        self.writer.write_long(count)
+        self.stack.append([kind, values, values])
+        return object_index
+
+    def begin_array(self, count):
+        """start an array of `count` values and return its link index"""
+        return self.begin_container(_ARRAY, TYPE_ARRAY, count, count)
+
+    def begin_hash(self, count):
+        """start a hash of `count` pairs (keys and values alternate) and return its link index"""
+        return self.begin_container(_HASH, TYPE_HASH, count, 2 * count)
+
+    def begin_object(self, class_name, count):
+        """start an object with `count` instance variables and return its link index
+
+        Each attribute is given by its name (with :meth:`symbol`), followed by its value.
+        """
+        self.begin_value()
+        object_index = self.writer.object_count
+        self.writer.count_object()
+        self.fd.write(TYPE_OBJECT)
+        self.writer.write_symbol(Symbol(class_name))
+        self.writer.write_long(count)
+        self.stack.append([_OBJECT, 2 * count, 2 * count])
+        return object_index
+
+    def end(self):
+        """close the last started array, hash or object"""
+        if not self.stack:
+            raise ValueError("no array, hash or object to close")
+        kind, remaining, total = self.stack[-1]
+        if remaining:
+            raise ValueError("%d values are missing in %s" % (remaining, kind))
+        self.stack.pop()
+        self.end_value()
+
+    def nil(self):
+        self.value(None)
+
+    def boolean(self, value):
+        self.value(bool(value))
+
+    def integer(self, value):
+        self.value(int(value))
+
+    def float(self, value):
+        """write a float and return its link index"""
+        return self.value(float(value))
+
+    def string(self, value):
+        """write a `str` (with its encoding) or raw `bytes` and return its link index"""
+        if not isinstance(value, (str, bytes)):
+            raise ValueError("%r is not a string" % value)
+        return self.value(value)
+
+    def symbol(self, name):
+        self.begin_value(is_symbol=True)
+        self.writer.write_symbol(Symbol(name))
+        self.end_value()
+
+    def link(self, object_index):
+        """write a link to an object that has already been written"""
+        if not 0 <= object_index < self.writer.object_count:
+            raise ValueError("invalid link destination: %d" % object_index)
+        self.begin_value()
+        self.fd.write(TYPE_LINK)
+        self.writer.write_long(object_index)
+        self.end_value()
+
+    def value(self, obj):
+        """write a complete Python object and return the link index of its first object (`None` if there is none)"""
+        self.begin_value(is_symbol=isinstance(obj, Symbol))
+        object_index = self.writer.object_count
+        self.writer.write(obj)
+        # the writer tracks objects by id, but `obj` may be freed (and its id reused) after this call
+        self.writer.objects.clear()
+        self.end_value()
+        if self.writer.object_count == object_index:
+            return None
+        return object_index
+
+    def close(self):
+        """check that the document is complete"""
+        if not self.complete:
+            raise ValueError("the document is not complete")
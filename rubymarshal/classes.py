@@ -6,6 +6,9 @@ __author__ = "Matthieu Gallet"
 
 class RubyObject:
     ruby_class_name = None
+    # registered classes can define a `to_python()` method,
+    # whose result replaces the decoded object (see :mod:`rubymarshal.codecs`)
+    to_python = None
 
     def __init__(self, ruby_class_name=None, attributes=None):
         self.ruby_class_name = ruby_class_name or self.ruby_class_name
@@ -51,6 +54,9 @@ class RubyString(RubyObject):
         return False
 
     def __getattr__(self, item):
+        if item == "text":
+            # not initialized yet (e.g. while unpickling)
+            raise AttributeError(item)
         return getattr(self.text, item)
 
     def __add__(self, other):
@@ -123,6 +129,169 @@ class UserDef(RubyObject):
         return self._private_data
 
 
+class RubyStruct(RubyObject):
+    """instance of a Struct: `members` maps the member names (without `@`) to their values,
+    `attributes` only contains the instance variables."""
+
+    def __init__(self, ruby_class_name=None, members=None, attributes=None):
+        self.members = members or {}
+        super().__init__(ruby_class_name=ruby_class_name, attributes=attributes)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, self.__class__)
+            and self.members == other.members
+            and self.attributes == other.attributes
+        )
+
+    def __hash__(self):
+        return hash(f"{self.ruby_class_name} {repr(self.members)}")
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.members)
+
+    def __str__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.members)
+
+
+class RubyData(RubyObject):
+    """object of a class implemented in C, serialized by the _dump_data and _load_data instance methods."""
+
+    def __init__(self, ruby_class_name=None, attributes=None):
+        self._private_data = None
+        super().__init__(ruby_class_name=ruby_class_name, attributes=attributes)
+
+    def _load_data(self, private_data):
+        self._private_data = private_data
+
+    def _dump_data(self):
+        return self._private_data
+
+
+class UserClass(RubyObject):
+    """instance of a subclass of String, Regexp, Array or Hash.
+
+    `value` is the value of the parent class (`str`, :class:`RubyString`, regexp, `list` or `dict`).
+    The instance variables of strings and regexps are kept by the wrapped value."""
+
+    def __init__(self, ruby_class_name=None, value=None, attributes=None):
+        self.value = value
+        super().__init__(ruby_class_name=ruby_class_name, attributes=attributes)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, self.__class__)
+            and self.value == other.value
+            and self.attributes == other.attributes
+        )
+
+    def __hash__(self):
+        return hash(f"{self.ruby_class_name} {repr(self.value)}")
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.value)
+
+    def __str__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.value)
+
+
+class DefaultHash(dict):
+    """hash with a default value (`Hash.new(default)`)"""
+
+    def __init__(self, *args, default=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default = default
+
+    def __eq__(self, other):
+        if isinstance(other, DefaultHash) and self.default != other.default:
+            return False
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "%s(%s, default=%r)" % (
+            self.__class__.__name__,
+            super().__repr__(),
+            self.default,
+        )
+
+
+class HashPairs:
+    """ordered `(key, value)` pairs of a hash, decoded without hashing the keys (that may be unhashable)
+
+    Lookups build a `dict` on first use: call :meth:`clear_cache` after modifying `pairs`.
+    """
+
+    __slots__ = ("pairs", "default", "_dict")
+
+    def __init__(self, pairs=None, default=None):
+        self.pairs = [] if pairs is None else pairs
+        self.default = default
+        self._dict = None
+
+    def to_dict(self):
+        """return a new `dict` with the same pairs (keys must be hashable)"""
+        return dict(self.pairs)
+
+    def clear_cache(self):
+        self._dict = None
+
+    def items(self):
+        return iter(self.pairs)
+
+    def keys(self):
+        return (key for (key, value) in self.pairs)
+
+    def values(self):
+        return (value for (key, value) in self.pairs)
+
+    def get(self, key, default=None):
+        if self._dict is None:
+            self._dict = self.to_dict()
+        return self._dict.get(key, default)
+
+    def __getitem__(self, key):
+        if self._dict is None:
+            self._dict = self.to_dict()
+        return self._dict[key]
+
+    def __contains__(self, key):
+        if self._dict is None:
+            self._dict = self.to_dict()
+        return key in self._dict
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, HashPairs)
+            and self.pairs == other.pairs
+            and self.default == other.default
+        )
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return HashPairs, (self.pairs, self.default)
+
+    def __repr__(self):
+        if self.default is None:
+            return "%s(%r)" % (self.__class__.__name__, self.pairs)
+        return "%s(%r, default=%r)" % (
+            self.__class__.__name__,
+            self.pairs,
+            self.default,
+        )
+
+
 class Extended(RubyObject):
     pass
 
@@ -143,6 +312,10 @@ class Symbol:
         self.name = name
         self.__registered_symbols__[name] = self
 
+    def __reduce__(self):
+        # unpickled symbols are also unique
+        return Symbol, (self.name,)
+
     def __hash__(self):
         return hash("<<<:%s:>>>" % self.name)
 
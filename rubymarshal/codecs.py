@@ -0,0 +1,298 @@
+"""Codecs for the standard Ruby types that have a native Python equivalent.
+
+=============== ===================================================
+Ruby            Python
+=============== ===================================================
+`Time`          `datetime.datetime` (aware)
+`Date`          `datetime.date`
+`DateTime`      `datetime.datetime` (aware, decoding only)
+`BigDecimal`    `decimal.Decimal`
+`Rational`      `fractions.Fraction`
+`Complex`       `complex`
+`Range`         `range` (`a...b` with integer bounds), or :class:`Range`
+`Set`           `set`
+=============== ===================================================
+
+:func:`install` registers the codecs in a class registry, so that :func:`rubymarshal.reader.loads`
+returns native Python values. :class:`CodecWriter` writes these values back.
+
+.. code-block:: python
+
+  from rubymarshal.codecs import CodecWriter, install
+  from rubymarshal.reader import loads
+  from rubymarshal.writer import writes
+  install()
+  entry = loads(data)
+  data = writes(entry, cls=CodecWriter)
+
+Naive `datetime` values are written as UTC times. Sub-microsecond parts of times are discarded.
+"""
+
+import datetime
+import decimal
+import fractions
+import struct
+
+from rubymarshal.classes import (
+    DefaultHash,
+    RubyObject,
+    RubyString,
+    UserDef,
+    UsrMarshal,
+)
+from rubymarshal.classes import registry as global_registry
+from rubymarshal.writer import Writer
+
+__author__ = "Matthieu Gallet"
+
+_time_struct = struct.Struct("<II")
+# Julian day number of 0001-01-01 minus one
+_JD_OFFSET = 1721425
+# Julian day number of the calendar reform in Italy (default start of `Date` and `DateTime`)
+_ITALY = 2299161.0
+
+
+class Time(UserDef):
+    """`_dump` format: two little-endian 32-bit words with the broken-down UTC time,
+    and the UTC offset and time zone as instance variables"""
+
+    ruby_class_name = "Time"
+
+    def to_python(self):
+        # noinspection PyProtectedMember
+        high, low = _time_struct.unpack(self._dump())
+        if not high & (1 << 31):
+            # dumped by Ruby < 1.8: seconds since the epoch
+            value = datetime.datetime.fromtimestamp(high, datetime.timezone.utc)
+            return value.replace(microsecond=low)
+        value = datetime.datetime(
+            ((high >> 14) & 0xFFFF) + 1900,
+            ((high >> 10) & 0xF) + 1,
+            (high >> 5) & 0x1F,
+            high & 0x1F,
+            (low >> 26) & 0x3F,
+            (low >> 20) & 0x3F,
+            low & 0xFFFFF,
+            datetime.timezone.utc,
+        )
+        offset = self.attributes.get("offset")
+        if offset is not None and not high & (1 << 30):
+            timezone = datetime.timezone(datetime.timedelta(seconds=offset))
+            value = value.astimezone(timezone)
+        return value
+
+    @classmethod
+    def from_python(cls, value):
+        offset = value.utcoffset()
+        if offset is None:
+            utc = value
+        else:
+            utc = (value - offset).replace(tzinfo=None)
+        if not 1900 <= utc.year < 1900 + 0x10000:
+            raise ValueError("%r: year out of range" % value)
+        is_utc = offset is None or value.tzinfo is datetime.timezone.utc
+        high = (
+            (1 << 31)
+            | (is_utc << 30)
+            | ((utc.year - 1900) << 14)
+            | ((utc.month - 1) << 10)
+            | (utc.day << 5)
+            | utc.hour
+        )
+        low = (utc.minute << 26) | (utc.second << 20) | utc.microsecond
+        if is_utc:
+            attributes = {"zone": RubyString("UTC", {"E": False})}
+        else:
+            attributes = {"offset": int(offset.total_seconds()), "zone": None}
+        result = cls(cls.ruby_class_name, attributes)
+        result._load(_time_struct.pack(high, low))
+        return result
+
+
+class BigDecimal(UserDef):
+    """`_dump` format: `precision:value`, like `18:0.1e1`"""
+
+    ruby_class_name = "BigDecimal"
+
+    def to_python(self):
+        # noinspection PyProtectedMember
+        text = self._dump().partition(b":")[2]
+        return decimal.Decimal(text.decode("ascii"))
+
+    @classmethod
+    def from_python(cls, value):
+        precision = 9
+        if value.is_nan():
+            text = "NaN"
+        elif value.is_infinite():
+            text = "-Infinity" if value < 0 else "Infinity"
+        else:
+            sign, digits, exponent = value.as_tuple()
+            exponent += len(digits)
+            digits = "".join(str(x) for x in digits).rstrip("0")
+            if digits:
+                text = "0.%se%d" % (digits, exponent)
+            else:
+                text = "0.0"
+            if sign:
+                text = "-" + text
+            precision = 9 * (max(1, -(-len(digits) // 9)) + 1)
+        result = cls(cls.ruby_class_name)
+        result._load(b"%d:%s" % (precision, text.encode("ascii")))
+        return result
+
+
+class Rational(UsrMarshal):
+    """`marshal_dump` format: `[numerator, denominator]`"""
+
+    ruby_class_name = "Rational"
+
+    def to_python(self):
+        numerator, denominator = self.marshal_dump()
+        return fractions.Fraction(numerator, denominator)
+
+    @classmethod
+    def from_python(cls, value):
+        result = cls(cls.ruby_class_name)
+        result.marshal_load([value.numerator, value.denominator])
+        return result
+
+
+class Complex(UsrMarshal):
+    """`marshal_dump` format: `[real, imaginary]`"""
+
+    ruby_class_name = "Complex"
+
+    def to_python(self):
+        real, imag = self.marshal_dump()
+        return complex(float(real), float(imag))
+
+    @classmethod
+    def from_python(cls, value):
+        result = cls(cls.ruby_class_name)
+        result.marshal_load([value.real, value.imag])
+        return result
+
+
+class Date(UsrMarshal):
+    """`marshal_dump` format: `[nth, jd, df, sf, of, sg]` (see :class:`DateTime`)"""
+
+    ruby_class_name = "Date"
+
+    def to_python(self):
+        return datetime.date.fromordinal(self.marshal_dump()[1] - _JD_OFFSET)
+
+    @classmethod
+    def from_python(cls, value):
+        result = cls(cls.ruby_class_name)
+        result.marshal_load([0, value.toordinal() + _JD_OFFSET, 0, 0, 0, _ITALY])
+        return result
+
+
+class DateTime(UsrMarshal):
+    """`marshal_dump` format: `[nth, jd, df, sf, of, sg]`, with the Julian day number `jd`,
+    the UTC seconds `df` and nanoseconds `sf` in this day, and the UTC offset `of` in seconds"""
+
+    ruby_class_name = "DateTime"
+
+    def to_python(self):
+        nth, jd, df, sf, of, sg = self.marshal_dump()
+        value = datetime.datetime.combine(
+            datetime.date.fromordinal(jd - _JD_OFFSET),
+            datetime.time(),
+            datetime.timezone.utc,
+        )
+        value += datetime.timedelta(seconds=df, microseconds=int(sf) // 1000)
+        return value.astimezone(datetime.timezone(datetime.timedelta(seconds=of)))
+
+
+class Range(RubyObject):
+    """range that has no `range` equivalent: bounds that are not both integers (`begin` or `end` may be `None`),
+    or an inclusive range like `1..10` (written back as it is)"""
+
+    ruby_class_name = "Range"
+
+    @property
+    def begin(self):
+        return self.attributes.get("begin")
+
+    @property
+    def end(self):
+        return self.attributes.get("end")
+
+    @property
+    def exclude_end(self):
+        return bool(self.attributes.get("excl"))
+
+    def to_python(self):
+        begin, end = self.begin, self.end
+        if type(begin) is int and type(end) is int and self.exclude_end:
+            return range(begin, end)
+        return self
+
+    @classmethod
+    def from_python(cls, value):
+        if value.step not in (None, 1):
+            raise ValueError("%r: only ranges with a step of 1 can be written" % value)
+        return cls(
+            cls.ruby_class_name,
+            {"excl": True, "begin": value.start, "end": value.stop},
+        )
+
+
+class Set(RubyObject):
+    """`@hash` maps each element to `true`"""
+
+    ruby_class_name = "Set"
+
+    def to_python(self):
+        return set(self.attributes["@hash"])
+
+    @classmethod
+    def from_python(cls, value):
+        elements = DefaultHash({x: True for x in value}, default=False)
+        return cls(cls.ruby_class_name, {"@hash": elements})
+
+
+CODECS = [Time, BigDecimal, Rational, Complex, Date, DateTime, Range, Set]
+
+# Python type -> codec (`datetime` must be checked before `date`)
+PYTHON_CODECS = [
+    (datetime.datetime, Time),
+    (datetime.date, Date),
+    (decimal.Decimal, BigDecimal),
+    (fractions.Fraction, Rational),
+    (complex, Complex),
+    ((range, slice), Range),
+    ((set, frozenset), Set),
+]
+
+
+def install(registry=None):
+    """register the codecs
+
+    :param registry: class registry to use instead of the global one
+    """
+    registry = global_registry if registry is None else registry
+    for cls in CODECS:
+        registry.register(cls)
+
+
+class CodecWriter(Writer):
+    """Writer that also writes the Python values of :data:`PYTHON_CODECS`"""
+
+    def __init__(self, fd, **kwargs):
+        super().__init__(fd, **kwargs)
+        # {id(value): (value, Ruby object)}: values are kept alive so that their id is not reused
+        self.converted = {}
+
+    def write_python_object(self, obj):
+        converted = self.converted.get(id(obj))
+        if converted is None:
+            for python_type, codec in PYTHON_CODECS:
+                if isinstance(obj, python_type):
+                    break
+            else:
+                return super().write_python_object(obj)
+            converted = self.converted[id(obj)] = (obj, codec.from_python(obj))
+        self.write(converted[1])
@@ -0,0 +1,290 @@
+"""SAX-style tokenizer, to process arbitrarily large documents in constant memory.
+
+:func:`iter_events` yields an :class:`Event` for each token of the document, without building the object graph.
+Only the names of the symbols and a stack of the open containers are kept in memory.
+
+.. code-block:: python
+
+  from rubymarshal.events import iter_events, FIXNUM
+  with open("huge_dump.bin", "rb") as fd:
+      total = sum(event.value for event in iter_events(fd) if event.kind == FIXNUM)
+
+Containers are opened by a `start_*` event and closed by an `END` event.
+A value with instance variables (`I` prefix) is followed by an `IVAR` event (with the number of variables),
+then by the name (`SYMBOL` or `SYMLINK`) and value of each variable, and finally by an `END` event.
+The attributes of `START_OBJECT` and `START_STRUCT` are given in the same way, before their `END` event.
+"""
+
+from collections import namedtuple
+
+from rubymarshal.constants import (
+    TYPE_ARRAY,
+    TYPE_BIGNUM,
+    TYPE_CLASS,
+    TYPE_DATA,
+    TYPE_EXTENDED,
+    TYPE_FALSE,
+    TYPE_FIXNUM,
+    TYPE_FLOAT,
+    TYPE_HASH,
+    TYPE_HASH_DEF,
+    TYPE_IVAR,
+    TYPE_LINK,
+    TYPE_MODULE,
+    TYPE_MODULE_OLD,
+    TYPE_NIL,
+    TYPE_OBJECT,
+    TYPE_REGEXP,
+    TYPE_STRING,
+    TYPE_STRUCT,
+    TYPE_SYMBOL,
+    TYPE_SYMLINK,
+    TYPE_TRUE,
+    TYPE_UCLASS,
+    TYPE_USERDEF,
+    TYPE_USRMARSHAL,
+)
+
+__author__ = "Matthieu Gallet"
+
+Event = namedtuple("Event", ["kind", "value", "index", "offset"])
+Event.__doc__ = """a token of a Marshal document
+
+:param kind: one of the constants of this module
+:param value: value of the token (see below)
+:param index: object index for values that can be the destination of a link,
+    symbol index for `SYMBOL` and `SYMLINK`, `None` otherwise
+:param offset: position of the token in the document (`END` events are located just after the closed value)
+"""
+
+# value: None, True or False
+NIL = "nil"
+TRUE = "true"
+FALSE = "false"
+# value: int
+FIXNUM = "fixnum"
+BIGNUM = "bignum"
+# value: float
+FLOAT = "float"
+# value: raw bytes (its encoding is given by the following instance variables)
+STRING = "string"
+# value: (raw source, options)
+REGEXP = "regexp"
+# value: name of the symbol (str)
+SYMBOL = "symbol"
+SYMLINK = "symlink"
+# value: index of the linked object
+LINK = "link"
+# value: number of elements (hashes have two values per element, followed by the default value for `HASH_DEF`)
+START_ARRAY = "start_array"
+START_HASH = "start_hash"
+START_HASH_DEF = "start_hash_def"
+# value: (class name, number of attributes)
+START_OBJECT = "start_object"
+START_STRUCT = "start_struct"
+# value: (class name, raw data)
+USERDEF = "userdef"
+# value: class name (followed by a single value)
+START_USRMARSHAL = "start_usrmarshal"
+START_DATA = "start_data"
+START_UCLASS = "start_uclass"
+START_EXTENDED = "start_extended"
+# value: class or module name
+CLASS = "class"
+MODULE = "module"
+# value: number of instance variables
+IVAR = "ivar"
+# value: None
+END = "end"
+
+# kind of the open frames
+_CONTAINER = 0
+_WRAPPED = 1
+
+
+class EventReader:
+    """iterate over the events of a single document
+
+    `position` is the number of bytes read so far (including the `\x04\x08` header).
+
+    :param fd: the file object
+    :param header: if False, the header has already been read
+    """
+
+    def __init__(self, fd, header=True):
+        self.fd = fd
+        self.header = header
+        self.position = 0 if header else 2
+        self.symbols = []
+        self.object_count = 0
+
+    def read(self, size):
+        data = self.fd.read(size)
+        if len(data) != size:
+            raise ValueError("unexpected end of data at offset %d" % self.position)
+        self.position += size
+        return data
+
+    def read_long(self):
+        length = self.read(1)[0]
+        if length > 127:
+            length -= 256
+        if length == 0:
+            return 0
+        if 5 < length < 128:
+            return length - 5
+        elif -129 < length < -5:
+            return length + 5
+        size = abs(length)
+        result = int.from_bytes(self.read(size), "little")
+        if length < 0:
+            result -= 1 << (8 * size)
+        return result
+
+    def read_blob(self):
+        return self.read(self.read_long())
+
+    def read_symbol(self):
+        """read a symbol used as class name, and return its name"""
+        token = self.read(1)
+        if token == TYPE_SYMBOL:
+            name = self.read_blob().decode("utf-8")
+            self.symbols.append(name)
+            return name
+        elif token == TYPE_SYMLINK:
+            return self.get_symbol(self.read_long())
+        raise ValueError("error while reading symbol with token %r" % token)
+
+    def get_symbol(self, symlink_id):
+        if not 0 <= symlink_id < len(self.symbols):
+            raise ValueError("invalid symlink destination: %d" % symlink_id)
+        return self.symbols[symlink_id]
+
+    def new_object(self):
+        self.object_count += 1
+        return self.object_count - 1
+
+    def __iter__(self):
+        if self.header and self.read(2) != b"\x04\x08":
+            raise ValueError(r"Expected header \x04\x08")
+        # each frame is [number of remaining values, frame kind]
+        stack = []
+        while True:
+            offset = self.position
+            token = self.read(1)
+            complete = True
+            if token == TYPE_NIL:
+                yield Event(NIL, None, None, offset)
+            elif token == TYPE_TRUE:
+                yield Event(TRUE, True, None, offset)
+            elif token == TYPE_FALSE:
+                yield Event(FALSE, False, None, offset)
+            elif token == TYPE_FIXNUM:
+                yield Event(FIXNUM, self.read_long(), None, offset)
+            elif token == TYPE_SYMBOL:
+                name = self.read_blob().decode("utf-8")
+                self.symbols.append(name)
+                yield Event(SYMBOL, name, len(self.symbols) - 1, offset)
+            elif token == TYPE_SYMLINK:
+                symlink_id = self.read_long()
+                yield Event(SYMLINK, self.get_symbol(symlink_id), symlink_id, offset)
+            elif token == TYPE_LINK:
+                link_id = self.read_long()
+                if not 0 <= link_id < self.object_count:
+                    raise ValueError("invalid link destination: %d" % link_id)
+                yield Event(LINK, link_id, None, offset)
+            elif token == TYPE_STRING:
+                index = self.new_object()
+                yield Event(STRING, self.read_blob(), index, offset)
+            elif token == TYPE_FLOAT:
+                index = self.new_object()
+                value = float(self.read_blob().split(b"\0")[0].decode("utf-8"))
+                yield Event(FLOAT, value, index, offset)
+            elif token == TYPE_BIGNUM:
+                index = self.new_object()
+                sign = 1 if self.read(1) == b"+" else -1
+                value = int.from_bytes(self.read(2 * self.read_long()), "little")
+                yield Event(BIGNUM, sign * value, index, offset)
+            elif token == TYPE_REGEXP:
+                index = self.new_object()
+                source = self.read_blob()
+                options = self.read(1)[0]
+                yield Event(REGEXP, (source, options), index, offset)
+            elif token == TYPE_USERDEF:
+                index = self.new_object()
+                class_name = self.read_symbol()
+                yield Event(USERDEF, (class_name, self.read_blob()), index, offset)
+            elif token in (TYPE_CLASS, TYPE_MODULE, TYPE_MODULE_OLD):
+                index = self.new_object()
+                name = self.read_blob().decode("utf-8")
+                kind = CLASS if token == TYPE_CLASS else MODULE
+                yield Event(kind, name, index, offset)
+            elif token in (TYPE_ARRAY, TYPE_HASH, TYPE_HASH_DEF):
+                index = self.new_object()
+                count = self.read_long()
+                if token == TYPE_ARRAY:
+                    kind, values = START_ARRAY, count
+                elif token == TYPE_HASH:
+                    kind, values = START_HASH, 2 * count
+                else:
+                    kind, values = START_HASH_DEF, 2 * count + 1
+                yield Event(kind, count, index, offset)
+                if values:
+                    stack.append([values, _CONTAINER])
+                    complete = False
+                else:
+                    yield Event(END, None, None, self.position)
+            elif token in (TYPE_OBJECT, TYPE_STRUCT):
+                index = self.new_object()
+                class_name = self.read_symbol()
+                count = self.read_long()
+                kind = START_OBJECT if token == TYPE_OBJECT else START_STRUCT
+                yield Event(kind, (class_name, count), index, offset)
+                if count:
+                    stack.append([2 * count, _CONTAINER])
+                    complete = False
+                else:
+                    yield Event(END, None, None, self.position)
+            elif token in (TYPE_USRMARSHAL, TYPE_DATA):
+                index = self.new_object()
+                class_name = self.read_symbol()
+                kind = START_USRMARSHAL if token == TYPE_USRMARSHAL else START_DATA
+                yield Event(kind, class_name, index, offset)
+                stack.append([1, _CONTAINER])
+                complete = False
+            elif token in (TYPE_UCLASS, TYPE_EXTENDED):
+                class_name = self.read_symbol()
+                kind = START_UCLASS if token == TYPE_UCLASS else START_EXTENDED
+                yield Event(kind, class_name, None, offset)
+                stack.append([1, _CONTAINER])
+                complete = False
+            elif token == TYPE_IVAR:
+                stack.append([1, _WRAPPED])
+                complete = False
+            else:
+                raise ValueError("token %r is not recognized" % token)
+            while complete and stack:
+                frame = stack[-1]
+                frame[0] -= 1
+                if frame[0]:
+                    complete = False
+                elif frame[1] == _WRAPPED:
+                    offset = self.position
+                    count = self.read_long()
+                    yield Event(IVAR, count, None, offset)
+                    if count:
+                        frame[:] = [2 * count, _CONTAINER]
+                        complete = False
+                    else:
+                        stack.pop()
+                        yield Event(END, None, None, self.position)
+                else:
+                    stack.pop()
+                    yield Event(END, None, None, self.position)
+            if complete:
+                return
+
+
+def iter_events(fd):
+    """iterate over the events of a single document read from a file object"""
+    return iter(EventReader(fd))
@@ -0,0 +1,304 @@
+"""Structural fingerprint of a document, computed from its bytes without building Python objects.
+
+Two documents have the same fingerprint when they encode equal values, even if they were written
+by different writers:
+
+  * symlinks are replaced by the name of their symbol, and links by the value of their target,
+  * integers are hashed by value (fixnum or bignum), floats by their shortest text,
+  * instance variables are hashed in any order, hash pairs too (unless `ordered` is True).
+
+.. code-block:: python
+
+  from rubymarshal.fingerprint import fingerprint
+  key = fingerprint(data).hex()
+
+A link to an object that is still being read (a cycle) is hashed as the distance to this object.
+
+Each value is read once by Python code: computing a fingerprint costs a bit more than
+:func:`rubymarshal.writer.writes` of the same value, but less than :func:`rubymarshal.reader.loads`.
+"""
+
+from hashlib import blake2b
+
+from rubymarshal.scanner import (
+    ARRAY,
+    BIGNUM,
+    CLASS,
+    DATA,
+    EXTENDED,
+    FALSE,
+    FIXNUM,
+    FLOAT,
+    HASH,
+    HASH_DEF,
+    IVAR,
+    LINK,
+    MODULE,
+    MODULE_OLD,
+    NIL,
+    OBJECT,
+    REGEXP,
+    STRING,
+    STRUCT,
+    SYMBOL,
+    SYMLINK,
+    TRUE,
+    UCLASS,
+    USERDEF,
+    USRMARSHAL,
+    Scanner,
+    skip_header,
+)
+from rubymarshal.writer import float_text
+
+__author__ = "Matthieu Gallet"
+
+# larger blobs are replaced by their digest
+_BLOB_LIMIT = 32
+_DIGEST_SIZE = 16
+
+
+def blob(tag, data):
+    """return the representation of a raw byte string"""
+    if len(data) <= _BLOB_LIMIT:
+        return b"%s%d:%s" % (tag, len(data), data)
+    return b"%s%d#%s" % (
+        tag,
+        len(data),
+        blake2b(data, digest_size=_DIGEST_SIZE).digest(),
+    )
+
+
+def digest(tag, parts):
+    """return the representation of a value made of other ones"""
+    return tag + blake2b(b"".join(parts), digest_size=_DIGEST_SIZE).digest()
+
+
+class Fingerprinter(Scanner):
+    """scanner that returns a representation of each value, independent of the layout of the document
+
+    Each representation is a short byte string that delimits itself.
+
+    :param ordered: if True, the order of hash pairs is taken into account
+    """
+
+    def __init__(self, buffer, offset=0, ordered=False):
+        super().__init__(buffer, offset)
+        self.ordered = ordered
+        # representation of each object, or the depth of the object while it is being read
+        self.values = []
+        # representation of each symbol
+        self.symbol_values = []
+        # number of open arrays, hashes and objects
+        self.depth = 0
+
+    def register_object(self, start):
+        # only called by Scanner.skip_symbol, for the instance variables of symbols
+        self.values.append(self.depth)
+        super().register_object(start)
+
+    def read_size(self, position):
+        """read a length at `position` and return it with the position of the next token"""
+        size = self.buffer[position]
+        if 5 < size < 128:
+            return size - 5, position + 1
+        self.position = position
+        size = self.read_long()
+        if size < 0:
+            raise ValueError("invalid length %d at offset %d" % (size, position))
+        return size, self.position
+
+    def read_bytes(self):
+        size, position = self.read_size(self.position)
+        end = position + size
+        if end > len(self.buffer):
+            raise ValueError("invalid length %d at offset %d" % (size, position))
+        self.position = end
+        return bytes(self.buffer[position:end])
+
+    def read_symbol(self):
+        token = self.buffer[self.position]
+        if token == SYMBOL:
+            self.position += 1
+            name = self.read_bytes()
+            self.symbols.append(name)
+            result = blob(b":", name)
+            self.symbol_values.append(result)
+            return result
+        elif token == SYMLINK:
+            symlink_id, self.position = self.read_size(self.position + 1)
+            if symlink_id >= len(self.symbol_values):
+                raise ValueError("invalid symlink destination: %d" % symlink_id)
+            return self.symbol_values[symlink_id]
+        # symbols with instance variables are rare
+        symbol_id = self.skip_symbol()
+        symbol_values = self.symbol_values
+        symbol_values += [blob(b":", x) for x in self.symbols[len(symbol_values) :]]
+        return symbol_values[symbol_id]
+
+    def read_attributes(self, ordered=False):
+        """read instance variables (or struct members) and return their representations"""
+        count, self.position = self.read_size(self.position)
+        if count == 1:
+            # most frequent case: the encoding of a string
+            return [self.read_symbol() + self.walk()]
+        pairs = [self.read_symbol() + self.walk() for x in range(count)]
+        if not ordered:
+            pairs.sort()
+        return pairs
+
+    def begin_object(self):
+        """register a new object and return its index"""
+        values = self.values
+        values.append(self.depth)
+        self.object_count += 1
+        return len(values) - 1
+
+    def walk(self):
+        """read a value and return its representation"""
+        values = self.values
+        position = self.position
+        token = self.buffer[position]
+        self.position = position + 1
+        if token == SYMLINK:
+            symlink_id = self.buffer[position + 1]
+            if 5 < symlink_id < 128 and symlink_id - 5 < len(self.symbol_values):
+                self.position = position + 2
+                return self.symbol_values[symlink_id - 5]
+            self.position = position
+            return self.read_symbol()
+        elif token == IVAR:
+            index = len(values)
+            value = self.walk()
+            attributes = self.read_attributes()
+            result = b"I%d;%s%s" % (len(attributes), value, b"".join(attributes))
+            if len(values) > index:
+                # the instance variables are part of the object
+                values[index] = result
+            return result
+        elif token == STRING:
+            self.object_count += 1
+            size = self.buffer[position + 1] - 5
+            if 0 < size <= _BLOB_LIMIT:
+                # most frequent case: a short string
+                end = position + 2 + size
+                if end > len(self.buffer):
+                    raise ValueError("unexpected end of data at offset %d" % end)
+                self.position = end
+                result = b'"%d:%s' % (size, self.buffer[position + 2 : end])
+            else:
+                result = blob(b'"', self.read_bytes())
+            values.append(result)
+            return result
+        elif token == FIXNUM:
+            value = self.buffer[position + 1]
+            if 5 < value < 128:
+                self.position = position + 2
+                return b"i%d;" % (value - 5)
+            elif 0 < value < 4:
+                # positive integer on 1 to 3 bytes
+                end = position + 2 + value
+                if end > len(self.buffer):
+                    raise ValueError("unexpected end of data at offset %d" % end)
+                self.position = end
+                value = int.from_bytes(self.buffer[position + 2 : end], "little")
+                return b"i%d;" % value
+            return b"i%d;" % self.read_long()
+        elif token == SYMBOL:
+            self.position = position
+            return self.read_symbol()
+        elif token == NIL or token == TRUE or token == FALSE:
+            return bytes([token])
+        elif token == LINK:
+            link_id = self.read_long()
+            if not 0 <= link_id < len(values):
+                raise ValueError("invalid link destination: %d" % link_id)
+            value = values[link_id]
+            if isinstance(value, int):
+                return b"^%d;" % (self.depth - value)
+            return value
+        elif token == ARRAY or token == HASH or token == HASH_DEF:
+            index = self.begin_object()
+            count, self.position = self.read_size(self.position)
+            self.depth += 1
+            if token == ARRAY:
+                items = [self.walk() for x in range(count)]
+            else:
+                items = [self.walk() + self.walk() for x in range(count)]
+                if not self.ordered:
+                    items.sort()
+                if token == HASH_DEF:
+                    items.append(self.walk())
+            self.depth -= 1
+            result = values[index] = digest(bytes([token]), items)
+            return result
+        elif token == FLOAT:
+            index = self.begin_object()
+            # Ruby < 1.9 appended the mantissa after a NUL byte
+            text = self.read_bytes().partition(b"\0")[0]
+            result = values[index] = b"f%s;" % float_text(float(text)).encode()
+            return result
+        elif token == OBJECT or token == STRUCT:
+            index = self.begin_object()
+            name = self.read_symbol()
+            self.depth += 1
+            members = self.read_attributes(ordered=token == STRUCT)
+            self.depth -= 1
+            result = values[index] = digest(bytes([token]), [name] + members)
+            return result
+        elif token == USRMARSHAL or token == DATA:
+            index = self.begin_object()
+            name = self.read_symbol()
+            self.depth += 1
+            value = self.walk()
+            self.depth -= 1
+            result = values[index] = digest(bytes([token]), [name, value])
+            return result
+        elif token == USERDEF:
+            index = self.begin_object()
+            name = self.read_symbol()
+            result = values[index] = digest(b"u", [name, blob(b"", self.read_bytes())])
+            return result
+        elif token == UCLASS or token == EXTENDED:
+            name = self.read_symbol()
+            index = len(values)
+            result = digest(bytes([token]), [name, self.walk()])
+            if len(values) > index:
+                values[index] = result
+            return result
+        elif token == BIGNUM:
+            index = self.begin_object()
+            sign = self.read_byte()
+            size = 2 * self.read_long()
+            start = self.skip_bytes(size)
+            value = int.from_bytes(self.buffer[start : start + size], "little")
+            sign = b"-" if sign == ord("-") else b""
+            result = values[index] = b"i%s%d;" % (sign, value)
+            return result
+        elif token == REGEXP:
+            index = self.begin_object()
+            source = self.read_bytes()
+            result = values[index] = blob(b"/%d," % self.read_byte(), source)
+            return result
+        elif token == CLASS or token == MODULE or token == MODULE_OLD:
+            index = self.begin_object()
+            result = values[index] = blob(bytes([token]), self.read_bytes())
+            return result
+        raise ValueError("token %r is not recognized" % bytes([token]))
+
+
+def fingerprint(buffer, offset=0, ordered=False, digest_size=32):
+    """return a BLAKE2b digest of the values of a document, independent of its symbols and links
+
+    :param buffer: bytes-like object (`bytes`, `mmap`, ...)
+    :param offset: offset of the document (its `\\x04\\x08` header)
+    :param ordered: if True, the order of hash pairs is taken into account
+    :param digest_size: size of the digest in bytes (at most 64)
+    :rtype: bytes
+    """
+    scanner = Fingerprinter(buffer, skip_header(buffer, offset), ordered=ordered)
+    try:
+        value = scanner.walk()
+    except IndexError:
+        raise ValueError("unexpected end of data") from None
+    return blake2b(value, digest_size=digest_size).digest()
@@ -0,0 +1,343 @@
+"""Random access to the elements of a huge top-level array or hash.
+
+The document is scanned once (without building any Python object) to record the offset of each
+top-level element, and the state of the symbol and object tables at this offset.
+This index is stored in a sidecar file, so any element can be later decoded in O(element) time:
+
+.. code-block:: python
+
+  from rubymarshal.index import IndexedDocument
+  with IndexedDocument("huge_array.bin") as document:
+      print(len(document), document[1234567])
+
+Links and symlinks to values that are stored before the element are resolved by lazily decoding these values.
+"""
+
+import array
+import bisect
+import mmap
+import os
+import struct
+import sys
+from hashlib import blake2b
+
+from rubymarshal.classes import Symbol
+from rubymarshal.constants import TYPE_ARRAY, TYPE_HASH
+from rubymarshal.reader import BufferReader, Reader, loads
+from rubymarshal.scanner import Scanner, skip_header
+from rubymarshal.writer import writes
+
+__author__ = "Matthieu Gallet"
+
+INDEX_SUFFIX = ".index"
+INDEX_MAGIC = b"RBMIDX02"
+# magic, kind, document offset, number of items, number of link targets, size of the symbol table,
+# size of the document, checksum of the document
+INDEX_HEADER = struct.Struct("<8sQQQQQQ16s")
+# number of bytes that are hashed at each end of the document
+CHECKSUM_SPAN = 64 * 1024
+KIND_ARRAY = 0
+KIND_HASH = 1
+
+
+def to_array(values):
+    """convert a sequence of integers to a little-endian array of 64-bit unsigned integers"""
+    result = array.array("Q", values)
+    if sys.byteorder == "big":
+        result.byteswap()
+    return result
+
+
+def from_buffer(buffer, start, count):
+    """return a read-only view on `count` little-endian 64-bit unsigned integers, without copying them when possible"""
+    end = start + 8 * count
+    if sys.byteorder == "little":
+        return memoryview(buffer)[start:end].cast("Q")
+    result = array.array("Q", bytes(buffer[start:end]))
+    result.byteswap()
+    return result
+
+
+def document_checksum(buffer, offset, size):
+    """return a digest of the first and last bytes of a document, to detect a document that has been rewritten"""
+    end = offset + size
+    checksum = blake2b(digest_size=16)
+    checksum.update(b"%d;" % size)
+    checksum.update(buffer[offset : min(end, offset + CHECKSUM_SPAN)])
+    checksum.update(buffer[max(offset, end - CHECKSUM_SPAN) : end])
+    return checksum.digest()
+
+
+class DocumentIndex:
+    """offsets of the top-level elements of a document
+
+    For a hash, keys and values are both stored as items (`2 * n` items for `n` pairs).
+
+    :param kind: `KIND_ARRAY` or `KIND_HASH`
+    :param offset: offset of the document (its `\\x04\\x08` header) in the file
+    :param offsets: offset of each item
+    :param bases: number of objects that are stored before each item
+    :param target_ids: ordered indices of the objects that are the destination of a link
+    :param target_offsets: offsets of these objects
+    :param symbols: raw names of all the symbols of the document
+    :param size: size of the document in bytes
+    :param checksum: digest of the document (see :func:`document_checksum`)
+    """
+
+    def __init__(
+        self,
+        kind,
+        offset,
+        offsets,
+        bases,
+        target_ids,
+        target_offsets,
+        symbols,
+        size=0,
+        checksum=b"",
+    ):
+        self.kind = kind
+        self.offset = offset
+        self.offsets = offsets
+        self.bases = bases
+        self.target_ids = target_ids
+        self.target_offsets = target_offsets
+        self.symbols = symbols
+        self.size = size
+        self.checksum = checksum
+
+    def __len__(self):
+        if self.kind == KIND_HASH:
+            return len(self.offsets) // 2
+        return len(self.offsets)
+
+    def save(self, path):
+        symbols = writes(self.symbols)
+        with open(path, "wb") as fd:
+            fd.write(
+                INDEX_HEADER.pack(
+                    INDEX_MAGIC,
+                    self.kind,
+                    self.offset,
+                    len(self.offsets),
+                    len(self.target_ids),
+                    len(symbols),
+                    self.size,
+                    self.checksum,
+                )
+            )
+            for values in (
+                self.offsets,
+                self.bases,
+                self.target_ids,
+                self.target_offsets,
+            ):
+                fd.write(to_array(values).tobytes())
+            fd.write(symbols)
+
+    @classmethod
+    def load(cls, buffer):
+        """read an index from a bytes-like object (its arrays are not copied on little-endian platforms)"""
+        (
+            magic,
+            kind,
+            offset,
+            item_count,
+            target_count,
+            symbols_size,
+            size,
+            checksum,
+        ) = INDEX_HEADER.unpack_from(buffer, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError("invalid index file")
+        start = INDEX_HEADER.size
+        offsets = from_buffer(buffer, start, item_count)
+        start += 8 * item_count
+        bases = from_buffer(buffer, start, item_count)
+        start += 8 * item_count
+        target_ids = from_buffer(buffer, start, target_count)
+        start += 8 * target_count
+        target_offsets = from_buffer(buffer, start, target_count)
+        start += 8 * target_count
+        symbols = loads(bytes(buffer[start : start + symbols_size]))
+        return cls(
+            kind,
+            offset,
+            offsets,
+            bases,
+            target_ids,
+            target_offsets,
+            symbols,
+            size=size,
+            checksum=checksum,
+        )
+
+    def matches(self, buffer, offset=0):
+        """return True if this index has been built for the document stored at `offset` in `buffer`"""
+        return (
+            self.offset == offset
+            and offset + self.size <= len(buffer)
+            and document_checksum(buffer, offset, self.size) == self.checksum
+        )
+
+
+def build_index(buffer, offset=0):
+    """scan a document whose top-level value is an array or a hash
+
+    :param buffer: bytes-like object (`bytes`, `mmap`, ...)
+    :param offset: offset of the document (its `\\x04\\x08` header)
+    :rtype: :class:`DocumentIndex`
+    """
+    start = skip_header(buffer, offset)
+    scanner = Scanner(buffer, start + 1, record_offsets=True)
+    token = buffer[start : start + 1]
+    if token == TYPE_ARRAY:
+        kind, values_per_item = KIND_ARRAY, 1
+    elif token == TYPE_HASH:
+        kind, values_per_item = KIND_HASH, 2
+    else:
+        raise ValueError("top-level value must be an array or a hash, not %r" % token)
+    scanner.register_object(start)
+    offsets = array.array("Q")
+    bases = array.array("Q")
+    for x in range(scanner.read_long() * values_per_item):
+        offsets.append(scanner.position)
+        bases.append(scanner.object_count)
+        scanner.skip()
+    target_ids = sorted(scanner.link_targets)
+    target_offsets = [scanner.object_offsets[x] for x in target_ids]
+    size = scanner.position - offset
+    return DocumentIndex(
+        kind,
+        offset,
+        offsets,
+        bases,
+        target_ids,
+        target_offsets,
+        scanner.symbols,
+        size=size,
+        checksum=document_checksum(buffer, offset, size),
+    )
+
+
+class SymbolTable(list):
+    """symbol table that is already filled with all symbols of the document"""
+
+    def append(self, symbol):
+        pass
+
+
+class LazyObjectTable:
+    """object table of a Reader that starts in the middle of a document
+
+    Objects that are stored before `base` are decoded on demand by the :class:`IndexedDocument`.
+    """
+
+    def __init__(self, document, base):
+        self.document = document
+        self.base = base
+        self.objects = []
+
+    def __len__(self):
+        return self.base + len(self.objects)
+
+    def append(self, obj):
+        self.objects.append(obj)
+
+    def __getitem__(self, index):
+        if index >= self.base:
+            return self.objects[index - self.base]
+        return self.document.get_object(index)
+
+    def __setitem__(self, index, obj):
+        self.objects[index - self.base] = obj
+
+
+class IndexedDocument:
+    """random access to the elements of a document whose top-level value is an array or a hash
+
+    The sidecar index is built (and saved) if it does not exist yet.
+    A `ValueError` is raised if the index does not match the document (for example if the document has been
+    rewritten after the creation of its index): delete the index to rebuild it.
+
+    :param path: path of the document
+    :param index_path: path of the sidecar index (default to `path + ".index"`)
+    :param registry: class registry to use instead of the global one
+    :param offset: offset of the document in the file
+    """
+
+    def __init__(self, path, index_path=None, registry=None, offset=0):
+        self.registry = registry
+        index_path = index_path or path + INDEX_SUFFIX
+        with open(path, "rb") as fd:
+            self.buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        if not os.path.exists(index_path):
+            build_index(self.buffer, offset).save(index_path)
+        with open(index_path, "rb") as fd:
+            self.index_buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        self.index = DocumentIndex.load(self.index_buffer)
+        if not self.index.matches(self.buffer, offset):
+            self.close()
+            raise ValueError(
+                "index %r does not match the document %r (delete it to rebuild it)"
+                % (index_path, path)
+            )
+        self.symbols = SymbolTable(
+            Symbol(x.decode("utf-8")) for x in self.index.symbols
+        )
+        self.objects = {}
+
+    def read_at(self, offset, base):
+        reader = Reader(BufferReader(self.buffer, offset), registry=self.registry)
+        reader.symbols = self.symbols
+        reader.objects = LazyObjectTable(self, base)
+        result = reader.read()
+        # keep the objects that may be the destination of a link
+        target_ids = self.index.target_ids
+        first = bisect.bisect_left(target_ids, base)
+        last = bisect.bisect_left(target_ids, len(reader.objects))
+        for x in range(first, last):
+            target_id = target_ids[x]
+            self.objects[target_id] = reader.objects[target_id]
+        return result
+
+    def get_object(self, index):
+        """return the object with the given link index"""
+        if index not in self.objects:
+            target_ids = self.index.target_ids
+            x = bisect.bisect_left(target_ids, index)
+            if x == len(target_ids) or target_ids[x] != index:
+                raise ValueError("object %d is not the destination of a link" % index)
+            self.read_at(self.index.target_offsets[x], index)
+        return self.objects[index]
+
+    def get_item(self, index):
+        return self.read_at(self.index.offsets[index], self.index.bases[index])
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        """return the element `index` of an array, or the pair `(key, value)` of a hash"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("index out of range")
+        if self.index.kind == KIND_HASH:
+            return self.get_item(2 * index), self.get_item(2 * index + 1)
+        return self.get_item(index)
+
+    def __iter__(self):
+        for x in range(len(self)):
+            yield self[x]
+
+    def close(self):
+        self.index = None
+        self.buffer.close()
+        self.index_buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
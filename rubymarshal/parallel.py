@@ -0,0 +1,317 @@
+"""Decode and encode huge top-level arrays (or hashes) with several processes.
+
+The document is first scanned (see :func:`rubymarshal.index.build_index`) to find the offset of each element,
+with the state of the symbol and object tables at this offset.
+Chunks of consecutive elements are then decoded by worker processes.
+Links to objects that are decoded by another worker are replaced by a :class:`LinkPlaceholder`,
+and these placeholders are replaced by the actual objects once all chunks are decoded.
+
+.. code-block:: python
+
+  from rubymarshal.parallel import parallel_load
+  records = parallel_load("huge_array.bin", workers=8)
+
+Workers do not share the global class registry when processes are not forked:
+pass the registry to use (its classes must be importable).
+
+:func:`parallel_writes` encodes chunks of a list in worker processes, each with its own symbol table,
+and then stitches them in a single document: symbols and symlinks are rewritten
+to follow the global order of first occurrence, and links are shifted by the number of previous objects.
+"""
+
+import bisect
+import io
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from rubymarshal.classes import DefaultHash, HashPairs, RubyObject, Symbol
+from rubymarshal.constants import TYPE_ARRAY, TYPE_LINK, TYPE_SYMBOL, TYPE_SYMLINK
+from rubymarshal.index import KIND_HASH, LazyObjectTable, SymbolTable, build_index
+from rubymarshal.reader import BufferReader, Reader
+from rubymarshal.writer import Writer
+
+__author__ = "Matthieu Gallet"
+
+
+class LinkPlaceholder:
+    """link to an object that is decoded by another worker"""
+
+    __slots__ = ("index",)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __reduce__(self):
+        return LinkPlaceholder, (self.index,)
+
+    def __repr__(self):
+        return "LinkPlaceholder(%d)" % self.index
+
+
+class ChunkObjectTable(LazyObjectTable):
+    """object table of a Reader that decodes a chunk: previous objects are replaced by placeholders"""
+
+    def __init__(self, base):
+        super().__init__(None, base)
+        self.placeholders = False
+
+    def __getitem__(self, index):
+        if index >= self.base:
+            return self.objects[index - self.base]
+        self.placeholders = True
+        return LinkPlaceholder(index)
+
+
+def decode_chunk(source, offset, count, base, symbols, target_ids, registry=None):
+    """decode `count` consecutive values
+
+    :param source: path of the document, or bytes starting with the chunk
+    :param offset: offset of the first value in `source`
+    :param count: number of values
+    :param base: number of objects that are stored before the first value
+    :param symbols: raw names of all symbols of the document
+    :param target_ids: objects of the chunk that are the destination of a link
+    :param registry: class registry to use instead of the global one
+    :return: `(values, {object index: object}, indices of the values that contain placeholders)`
+    """
+    buffer = source
+    if not isinstance(source, (bytes, bytearray, memoryview)):
+        with open(source, "rb") as fd:
+            buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        reader = Reader(BufferReader(buffer, offset), registry=registry)
+        reader.symbols = SymbolTable(Symbol(x.decode("utf-8")) for x in symbols)
+        reader.objects = ChunkObjectTable(base)
+        values = []
+        unresolved = []
+        for x in range(count):
+            reader.objects.placeholders = False
+            values.append(reader.read())
+            if reader.objects.placeholders:
+                unresolved.append(x)
+        targets = {x: reader.objects[x] for x in target_ids}
+        return values, targets, unresolved
+    finally:
+        if buffer is not source:
+            buffer.close()
+
+
+def resolve(value, targets, seen):
+    """replace the placeholders of a value (in place for mutable values) and return the resolved value"""
+    if isinstance(value, LinkPlaceholder):
+        return targets[value.index]
+    if id(value) in seen:
+        return value
+    if isinstance(value, list):
+        seen.add(id(value))
+        for x, item in enumerate(value):
+            value[x] = resolve(item, targets, seen)
+    elif isinstance(value, dict):
+        seen.add(id(value))
+        items = [
+            (resolve(k, targets, seen), resolve(v, targets, seen))
+            for (k, v) in value.items()
+        ]
+        value.clear()
+        value.update(items)
+        if isinstance(value, DefaultHash):
+            value.default = resolve(value.default, targets, seen)
+    elif isinstance(value, HashPairs):
+        seen.add(id(value))
+        value.pairs = [
+            (resolve(k, targets, seen), resolve(v, targets, seen))
+            for (k, v) in value.pairs
+        ]
+        value.default = resolve(value.default, targets, seen)
+        value.clear_cache()
+    elif isinstance(value, tuple):
+        value = tuple(resolve(item, targets, seen) for item in value)
+    elif isinstance(value, RubyObject):
+        seen.add(id(value))
+        attributes = vars(value)
+        for key, item in list(attributes.items()):
+            attributes[key] = resolve(item, targets, seen)
+    return value
+
+
+def parallel_load(source, workers=None, chunk_size=None, registry=None, offset=0):
+    """decode a document whose top-level value is an array or a hash, with several processes
+
+    :param source: path of the document (preferred: workers read it directly), or a bytes-like object
+    :param workers: number of worker processes (default to the number of CPUs)
+    :param chunk_size: number of elements decoded by each task (default to split the document in `4 * workers` tasks)
+    :param registry: class registry to use instead of the global one
+    :param offset: offset of the document (its `\\x04\\x08` header)
+    :return: a `list` or a `dict`
+    """
+    workers = workers or os.cpu_count() or 1
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        buffer, path = source, None
+    else:
+        path = os.fspath(source)
+        with open(path, "rb") as fd:
+            buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        index = build_index(buffer, offset)
+        tasks = split_tasks(buffer, path, index, workers, chunk_size, registry)
+    finally:
+        if path is not None:
+            buffer.close()
+    values = []
+    targets = {}
+    unresolved = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_values, chunk_targets, chunk_unresolved in executor.map(
+            decode_chunk, *zip(*tasks)
+        ):
+            unresolved += [len(values) + x for x in chunk_unresolved]
+            values += chunk_values
+            targets.update(chunk_targets)
+    # the top-level container is the first object
+    result = {} if index.kind == KIND_HASH else values
+    targets[0] = result
+    seen = set()
+    for x in unresolved:
+        values[x] = resolve(values[x], targets, seen)
+    if index.kind == KIND_HASH:
+        ensure_hashable = Reader(None, registry=registry).ensure_hashable
+        for x in range(0, len(values), 2):
+            result[ensure_hashable(values[x])] = values[x + 1]
+    return result
+
+
+def split_tasks(buffer, path, index, workers, chunk_size, registry):
+    """return the arguments of :func:`decode_chunk` for each chunk"""
+    item_count = len(index.offsets)
+    if chunk_size is None:
+        chunk_size = -(-item_count // (4 * workers))
+    chunk_size = max(chunk_size, 1)
+    if index.kind == KIND_HASH:
+        # keys and values must be decoded by the same task
+        chunk_size *= 2
+    target_ids = index.target_ids
+    tasks = []
+    for first in range(0, item_count, chunk_size):
+        last = min(first + chunk_size, item_count)
+        start = index.offsets[first]
+        base = index.bases[first]
+        if last < item_count:
+            last_target = bisect.bisect_left(target_ids, index.bases[last])
+        else:
+            last_target = len(target_ids)
+        chunk_targets = list(
+            target_ids[bisect.bisect_left(target_ids, base) : last_target]
+        )
+        if path is None:
+            end = index.offsets[last] if last < item_count else len(buffer)
+            source, offset = bytes(buffer[start:end]), 0
+        else:
+            source, offset = path, start
+        tasks.append(
+            (
+                source,
+                offset,
+                last - first,
+                base,
+                index.symbols,
+                chunk_targets,
+                registry,
+            )
+        )
+    return tasks
+
+
+class ChunkMixin:
+    """record the position of each symbol and link written by a Writer
+
+    `references` is a list of `(start, end, symbol name or None, link index or None)`.
+    """
+
+    def __init__(self, fd, *args, **kwargs):
+        super().__init__(fd, *args, **kwargs)
+        self.references = []
+
+    def write_symbol(self, obj):
+        start = self.fd.tell()
+        super().write_symbol(obj)
+        self.references.append((start, self.fd.tell(), obj.name, None))
+
+    def must_write(self, obj):
+        start = self.fd.tell()
+        if super().must_write(obj):
+            return True
+        self.references.append((start, self.fd.tell(), None, self.objects[id(obj)]))
+        return False
+
+
+def encode_chunk(values, cls=Writer, **kwargs):
+    """encode consecutive values with their own symbol and object tables
+
+    :return: `(data, references, number of objects)` (see :class:`ChunkMixin`)
+    """
+    chunk_cls = type(cls.__name__, (ChunkMixin, cls), {})
+    fd = io.BytesIO()
+    writer = chunk_cls(fd, **kwargs)
+    for value in values:
+        writer.write(value)
+    return fd.getvalue(), writer.references, writer.object_count
+
+
+def parallel_write(fd, obj, workers=None, chunk_size=None, cls=Writer, **kwargs):
+    """write a list with several processes
+
+    Objects that are shared by elements of different chunks are written once per chunk,
+    so the result is a valid document but these objects are no longer identical once decoded.
+
+    :param fd: the file descriptor
+    :param obj: the list to serialize
+    :param workers: number of worker processes (default to the number of CPUs)
+    :param chunk_size: number of elements encoded by each task (default to split the list in `4 * workers` tasks)
+    :param cls: Writer class to use (it must be importable by the workers)
+    :param kwargs: extra arguments of the Writer class
+    """
+    if not isinstance(obj, list):
+        raise ValueError("parallel_write only supports lists, not %r" % type(obj))
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = -(-len(obj) // (4 * workers))
+    chunk_size = max(chunk_size, 1)
+    chunks = [obj[x : x + chunk_size] for x in range(0, len(obj), chunk_size)]
+    writer = Writer(fd)
+    fd.write(b"\x04\x08")
+    fd.write(TYPE_ARRAY)
+    writer.write_long(len(obj))
+    # the top-level array is the first object
+    base = 1
+    symbols = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(partial(encode_chunk, cls=cls, **kwargs), chunks)
+        for data, references, object_count in results:
+            view = memoryview(data)
+            position = 0
+            for start, end, symbol_name, link_index in references:
+                fd.write(view[position:start])
+                position = end
+                if link_index is not None:
+                    fd.write(TYPE_LINK)
+                    writer.write_long(base + link_index)
+                elif symbol_name in symbols:
+                    fd.write(TYPE_SYMLINK)
+                    writer.write_long(symbols[symbol_name])
+                else:
+                    symbols[symbol_name] = len(symbols)
+                    encoded = symbol_name.encode("utf-8")
+                    fd.write(TYPE_SYMBOL)
+                    writer.write_long(len(encoded))
+                    fd.write(encoded)
+            fd.write(view[position:])
+            base += object_count
+
+
+def parallel_writes(obj, workers=None, chunk_size=None, cls=Writer, **kwargs):
+    """write a list to a bytes string with several processes (see :func:`parallel_write`)"""
+    fd = io.BytesIO()
+    parallel_write(fd, obj, workers=workers, chunk_size=chunk_size, cls=cls, **kwargs)
+    return fd.getvalue()
@@ -0,0 +1,265 @@
+"""Opt-in instrumentation of decoding and encoding.
+
+:class:`ProfilingReader` and :class:`ProfilingWriter` record, for each token type and each Ruby class name,
+the number of values, the number of bytes consumed (or produced) and the time spent.
+The default :class:`rubymarshal.reader.Reader` and :class:`rubymarshal.writer.Writer` are not modified,
+so there is no cost when profiling is disabled.
+
+.. code-block:: python
+
+  from rubymarshal.reader import loads
+  from rubymarshal.profiling import ProfilingReader, Stats
+  stats = Stats()
+  obj = loads(data, cls=ProfilingReader, stats=stats)
+  print(stats.report())
+
+Times are given in seconds. `time` includes the nested values, `self_time` does not.
+"""
+
+import time
+
+from rubymarshal.classes import RubyObject, RubyString
+from rubymarshal.constants import TYPES
+from rubymarshal.reader import Reader
+from rubymarshal.writer import Writer
+
+__author__ = "Matthieu Gallet"
+
+
+class Counter:
+    """statistics of a single token type or class name"""
+
+    __slots__ = ("count", "size", "time", "self_time")
+
+    def __init__(self, count=0, size=0, time=0.0, self_time=0.0):
+        self.count = count
+        self.size = size
+        self.time = time
+        self.self_time = self_time
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "size": self.size,
+            "time": self.time,
+            "self_time": self.self_time,
+        }
+
+    def __repr__(self):
+        return "Counter(count=%d, size=%d, time=%f, self_time=%f)" % (
+            self.count,
+            self.size,
+            self.time,
+            self.self_time,
+        )
+
+
+class Stats:
+    """statistics of one or more documents
+
+    `tokens` maps token names (like `"TYPE_ARRAY"`) to :class:`Counter`,
+    `classes` maps Ruby class names to :class:`Counter`.
+    """
+
+    def __init__(self):
+        self.tokens = {}
+        self.classes = {}
+        self.documents = 0
+
+    def add(self, token_name, class_name, size, elapsed, self_elapsed):
+        for table, key in ((self.tokens, token_name), (self.classes, class_name)):
+            if key is None:
+                continue
+            counter = table.get(key)
+            if counter is None:
+                counter = table[key] = Counter()
+            counter.count += 1
+            counter.size += size
+            counter.time += elapsed
+            counter.self_time += self_elapsed
+
+    def merge(self, other):
+        """add the statistics of another :class:`Stats`"""
+        for table, other_table in (
+            (self.tokens, other.tokens),
+            (self.classes, other.classes),
+        ):
+            for key, other_counter in other_table.items():
+                counter = table.get(key)
+                if counter is None:
+                    counter = table[key] = Counter()
+                counter.count += other_counter.count
+                counter.size += other_counter.size
+                counter.time += other_counter.time
+                counter.self_time += other_counter.self_time
+        self.documents += other.documents
+
+    def reset(self):
+        self.tokens.clear()
+        self.classes.clear()
+        self.documents = 0
+
+    def as_dict(self):
+        """return the statistics as a JSON-serializable dict"""
+        return {
+            "documents": self.documents,
+            "tokens": {k: v.as_dict() for (k, v) in self.tokens.items()},
+            "classes": {k: v.as_dict() for (k, v) in self.classes.items()},
+        }
+
+    def report(self):
+        """return a text table, sorted by decreasing self time"""
+        lines = ["%-24s %10s %12s %12s %12s" % ("", "count", "bytes", "time", "self")]
+        for table in (self.tokens, self.classes):
+            for key, counter in sorted(table.items(), key=lambda x: -x[1].self_time):
+                lines.append(
+                    "%-24s %10d %12d %12.6f %12.6f"
+                    % (
+                        key,
+                        counter.count,
+                        counter.size,
+                        counter.time,
+                        counter.self_time,
+                    )
+                )
+        return "\n".join(lines)
+
+
+def token_name(token):
+    return TYPES.get(token, repr(token))
+
+
+def class_name(obj):
+    if isinstance(obj, RubyObject) and not isinstance(obj, RubyString):
+        return obj.ruby_class_name
+    return None
+
+
+class Profiler:
+    """measure the nested calls of a Reader or a Writer"""
+
+    def __init__(self, stats=None, callback=None):
+        self.stats = Stats() if stats is None else stats
+        self.callback = callback
+        # time spent in the nested values of each open value
+        self.children = [0.0]
+
+    def begin(self):
+        self.children.append(0.0)
+        return time.perf_counter()
+
+    def end(self, start, token, obj, size):
+        elapsed = time.perf_counter() - start
+        children = self.children.pop()
+        self.children[-1] += elapsed
+        self.stats.add(
+            token_name(token), class_name(obj), size, elapsed, elapsed - children
+        )
+        if len(self.children) == 1:
+            self.children[0] = 0.0
+            self.stats.documents += 1
+            if self.callback is not None:
+                self.callback(self.stats)
+
+
+class MeteredReader:
+    """file object that counts the read bytes and allows to peek the next byte"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.position = 0
+        self.pending = b""
+
+    def peek(self):
+        if not self.pending:
+            self.pending = self.fd.read(1)
+        return self.pending
+
+    def read(self, size=-1):
+        pending = self.pending
+        if pending:
+            self.pending = b""
+            if size == 1:
+                data = pending
+            elif size < 0:
+                data = pending + self.fd.read()
+            else:
+                data = pending + self.fd.read(size - 1)
+        else:
+            data = self.fd.read(size)
+        self.position += len(data)
+        return data
+
+
+class MeteredWriter:
+    """file object that counts the written bytes and captures the first token of each value"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.position = 0
+        # first token of each value that is being written (`None` until it is written)
+        self.tokens = []
+
+    def write(self, data):
+        tokens = self.tokens
+        if tokens and tokens[-1] is None and data:
+            tokens[-1] = data[:1]
+        self.position += len(data)
+        return self.fd.write(data)
+
+
+class ProfilingReader(Reader):
+    """Reader that records statistics about the decoded values
+
+    :param limits: :class:`rubymarshal.reader.Limits` to apply
+    :param stats: :class:`Stats` to update (a new one is created if not provided)
+    :param callback: function called with the :class:`Stats` after each document
+    :param kwargs: extra arguments of :class:`rubymarshal.reader.Reader` (like hooks)
+    """
+
+    def __init__(
+        self, fd, registry=None, limits=None, stats=None, callback=None, **kwargs
+    ):
+        super().__init__(fd, registry=registry, limits=limits, **kwargs)
+        # after Reader.__init__, that may wrap `fd` to enforce limits
+        self.fd = MeteredReader(self.fd)
+        self.profiler = Profiler(stats, callback)
+
+    @property
+    def stats(self):
+        return self.profiler.stats
+
+    def read(self, in_ivar=False):
+        fd = self.fd
+        token = fd.peek()
+        position = fd.position
+        start = self.profiler.begin()
+        result = super().read(in_ivar=in_ivar)
+        self.profiler.end(start, token, result, fd.position - position)
+        return result
+
+
+class ProfilingWriter(Writer):
+    """Writer that records statistics about the encoded values
+
+    :param stats: :class:`Stats` to update (a new one is created if not provided)
+    :param callback: function called with the :class:`Stats` after each document
+    :param kwargs: extra arguments of :class:`rubymarshal.writer.Writer`
+    """
+
+    def __init__(self, fd, stats=None, callback=None, **kwargs):
+        super().__init__(MeteredWriter(fd), **kwargs)
+        self.profiler = Profiler(stats, callback)
+
+    @property
+    def stats(self):
+        return self.profiler.stats
+
+    def write(self, obj):
+        fd = self.fd
+        position = fd.position
+        fd.tokens.append(None)
+        start = self.profiler.begin()
+        super().write(obj)
+        token = fd.tokens.pop()
+        self.profiler.end(start, token, obj, fd.position - position)
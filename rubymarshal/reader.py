@@ -1,12 +1,19 @@
 import io
+import mmap
 import re
+import zlib
 
 from rubymarshal.classes import (
+    DefaultHash,
     Extended,
+    HashPairs,
     Module,
+    RubyData,
     RubyObject,
     RubyString,
+    RubyStruct,
     Symbol,
+    UserClass,
     UserDef,
     UsrMarshal,
 )
@@ -21,6 +28,7 @@ from rubymarshal.constants import (
     TYPE_FIXNUM,
     TYPE_FLOAT,
     TYPE_HASH,
+    TYPE_HASH_DEF,
     TYPE_IVAR,
     TYPE_LINK,
     TYPE_MODULE,
@@ -32,6 +40,7 @@ from rubymarshal.constants import (
     TYPE_SYMBOL,
     TYPE_SYMLINK,
     TYPE_TRUE,
+    TYPE_UCLASS,
     TYPE_USERDEF,
     TYPE_USRMARSHAL,
 )
@@ -40,17 +49,228 @@ from rubymarshal.utils import read_sbyte, read_ubyte, read_ushort
 __author__ = "Matthieu Gallet"
 
 
+class BufferReader:
+    """read-only file-like object over a bytes-like buffer (`bytes`, `bytearray`, `mmap`, ...).
+
+    Only the requested slices are copied, never the remaining part of the buffer."""
+
+    def __init__(self, buffer, offset=0):
+        if not isinstance(buffer, (bytes, mmap.mmap)):
+            buffer = memoryview(buffer)
+        self.buffer = buffer
+        self.position = offset
+
+    def read(self, size=-1):
+        start = self.position
+        end = len(self.buffer)
+        if 0 <= size < end - start:
+            end = start + size
+        self.position = max(start, end)
+        data = self.buffer[start:end]
+        if type(data) is not bytes:
+            data = bytes(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+
+# `wbits` of :func:`zlib.decompressobj` for each supported compression
+COMPRESSIONS = {"zlib": zlib.MAX_WBITS, "gzip": zlib.MAX_WBITS | 16}
+
+
+def detect_compression(header):
+    """return the compression of a stream (`"zlib"`, `"gzip"` or `None`) from its first two bytes"""
+    if header[:2] == b"\x1f\x8b":
+        return "gzip"
+    if (
+        len(header) >= 2
+        and header[0] & 0x0F == 8
+        and (header[0] << 8 | header[1]) % 31 == 0
+    ):
+        return "zlib"
+    return None
+
+
+class DecompressingReader:
+    """file object that decompresses a zlib or gzip stream on the fly
+
+    At most `chunk_size` decompressed bytes are kept in memory, besides the returned data.
+
+    :param fd: file object of the compressed stream
+    :param compression: `"zlib"` or `"gzip"`
+    :param prefix: compressed bytes that have already been read from `fd`
+    """
+
+    chunk_size = 65536
+
+    def __init__(self, fd, compression="zlib", prefix=b""):
+        if compression not in COMPRESSIONS:
+            raise ValueError("unsupported compression: %r" % compression)
+        self.fd = fd
+        self.decompressor = zlib.decompressobj(COMPRESSIONS[compression])
+        self.pending = prefix
+        self.buffer = b""
+        self.position = 0
+
+    def read(self, size=-1):
+        start = self.position
+        end = start + size
+        if 0 <= size and end <= len(self.buffer):
+            self.position = end
+            return self.buffer[start:end]
+        parts = [self.buffer[start:]]
+        self.buffer = b""
+        self.position = 0
+        missing = size - len(parts[0])
+        while size < 0 or missing > 0:
+            chunk = self.decompress()
+            if not chunk:
+                break
+            if 0 <= missing < len(chunk):
+                # keep the remaining part of the chunk for the next calls
+                parts.append(chunk[:missing])
+                self.buffer = chunk
+                self.position = missing
+                break
+            parts.append(chunk)
+            missing -= len(chunk)
+        return b"".join(parts)
+
+    def decompress(self):
+        """return the next decompressed chunk (empty at the end of the stream)"""
+        decompressor = self.decompressor
+        while not decompressor.eof:
+            data = decompressor.unconsumed_tail or self.pending
+            self.pending = b""
+            if not data:
+                data = self.fd.read(self.chunk_size)
+                if not data:
+                    raise ValueError("unexpected end of compressed data")
+            chunk = decompressor.decompress(data, self.chunk_size)
+            if chunk:
+                return chunk
+        return b""
+
+
+class LimitExceeded(ValueError):
+    """raised when a document exceeds one of its :class:`Limits`"""
+
+
+class Limits:
+    """resource limits for decoding untrusted documents
+
+    Limits are checked before any allocation. `None` means no limit.
+
+    :param max_bytes: number of bytes of the document (after its header)
+    :param max_objects: number of objects (all values but `nil`, booleans, integers and symbols)
+    :param max_depth: nesting depth of values
+    :param max_string: size of strings, symbols, bignums and raw data
+    :param max_array: number of elements of an array
+    :param max_hash: number of pairs of a hash, or of instance variables of an object
+    """
+
+    def __init__(
+        self,
+        max_bytes=None,
+        max_objects=None,
+        max_depth=None,
+        max_string=None,
+        max_array=None,
+        max_hash=None,
+    ):
+        self.max_bytes = max_bytes
+        self.max_objects = max_objects
+        self.max_depth = max_depth
+        self.max_string = max_string
+        self.max_array = max_array
+        self.max_hash = max_hash
+
+    def check(self, name, value):
+        limit = getattr(self, name)
+        if limit is not None and value > limit:
+            raise LimitExceeded("%s exceeded: %d > %d" % (name, value, limit))
+
+
+class LimitedReader:
+    """file object that refuses to read more than `max_bytes` bytes"""
+
+    def __init__(self, fd, max_bytes):
+        self.fd = fd
+        self.max_bytes = max_bytes
+        self.position = 0
+
+    def read(self, size=-1):
+        if size < 0 or self.position + size > self.max_bytes:
+            raise LimitExceeded("max_bytes exceeded: %d" % self.max_bytes)
+        data = self.fd.read(size)
+        self.position += len(data)
+        return data
+
+
 class Reader:
-    def __init__(self, fd, registry=None):
+    """decode the values of a document
+
+    :param fd: the file object
+    :param registry: class registry to use instead of the global one
+    :param limits: :class:`Limits` to apply (no limit by default)
+    :param object_hook: function called with the class name and the attributes of each object,
+      whose result replaces the object (instead of the registry)
+    :param hash_hook: function called with the list of `(key, value)` pairs of each hash,
+      whose result replaces the hash (hashes with a default value are not concerned)
+    :param string_hook: function called with each string (`bytes`, `str` or :class:`RubyString`),
+      whose result replaces the string
+    :param symbol_hook: function called with the name of each symbol used as a value
+      (not as a class or attribute name), whose result replaces the symbol
+    :param symbols_as_str: decode symbols used as values to their name (a `str`, shared by all
+      occurrences of the symbol) instead of :class:`rubymarshal.classes.Symbol`
+    :param hash_pairs: decode hashes to :class:`rubymarshal.classes.HashPairs` instead of `dict`
+      (faster, and keys are never hashed)
+
+    Hooks are called as soon as the value is complete, so links to the value resolve to the result of the hook.
+    Links from the content of an object or a hash to itself cannot be resolved when its hook is set.
+    """
+
+    def __init__(
+        self,
+        fd,
+        registry=None,
+        limits=None,
+        object_hook=None,
+        hash_hook=None,
+        string_hook=None,
+        symbol_hook=None,
+        symbols_as_str=False,
+        hash_pairs=False,
+    ):
         self.symbols = []
         self.objects = []
         self.fd = fd
         self.registry = registry or global_registry
+        self.limits = limits
+        self.depth = 0
+        self.object_hook = object_hook
+        self.hash_hook = hash_hook
+        self.string_hook = string_hook
+        self.symbol_hook = symbol_hook
+        self.symbols_as_str = symbols_as_str
+        self.hash_pairs = hash_pairs
+        # instance variables of the last array or hash (set on the UserClass that wraps it)
+        self.container_attributes = None
+        # UserClass whose wrapped value is being read (links to this value must return the wrapper)
+        self.wrapper = None
+        if limits is not None and limits.max_bytes is not None:
+            self.fd = LimitedReader(fd, limits.max_bytes)
 
     def read(self, in_ivar=False):
         result = None
         object_index = None
         re_flags = None
+        python_class = None
+        limits = self.limits
+        if limits is not None:
+            self.depth += 1
+            limits.check("max_depth", self.depth)
 
         token = self.fd.read(1)
 
@@ -58,7 +278,8 @@ class Reader:
         # The stream contains only one copy of each object for all objects except
         # true, false, nil, Fixnums and Symbols.
         if token in (
-            # TYPE_EXTENDED, TYPE_UCLASS, ????
+            # TYPE_EXTENDED, ????
+            # TYPE_UCLASS shares the index of the wrapped value
             TYPE_CLASS,
             TYPE_MODULE,
             TYPE_FLOAT,
@@ -67,6 +288,7 @@ class Reader:
             TYPE_REGEXP,
             TYPE_ARRAY,
             TYPE_HASH,
+            TYPE_HASH_DEF,
             TYPE_STRUCT,
             TYPE_OBJECT,
             TYPE_DATA,
@@ -74,8 +296,13 @@ class Reader:
             TYPE_USERDEF,
         ):
             object_index = len(self.objects)
-            # placeholder for incomplete type
-            self.objects.append(None)
+            if limits is not None:
+                limits.check("max_objects", object_index + 1)
+            # containers and objects replace this placeholder before reading their content,
+            # so links from their content (cycles) are resolved
+            wrapper = self.wrapper
+            self.objects.append(wrapper)
+            self.wrapper = None
 
         if token == TYPE_NIL:
             pass
@@ -89,20 +316,47 @@ class Reader:
             result = self.read_blob()
         elif token == TYPE_SYMBOL:
             result = self.read_symreal()
+            if self.symbols_as_str:
+                result = result.name
+            elif self.symbol_hook is not None:
+                result = self.symbol_hook(result.name)
         elif token == TYPE_FIXNUM:
             result = self.read_long()
         elif token == TYPE_ARRAY:
             num_elements = self.read_long()
+            if limits is not None:
+                limits.check("max_array", num_elements)
+            result = []
+            if wrapper is None:
+                self.objects[object_index] = result
             # noinspection PyUnusedLocal
-            result = [self.read() for x in range(num_elements)]
-        elif token == TYPE_HASH:
+            result[:] = [self.read() for x in range(num_elements)]
+        elif token == TYPE_HASH or token == TYPE_HASH_DEF:
             num_elements = self.read_long()
-            result = {}
-            for x in range(num_elements):
-                key = self.ensure_hashable(self.read())
-                value = self.read()
-                result[key] = value
-            result = result
+            if limits is not None:
+                limits.check("max_hash", num_elements)
+            if token == TYPE_HASH and self.hash_hook is not None:
+                # noinspection PyUnusedLocal
+                pairs = [(self.read(), self.read()) for x in range(num_elements)]
+                result = self.hash_hook(pairs)
+            elif self.hash_pairs:
+                result = HashPairs()
+                if wrapper is None:
+                    self.objects[object_index] = result
+                # noinspection PyUnusedLocal
+                result.pairs = [(self.read(), self.read()) for x in range(num_elements)]
+                if token == TYPE_HASH_DEF:
+                    result.default = self.read()
+            else:
+                result = {} if token == TYPE_HASH else DefaultHash()
+                if wrapper is None:
+                    self.objects[object_index] = result
+                for x in range(num_elements):
+                    key = self.ensure_hashable(self.read())
+                    value = self.read()
+                    result[key] = value
+                if token == TYPE_HASH_DEF:
+                    result.default = self.read()
         elif token == TYPE_FLOAT:
             floatn = self.read_blob()
             floatn = floatn.split(b"\0")
@@ -110,6 +364,8 @@ class Reader:
         elif token == TYPE_BIGNUM:
             sign = 1 if self.fd.read(1) == b"+" else -1
             num_elements = self.read_long()
+            if limits is not None:
+                limits.check("max_string", 2 * num_elements)
             result = 0
             factor = 1
             for x in range(num_elements):
@@ -125,11 +381,7 @@ class Reader:
             if options & 4:
                 re_flags |= re.MULTILINE
         elif token == TYPE_USRMARSHAL:
-            class_symbol = self.read()
-            if not isinstance(class_symbol, Symbol):
-                raise ValueError("invalid class name: %r" % class_symbol)
-            class_name = class_symbol.name
-            attr_list = self.read()
+            class_name = self.read_symbol().name
             python_class = self.registry.get(class_name, UsrMarshal)
             if not issubclass(python_class, UsrMarshal):
                 raise ValueError(
@@ -137,9 +389,14 @@ class Reader:
                     % (class_name, python_class, UsrMarshal)
                 )
             result = python_class(class_name)
-            result.marshal_load(attr_list)
+            self.objects[object_index] = result
+            result.marshal_load(self.read())
         elif token == TYPE_SYMLINK:
             result = self.read_symlink()
+            if self.symbols_as_str:
+                result = result.name
+            elif self.symbol_hook is not None:
+                result = self.symbol_hook(result.name)
         elif token == TYPE_LINK:
             link_id = self.read_long()
             if link_id > len(self.objects):
@@ -157,11 +414,8 @@ class Reader:
                     % (link_id)
                 )
         elif token == TYPE_USERDEF:
-            class_symbol = self.read()
+            class_name = self.read_symbol().name
             private_data = self.read_blob()
-            if not isinstance(class_symbol, Symbol):
-                raise ValueError("invalid class name: %r" % class_symbol)
-            class_name = class_symbol.name
             python_class = self.registry.get(class_name, UserDef)
             if not issubclass(python_class, UserDef):
                 raise ValueError(
@@ -171,22 +425,67 @@ class Reader:
             result = python_class(class_name)
             # noinspection PyProtectedMember
             result._load(private_data)
+            self.objects[object_index] = result
         elif token == TYPE_MODULE:
             data = self.read_blob()
             module_name = data.decode()
             result = Module(module_name, None)
         elif token == TYPE_OBJECT:
-            class_symbol = self.read()
-            assert isinstance(class_symbol, Symbol)
-            class_name = class_symbol.name
-            python_class = self.registry.get(class_name, RubyObject)
-            if not issubclass(python_class, RubyObject):
+            class_name = self.read_symbol().name
+            if self.object_hook is not None:
+                result = self.object_hook(class_name, self.read_attributes())
+            else:
+                python_class = self.registry.get(class_name, RubyObject)
+                if not issubclass(python_class, RubyObject):
+                    raise ValueError(
+                        "invalid class mapping for %r: %r should be a subclass of %r."
+                        % (class_name, python_class, RubyObject)
+                    )
+                result = python_class(class_name)
+                self.objects[object_index] = result
+                result.set_attributes(self.read_attributes())
+        elif token == TYPE_STRUCT:
+            class_name = self.read_symbol().name
+            python_class = self.registry.get(class_name, RubyStruct)
+            if not issubclass(python_class, RubyStruct):
                 raise ValueError(
                     "invalid class mapping for %r: %r should be a subclass of %r."
-                    % (class_name, python_class, RubyObject)
+                    % (class_name, python_class, RubyStruct)
                 )
-            attributes = self.read_attributes()
-            result = python_class(class_name, attributes)
+            result = python_class(class_name)
+            self.objects[object_index] = result
+            result.members = self.read_attributes()
+        elif token == TYPE_DATA:
+            class_name = self.read_symbol().name
+            python_class = self.registry.get(class_name, RubyData)
+            if not issubclass(python_class, RubyData):
+                raise ValueError(
+                    "invalid class mapping for %r: %r should be a subclass of %r."
+                    % (class_name, python_class, RubyData)
+                )
+            result = python_class(class_name)
+            self.objects[object_index] = result
+            # noinspection PyProtectedMember
+            result._load_data(self.read())
+        elif token == TYPE_UCLASS:
+            class_name = self.read_symbol().name
+            python_class = self.registry.get(class_name, UserClass)
+            if not issubclass(python_class, UserClass):
+                raise ValueError(
+                    "invalid class mapping for %r: %r should be a subclass of %r."
+                    % (class_name, python_class, UserClass)
+                )
+            result = python_class(class_name)
+            # the wrapped value registers the object (and reads the instance variables)
+            object_index = len(self.objects)
+            self.wrapper = result
+            self.container_attributes = None
+            result.value = self.read(in_ivar=in_ivar)
+            self.wrapper = None
+            in_ivar = False
+            if self.container_attributes:
+                result.set_attributes(self.container_attributes)
+                self.container_attributes = None
         elif token == TYPE_EXTENDED:
             class_name = self.read_blob()
             result = Extended(class_name, None)
@@ -216,14 +515,25 @@ class Reader:
                 # string instance attributes are discarded (on regex?)
                 if attributes and token == TYPE_STRING:
                     result = RubyString(result, attributes)
+            elif token == TYPE_SYMBOL or token == TYPE_SYMLINK:
+                # encoding of the symbol
+                pass
+            elif isinstance(result, (list, dict, HashPairs)):
+                self.container_attributes = attributes
             elif attributes:
                 result.set_attributes(attributes)
 
         if token == TYPE_REGEXP:
             result = re.compile(str(result), re_flags)
+        elif token == TYPE_STRING and self.string_hook is not None:
+            result = self.string_hook(result)
+        elif python_class is not None and python_class.to_python is not None:
+            result = result.to_python()
 
         if object_index is not None:
             self.objects[object_index] = result
+        if limits is not None:
+            self.depth -= 1
         return result
 
     @staticmethod
@@ -237,9 +547,11 @@ class Reader:
 
     def read_attributes(self):
         attr_count = self.read_long()
+        if self.limits is not None:
+            self.limits.check("max_hash", attr_count)
         attrs = {}
         for x in range(attr_count):
-            attr_name = self.read()
+            attr_name = self.read_symbol()
             attr_value = self.read()
             attrs[attr_name.name] = attr_value
         return attrs
@@ -266,6 +578,10 @@ class Reader:
 
     def read_blob(self):
         size = self.read_long()
+        if size < 0:
+            raise ValueError("invalid length: %d" % size)
+        if self.limits is not None:
+            self.limits.check("max_string", size)
         return self.fd.read(size)
 
     def read_symbol(self):
@@ -276,7 +592,11 @@ class Reader:
                 ivar = 1
                 continue
             elif token == TYPE_SYMBOL:
-                return self.read_symreal()
+                result = self.read_symreal()
+                if ivar:
+                    # encoding of the symbol
+                    self.read_attributes()
+                return result
             elif token == TYPE_SYMLINK:
                 if ivar:
                     raise ValueError("dump format error (symlink with encoding)")
@@ -303,15 +623,71 @@ class Reader:
         return value
 
 
-def load(fd, registry=None):
-    if fd.read(1) != b"\x04":
+def load(fd, registry=None, cls=Reader, compression="auto", **kwargs):
+    """read a single document from a file object
+
+    :param fd: the file object
+    :param registry: class registry to use instead of the global one
+    :param cls: Reader class to use
+    :param compression: `"zlib"` or `"gzip"` to decompress the stream while decoding it,
+      `"auto"` to detect it from the first bytes, or `None`.
+      A compressed stream is read by chunks, so `fd` may be read after the end of the document.
+    :param kwargs: extra arguments of the Reader class
+    """
+    header = fd.read(2)
+    if compression == "auto":
+        compression = detect_compression(header)
+    if compression is not None:
+        fd = DecompressingReader(fd, compression, prefix=header)
+        header = fd.read(2)
+    if header[:1] != b"\x04":
         raise ValueError(r"Expected token \x04")
-    if fd.read(1) != b"\x08":
+    if header[1:2] != b"\x08":
         raise ValueError(r"Expected token \x08")
 
-    loader = Reader(fd, registry=registry)
+    loader = cls(fd, registry=registry, **kwargs)
     return loader.read()
 
 
-def loads(byte_text, registry=None):
-    return load(io.BytesIO(byte_text), registry=registry)
+def loads(byte_text, registry=None, cls=Reader, compression="auto", **kwargs):
+    """read a single document from a bytes string (see :func:`load`)"""
+    return load(
+        io.BytesIO(byte_text),
+        registry=registry,
+        cls=cls,
+        compression=compression,
+        **kwargs,
+    )
+
+
+def loads_from(buffer, offset=0, registry=None, cls=Reader, **kwargs):
+    """read a single document starting at `offset` in a bytes-like object
+
+    :param buffer: `bytes`, `bytearray`, `memoryview` or `mmap` (the buffer is not copied)
+    :param offset: position of the document header in the buffer
+    :param registry: class registry to use instead of the global one
+    :param cls: Reader class to use
+    :param kwargs: extra arguments of the Reader class
+    :return: a tuple `(obj, end_offset)`, where `end_offset` is the position just after the document
+
+    Compressed documents are not accepted, since their end offset cannot be known.
+    """
+    fd = BufferReader(buffer, offset)
+    obj = load(fd, registry=registry, cls=cls, compression=None, **kwargs)
+    return obj, fd.tell()
+
+
+def iter_load(fd, registry=None, cls=Reader, **kwargs):
+    """iterate over the documents that are concatenated in a file (e.g. many `Marshal.dump` appended to a log)
+
+    All documents are read from the same file object, so its read buffer is shared between them.
+    """
+    while True:
+        token = fd.read(1)
+        if token == b"":
+            return
+        if token != b"\x04":
+            raise ValueError(r"Expected token \x04")
+        if fd.read(1) != b"\x08":
+            raise ValueError(r"Expected token \x08")
+        yield cls(fd, registry=registry, **kwargs).read()
@@ -0,0 +1,182 @@
+"""Classes of the RPG Maker XP/VX/VX Ace runtime (RGSS), stored as `_dump` data in `.rxdata`, `.rvdata` and `.rvdata2` files.
+
+:class:`Table` exposes its packed 16-bit values as a `memoryview` (or a NumPy array with :meth:`Table.to_numpy`)
+without any per-element loop or copy. :class:`Color` and :class:`Tone` unpack their four doubles at once.
+
+.. code-block:: python
+
+  from rubymarshal.reader import load
+  from rubymarshal.rpgmaker import install
+  install()
+  with open("Data/Map001.rvdata2", "rb") as fd:
+      game_map = load(fd)
+  tiles = game_map.attributes["@data"]
+  tile_id = tiles[x, y, 0]
+"""
+
+import struct
+import sys
+from array import array
+
+from rubymarshal.classes import UserDef
+from rubymarshal.classes import registry as global_registry
+
+__author__ = "Matthieu Gallet"
+
+_table_header = struct.Struct("<5i")
+_doubles = struct.Struct("<4d")
+
+
+def _int16_view(data, offset):
+    """return the little-endian int16 values that start at `offset`, as a view if possible"""
+    view = memoryview(data)[offset:]
+    if sys.byteorder == "little":
+        return view.cast("B").cast("h")
+    values = array("h", view)
+    values.byteswap()
+    return memoryview(values)
+
+
+class Table(UserDef):
+    """multi-dimensional array of signed 16-bit integers (map tiles, ...)
+
+    `_dump` format: five little-endian int32 (number of dimensions, x size, y size, z size, number of values),
+    followed by the values (x varies first).
+    """
+
+    ruby_class_name = "Table"
+
+    def __init__(self, ruby_class_name=None, attributes=None):
+        super().__init__(ruby_class_name=ruby_class_name, attributes=attributes)
+        self.dimensions = 1
+        self.xsize = self.ysize = self.zsize = 0
+        self.values = memoryview(array("h"))
+
+    @classmethod
+    def from_values(cls, values, xsize, ysize=1, zsize=1, dimensions=None):
+        """create a table from a sequence (or a buffer) of `xsize * ysize * zsize` integers"""
+        if dimensions is None:
+            dimensions = 3 if zsize > 1 else (2 if ysize > 1 else 1)
+        values = array("h", values)
+        if len(values) != xsize * ysize * zsize:
+            raise ValueError(
+                "%d values for a table of size %r"
+                % (len(values), (xsize, ysize, zsize))
+            )
+        if sys.byteorder != "little":
+            values.byteswap()
+        header = _table_header.pack(dimensions, xsize, ysize, zsize, len(values))
+        result = cls(cls.ruby_class_name)
+        result._load(header + values.tobytes())
+        return result
+
+    def _load(self, private_data: bytes):
+        super()._load(private_data)
+        if len(private_data) < _table_header.size:
+            raise ValueError("invalid Table data")
+        self.dimensions, self.xsize, self.ysize, self.zsize, size = (
+            _table_header.unpack_from(private_data)
+        )
+        if (
+            size != self.xsize * self.ysize * self.zsize
+            or len(private_data) != _table_header.size + 2 * size
+        ):
+            raise ValueError("invalid Table data")
+        self.values = _int16_view(private_data, _table_header.size)
+
+    def to_numpy(self):
+        """return the values as a read-only NumPy array of shape `(zsize, ysize, xsize)` (requires NumPy)"""
+        import numpy
+
+        return numpy.frombuffer(
+            self._dump(), dtype="<i2", offset=_table_header.size
+        ).reshape(self.zsize, self.ysize, self.xsize)
+
+    def __getitem__(self, item):
+        if not isinstance(item, tuple):
+            return self.values[item]
+        x, y, z = (item + (0, 0))[:3]
+        return self.values[x + self.xsize * (y + self.ysize * z)]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __eq__(self, other):
+        return isinstance(other, Table) and self._dump() == other._dump()
+
+    def __hash__(self):
+        return hash(self._dump())
+
+    def __repr__(self):
+        return "Table(%d, %d, %d)" % (self.xsize, self.ysize, self.zsize)
+
+
+class _Doubles(UserDef):
+    """four packed little-endian doubles"""
+
+    fields = ()
+
+    def __init__(self, ruby_class_name=None, attributes=None):
+        super().__init__(ruby_class_name=ruby_class_name, attributes=attributes)
+        self.values = (0.0, 0.0, 0.0, 0.0)
+
+    @classmethod
+    def from_values(cls, *values):
+        if len(values) != 4:
+            raise ValueError(
+                "%s requires 4 values, not %d" % (cls.__name__, len(values))
+            )
+        result = cls(cls.ruby_class_name)
+        result.values = tuple(float(x) for x in values)
+        return result
+
+    def _load(self, private_data: bytes):
+        self.values = _doubles.unpack(private_data)
+
+    def _dump(self) -> bytes:
+        return _doubles.pack(*self.values)
+
+    def __getattr__(self, item):
+        fields = type(self).fields
+        if item in fields:
+            return self.values[fields.index(item)]
+        raise AttributeError(item)
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and self.values == other.values
+
+    def __hash__(self):
+        return hash(self.values)
+
+    def __repr__(self):
+        return "%s(%s)" % (
+            self.__class__.__name__,
+            ", ".join("%g" % x for x in self.values),
+        )
+
+
+class Color(_Doubles):
+    """`_dump` format: red, green, blue and alpha as little-endian doubles"""
+
+    ruby_class_name = "Color"
+    fields = ("red", "green", "blue", "alpha")
+
+
+class Tone(_Doubles):
+    """`_dump` format: red, green, blue and gray as little-endian doubles"""
+
+    ruby_class_name = "Tone"
+    fields = ("red", "green", "blue", "gray")
+
+
+CLASSES = [Table, Color, Tone]
+
+
+def install(registry=None):
+    """register the RGSS classes
+
+    :param registry: class registry to use instead of the global one
+    """
+    registry = global_registry if registry is None else registry
+    for cls in CLASSES:
+        registry.register(cls)
@@ -0,0 +1,454 @@
+"""Walk through Marshal documents stored in bytes-like objects, without building Python objects.
+
+Symbols and objects are numbered exactly like :class:`rubymarshal.reader.Reader` does,
+so the state of the scanner can be used to resume decoding anywhere in the document.
+"""
+
+from collections import namedtuple
+
+from rubymarshal.constants import (
+    TYPE_ARRAY,
+    TYPE_BIGNUM,
+    TYPE_CLASS,
+    TYPE_DATA,
+    TYPE_EXTENDED,
+    TYPE_FALSE,
+    TYPE_FIXNUM,
+    TYPE_FLOAT,
+    TYPE_HASH,
+    TYPE_HASH_DEF,
+    TYPE_IVAR,
+    TYPE_LINK,
+    TYPE_MODULE,
+    TYPE_MODULE_OLD,
+    TYPE_NIL,
+    TYPE_OBJECT,
+    TYPE_REGEXP,
+    TYPE_STRING,
+    TYPE_STRUCT,
+    TYPE_SYMBOL,
+    TYPE_SYMLINK,
+    TYPE_TRUE,
+    TYPE_UCLASS,
+    TYPE_USERDEF,
+    TYPE_USRMARSHAL,
+)
+
+__author__ = "Matthieu Gallet"
+
+NIL, TRUE, FALSE = ord(TYPE_NIL), ord(TYPE_TRUE), ord(TYPE_FALSE)
+FIXNUM, BIGNUM, FLOAT = ord(TYPE_FIXNUM), ord(TYPE_BIGNUM), ord(TYPE_FLOAT)
+STRING, REGEXP = ord(TYPE_STRING), ord(TYPE_REGEXP)
+SYMBOL, SYMLINK, LINK, IVAR = (
+    ord(TYPE_SYMBOL),
+    ord(TYPE_SYMLINK),
+    ord(TYPE_LINK),
+    ord(TYPE_IVAR),
+)
+ARRAY, HASH, HASH_DEF = ord(TYPE_ARRAY), ord(TYPE_HASH), ord(TYPE_HASH_DEF)
+OBJECT, STRUCT, DATA = ord(TYPE_OBJECT), ord(TYPE_STRUCT), ord(TYPE_DATA)
+USERDEF, USRMARSHAL = ord(TYPE_USERDEF), ord(TYPE_USRMARSHAL)
+UCLASS, EXTENDED = ord(TYPE_UCLASS), ord(TYPE_EXTENDED)
+CLASS, MODULE, MODULE_OLD = ord(TYPE_CLASS), ord(TYPE_MODULE), ord(TYPE_MODULE_OLD)
+
+
+class Scanner:
+    """skip values of a Marshal document stored in a bytes-like object (`bytes`, `mmap`, `memoryview`)
+
+    :param buffer: the bytes-like object
+    :param offset: position of the first token to read (after the `\\x04\\x08` header)
+    :param record_offsets: if True, the offset of each object is stored in `object_offsets`
+
+    After each call to :meth:`skip`:
+
+      * `position` is the offset just after the skipped value,
+      * `symbols` is the list of the raw names of all symbols that have been read,
+      * `object_count` is the number of objects that can be the destination of a link,
+      * `object_offsets` is the offset of each of these objects (including `I`, `C` or `e` prefixes),
+      * `link_targets` is the set of the objects that are the destination of a link.
+    """
+
+    def __init__(self, buffer, offset=0, record_offsets=False):
+        self.buffer = buffer
+        self.position = offset
+        self.symbols = []
+        self.object_count = 0
+        self.object_offsets = [] if record_offsets else None
+        self.link_targets = set()
+
+    def read_byte(self):
+        position = self.position
+        if position >= len(self.buffer):
+            raise ValueError("unexpected end of data at offset %d" % position)
+        self.position = position + 1
+        return self.buffer[position]
+
+    def read_long(self):
+        length = self.read_byte()
+        if length > 127:
+            length -= 256
+        if length == 0:
+            return 0
+        if 5 < length < 128:
+            return length - 5
+        elif -129 < length < -5:
+            return length + 5
+        size = abs(length)
+        position = self.position
+        if position + size > len(self.buffer):
+            raise ValueError("unexpected end of data at offset %d" % position)
+        self.position = position + size
+        result = int.from_bytes(self.buffer[position : position + size], "little")
+        if length < 0:
+            result -= 1 << (8 * size)
+        return result
+
+    def skip_bytes(self, size):
+        position = self.position
+        if size < 0 or position + size > len(self.buffer):
+            raise ValueError("invalid length %d at offset %d" % (size, position))
+        self.position = position + size
+        return position
+
+    def read_blob(self):
+        size = self.read_long()
+        start = self.skip_bytes(size)
+        return bytes(self.buffer[start : start + size])
+
+    def skip_blob(self):
+        self.skip_bytes(self.read_long())
+
+    def register_object(self, start):
+        if self.object_offsets is not None:
+            self.object_offsets.append(start)
+        self.object_count += 1
+
+    def skip_symbol(self):
+        """skip a symbol (used for class and attribute names) and return its index"""
+        token = self.read_byte()
+        if token == SYMBOL:
+            self.symbols.append(self.read_blob())
+            return len(self.symbols) - 1
+        elif token == SYMLINK:
+            symlink_id = self.read_long()
+            if not 0 <= symlink_id < len(self.symbols):
+                raise ValueError("invalid symlink destination: %d" % symlink_id)
+            return symlink_id
+        elif token == IVAR:
+            symbol_id = self.skip_symbol()
+            self.skip_attributes()
+            return symbol_id
+        raise ValueError("error while reading symbol with token %r" % bytes([token]))
+
+    def skip_attributes(self):
+        for x in range(self.read_long()):
+            self.skip_symbol()
+            self.skip()
+
+    def skip(self, start=None):
+        """skip a single value
+
+        :param start: offset to record for the next object (used for `I`, `C` and `e` prefixes)
+        """
+        if start is None:
+            start = self.position
+        token = self.read_byte()
+        if token == NIL or token == TRUE or token == FALSE:
+            pass
+        elif token == FIXNUM:
+            self.read_long()
+        elif token == SYMBOL:
+            self.symbols.append(self.read_blob())
+        elif token == SYMLINK:
+            symlink_id = self.read_long()
+            if not 0 <= symlink_id < len(self.symbols):
+                raise ValueError("invalid symlink destination: %d" % symlink_id)
+        elif token == LINK:
+            link_id = self.read_long()
+            if not 0 <= link_id < self.object_count:
+                raise ValueError("invalid link destination: %d" % link_id)
+            self.link_targets.add(link_id)
+        elif token == IVAR:
+            self.skip(start)
+            self.skip_attributes()
+        elif token == STRING or token == FLOAT:
+            self.register_object(start)
+            self.skip_blob()
+        elif token == ARRAY:
+            self.register_object(start)
+            for x in range(self.read_long()):
+                self.skip()
+        elif token == HASH or token == HASH_DEF:
+            self.register_object(start)
+            for x in range(self.read_long()):
+                self.skip()
+                self.skip()
+            if token == HASH_DEF:
+                self.skip()
+        elif token == OBJECT or token == STRUCT:
+            self.register_object(start)
+            self.skip_symbol()
+            self.skip_attributes()
+        elif token == USERDEF:
+            self.register_object(start)
+            self.skip_symbol()
+            self.skip_blob()
+        elif token == USRMARSHAL or token == DATA:
+            self.register_object(start)
+            self.skip_symbol()
+            self.skip()
+        elif token == UCLASS or token == EXTENDED:
+            self.skip_symbol()
+            self.skip(start)
+        elif token == BIGNUM:
+            self.register_object(start)
+            self.read_byte()
+            self.skip_bytes(2 * self.read_long())
+        elif token == REGEXP:
+            self.register_object(start)
+            self.skip_blob()
+            self.read_byte()
+        elif token == CLASS or token == MODULE or token == MODULE_OLD:
+            self.register_object(start)
+            self.skip_blob()
+        else:
+            raise ValueError("token %r is not recognized" % bytes([token]))
+
+
+def skip_header(buffer, offset=0):
+    """check the `\\x04\\x08` header at `offset` and return the offset of the first token"""
+    if buffer[offset : offset + 1] != b"\x04":
+        raise ValueError(r"Expected token \x04")
+    if buffer[offset + 1 : offset + 2] != b"\x08":
+        raise ValueError(r"Expected token \x08")
+    return offset + 2
+
+
+Validation = namedtuple(
+    "Validation", ["size", "objects", "symbols", "links", "max_depth"]
+)
+Validation.__doc__ = """result of :func:`validate`
+
+:param size: size of the document in bytes (including its header)
+:param objects: number of objects (values that can be the destination of a link)
+:param symbols: number of distinct symbols
+:param links: number of links
+:param max_depth: maximum nesting depth of values
+"""
+
+
+# kind of the open frames of validate()
+_VALUES = 0
+_ATTRIBUTES = 1
+_WRAPPED = 2
+
+
+def _read_long(data, position):
+    """read an integer and return it with the position of the next token"""
+    length = data[position]
+    position += 1
+    if length == 0:
+        return 0, position
+    if length < 128:
+        if length > 5:
+            return length - 5, position
+    else:
+        length -= 256
+        if length < -5:
+            return length + 5, position
+    size = abs(length)
+    if position + size > len(data):
+        raise ValueError("unexpected end of data at offset %d" % position)
+    result = int.from_bytes(data[position : position + size], "little")
+    if length < 0:
+        result -= 1 << (8 * size)
+    return result, position + size
+
+
+def _read_count(data, position):
+    """read a length, that must be positive"""
+    count, next_position = _read_long(data, position)
+    if count < 0:
+        raise ValueError("invalid length %d at offset %d" % (count, position))
+    return count, next_position
+
+
+def validate(buffer, offset=0, trailing=False):
+    """check the structure of a document without decoding it
+
+    Tokens, lengths, links (that must point to previous objects, possibly still incomplete) and symlinks are checked,
+    but the content of strings, floats or class names is not.
+    This is much faster than :func:`rubymarshal.reader.loads`, since no Python object is created.
+
+    :param buffer: bytes-like object (`bytes`, `mmap`, ...)
+    :param offset: offset of the document (its `\\x04\\x08` header)
+    :param trailing: accept extra bytes after the document
+    :raise ValueError: if the document is invalid
+    :rtype: :class:`Validation`
+    """
+    data = buffer
+    end = len(data)
+    position = skip_header(buffer, offset)
+    symbols = objects = links = depth = 0
+    # each frame is [number of remaining values, frame kind]
+    stack = []
+    # this is the hot loop: small lengths are decoded inline
+
+    def skip_blob(position):
+        size = data[position]
+        if 5 < size < 128:
+            position += size - 4
+            if position > end:
+                raise ValueError("unexpected end of data at offset %d" % end)
+            return position
+        size, position = _read_long(data, position)
+        if size < 0 or position + size > end:
+            raise ValueError("invalid length %d at offset %d" % (size, position))
+        return position + size
+
+    def read_symbol(position):
+        nonlocal symbols, objects
+        token = data[position]
+        if token == SYMBOL:
+            symbols += 1
+            return skip_blob(position + 1)
+        elif token == SYMLINK:
+            symlink_id = data[position + 1]
+            if symlink_id == 0 or 5 < symlink_id < 128:
+                symlink_id = symlink_id and symlink_id - 5
+                position += 2
+            else:
+                symlink_id, position = _read_long(data, position + 1)
+            if not 0 <= symlink_id < symbols:
+                raise ValueError("invalid symlink destination: %d" % symlink_id)
+            return position
+        # symbols with instance variables are rare
+        scanner = Scanner(data, position)
+        scanner.symbols = [None] * symbols
+        scanner.object_count = objects
+        scanner.skip_symbol()
+        symbols, objects = len(scanner.symbols), scanner.object_count
+        return scanner.position
+
+    try:
+        while True:
+            token = data[position]
+            position += 1
+            if token == IVAR:
+                if data[position] != STRING:
+                    stack.append([1, _WRAPPED])
+                    if len(stack) > depth:
+                        depth = len(stack)
+                    continue
+                # most frequent case: a string with its encoding
+                objects += 1
+                position = skip_blob(position + 1)
+                count = data[position]
+                if 5 < count < 128:
+                    count -= 5
+                    position += 1
+                else:
+                    count, position = _read_count(data, position)
+                if count:
+                    stack.append([count, _ATTRIBUTES])
+                    if len(stack) > depth:
+                        depth = len(stack)
+                    position = read_symbol(position)
+                    continue
+            elif token == FIXNUM:
+                if 5 < data[position] < 251:
+                    position += 1
+                else:
+                    position = _read_long(data, position)[1]
+            elif token == STRING or token == FLOAT:
+                objects += 1
+                position = skip_blob(position)
+            elif token == SYMBOL or token == SYMLINK:
+                position = read_symbol(position - 1)
+            elif token == NIL or token == TRUE or token == FALSE:
+                pass
+            elif token == LINK:
+                link_id, position = _read_long(data, position)
+                if not 0 <= link_id < objects:
+                    raise ValueError("invalid link destination: %d" % link_id)
+                links += 1
+            elif token == ARRAY or token == HASH or token == HASH_DEF:
+                objects += 1
+                count = data[position]
+                if 5 < count < 128:
+                    count -= 5
+                    position += 1
+                else:
+                    count, position = _read_count(data, position)
+                if token != ARRAY:
+                    count = 2 * count + (token == HASH_DEF)
+                if count:
+                    stack.append([count, _VALUES])
+                    if len(stack) > depth:
+                        depth = len(stack)
+                    continue
+            elif token == OBJECT or token == STRUCT:
+                objects += 1
+                position = read_symbol(position)
+                count, position = _read_count(data, position)
+                if count:
+                    stack.append([count, _ATTRIBUTES])
+                    if len(stack) > depth:
+                        depth = len(stack)
+                    position = read_symbol(position)
+                    continue
+            elif token == USERDEF:
+                objects += 1
+                position = skip_blob(read_symbol(position))
+            elif token == USRMARSHAL or token == DATA:
+                objects += 1
+                position = read_symbol(position)
+                stack.append([1, _VALUES])
+                if len(stack) > depth:
+                    depth = len(stack)
+                continue
+            elif token == UCLASS or token == EXTENDED:
+                # the next token is the wrapped value
+                position = read_symbol(position)
+                continue
+            elif token == BIGNUM:
+                objects += 1
+                count, position = _read_long(data, position + 1)
+                if count < 0 or position + 2 * count > end:
+                    raise ValueError(
+                        "invalid length %d at offset %d" % (count, position)
+                    )
+                position += 2 * count
+            elif token == REGEXP:
+                objects += 1
+                position = skip_blob(position) + 1
+            elif token == CLASS or token == MODULE or token == MODULE_OLD:
+                objects += 1
+                position = skip_blob(position)
+            else:
+                raise ValueError("token %r is not recognized" % bytes([token]))
+            # the value is complete: close the frames that are complete too
+            while stack:
+                frame = stack[-1]
+                frame[0] -= 1
+                if frame[0]:
+                    if frame[1] == _ATTRIBUTES:
+                        position = read_symbol(position)
+                    break
+                if frame[1] == _WRAPPED:
+                    count, position = _read_count(data, position)
+                    if count:
+                        frame[0] = count
+                        frame[1] = _ATTRIBUTES
+                        position = read_symbol(position)
+                        break
+                stack.pop()
+            else:
+                break
+    except IndexError:
+        raise ValueError("unexpected end of data at offset %d" % position) from None
+    if position > end:
+        raise ValueError("unexpected end of data at offset %d" % end)
+    if not trailing and position != end:
+        raise ValueError("%d trailing bytes after the document" % (end - position))
+    return Validation(position - offset, objects, symbols, links, depth + 1)
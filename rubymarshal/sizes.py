@@ -0,0 +1,331 @@
+"""Attribute every byte of a document to the path of the value that contains it.
+
+.. code-block:: python
+
+  from rubymarshal.sizes import analyze
+  with open("session.bin", "rb") as fd:
+      print(analyze(fd.read()).report())
+
+Paths start with `root` and are built like Ruby accessors:
+
+  * `[*]` for the elements of an array (all elements are aggregated),
+  * `[:key]`, `["key"]` or `[12]` for the values of a hash with symbol, string or integer keys (`[*]` for other keys),
+  * `@name` for the instance variables of objects, `.name` for the members of structs,
+  * `<dump>` for the value returned by `marshal_dump` or `_dump_data`.
+
+The bytes of a hash key are attributed to the path of its value.
+The bytes of internal instance variables (like the encoding of strings) are attributed to their value.
+
+Symbols and links make documents smaller: each symlink (or link) replaces a copy of the symbol (or object),
+and the number of bytes that are saved in this way is given separately.
+"""
+
+import json
+
+from rubymarshal.scanner import (
+    ARRAY,
+    BIGNUM,
+    CLASS,
+    DATA,
+    EXTENDED,
+    FALSE,
+    FIXNUM,
+    FLOAT,
+    HASH,
+    HASH_DEF,
+    IVAR,
+    LINK,
+    MODULE,
+    MODULE_OLD,
+    NIL,
+    OBJECT,
+    REGEXP,
+    STRING,
+    STRUCT,
+    SYMBOL,
+    SYMLINK,
+    TRUE,
+    UCLASS,
+    USERDEF,
+    USRMARSHAL,
+    Scanner,
+    skip_header,
+)
+
+__author__ = "Matthieu Gallet"
+
+
+def symbol_size(name):
+    """return the size of the definition of a symbol (`:` token, length and raw name)"""
+    size = len(name)
+    if size < 123:
+        return 2 + size
+    return 2 + (size.bit_length() + 7) // 8 + size
+
+
+class Usage:
+    """number of values, and their total size in bytes
+
+    `size` includes the nested values, `self_size` only counts the bytes that are not attributed to a nested path.
+    """
+
+    __slots__ = ("count", "size", "self_size")
+
+    def __init__(self):
+        self.count = 0
+        self.size = 0
+        self.self_size = 0
+
+    def as_dict(self):
+        return {"count": self.count, "size": self.size, "self_size": self.self_size}
+
+    def __repr__(self):
+        return "Usage(count=%d, size=%d, self_size=%d)" % (
+            self.count,
+            self.size,
+            self.self_size,
+        )
+
+
+class SizeReport:
+    """result of :func:`analyze`
+
+    :param size: size of the document (including its header)
+    :param paths: dict `{path: Usage}`
+    :param classes: dict `{Ruby class name: Usage}`
+    """
+
+    def __init__(self, size, paths, classes):
+        self.size = size
+        self.paths = paths
+        self.classes = classes
+        self.symbol_count = 0
+        self.symbol_size = 0
+        self.symlink_count = 0
+        self.symlink_size = 0
+        self.symlink_savings = 0
+        self.link_count = 0
+        self.link_size = 0
+        self.link_savings = 0
+
+    def as_dict(self):
+        """return the report as a JSON-serializable dict"""
+        return {
+            "size": self.size,
+            "paths": {k: v.as_dict() for (k, v) in self.paths.items()},
+            "classes": {k: v.as_dict() for (k, v) in self.classes.items()},
+            "symbols": {"count": self.symbol_count, "size": self.symbol_size},
+            "symlinks": {
+                "count": self.symlink_count,
+                "size": self.symlink_size,
+                "savings": self.symlink_savings,
+            },
+            "links": {
+                "count": self.link_count,
+                "size": self.link_size,
+                "savings": self.link_savings,
+            },
+        }
+
+    def report(self, limit=None):
+        """return a text report, with paths and classes sorted by decreasing size
+
+        :param limit: maximum number of paths and classes to display
+        """
+        lines = ["total: %d bytes" % self.size, ""]
+        line_format = "%10s %10s %10s  %s"
+        for title, table in (("path", self.paths), ("class", self.classes)):
+            lines.append(line_format % ("size", "self", "count", title))
+            values = sorted(table.items(), key=lambda x: (-x[1].size, x[0]))
+            for key, usage in values[:limit]:
+                lines.append(
+                    line_format % (usage.size, usage.self_size, usage.count, key)
+                )
+            lines.append("")
+        lines.append(
+            "symbols: %d definitions (%d bytes), %d symlinks (%d bytes, %d bytes saved)"
+            % (
+                self.symbol_count,
+                self.symbol_size,
+                self.symlink_count,
+                self.symlink_size,
+                self.symlink_savings,
+            )
+        )
+        lines.append(
+            "links: %d links (%d bytes, %d bytes saved)"
+            % (self.link_count, self.link_size, self.link_savings)
+        )
+        return "\n".join(lines)
+
+
+class SizeAnalyzer(Scanner):
+    """scanner that attributes the size of each value to its path"""
+
+    def __init__(self, buffer, offset=0):
+        super().__init__(buffer, offset, record_offsets=True)
+        self.result = SizeReport(0, {}, {})
+        # size of the objects that are the destination of a link
+        self.object_sizes = {}
+
+    @staticmethod
+    def add(table, key, size, self_size):
+        usage = table.get(key)
+        if usage is None:
+            usage = table[key] = Usage()
+        usage.count += 1
+        usage.size += size
+        usage.self_size += self_size
+
+    def skip_symbol(self):
+        start = self.position
+        token = self.buffer[start] if start < len(self.buffer) else None
+        symbol_id = super().skip_symbol()
+        if token == SYMLINK:
+            size = self.position - start
+            result = self.result
+            result.symlink_count += 1
+            result.symlink_size += size
+            result.symlink_savings += symbol_size(self.symbols[symbol_id]) - size
+        return symbol_id
+
+    def symbol_name(self, symbol_id):
+        return self.symbols[symbol_id].decode("utf-8", "replace")
+
+    def object_size(self, object_id):
+        """return the size of an object that has already been read (or is being read)"""
+        if object_id not in self.object_sizes:
+            start = self.object_offsets[object_id]
+            scanner = Scanner(self.buffer, start)
+            scanner.symbols = list(self.symbols)
+            scanner.object_count = self.object_count
+            scanner.skip()
+            self.object_sizes[object_id] = scanner.position - start
+        return self.object_sizes[object_id]
+
+    def walk(self, path, extra=0):
+        """read a value and return its size
+
+        :param path: path of the value
+        :param extra: number of bytes to attribute to the same path (the hash key)
+        """
+        start = self.position
+        children, class_name = self.read_value(path, start)
+        size = self.position - start + extra
+        self.add(self.result.paths, path, size, size - children)
+        if class_name is not None:
+            self.add(self.result.classes, class_name, size, size - children)
+        return size
+
+    def read_value(self, path, start):
+        """read a value and return the size of its nested values, and its class name"""
+        token = self.read_byte()
+        children, class_name = 0, None
+        if token == NIL or token == TRUE or token == FALSE:
+            pass
+        elif token == FIXNUM:
+            self.read_long()
+        elif token == SYMBOL or token == SYMLINK:
+            self.position = start
+            self.skip_symbol()
+        elif token == LINK:
+            link_id = self.read_long()
+            if not 0 <= link_id < self.object_count:
+                raise ValueError("invalid link destination: %d" % link_id)
+            result = self.result
+            size = self.position - start
+            result.link_count += 1
+            result.link_size += size
+            result.link_savings += self.object_size(link_id) - size
+        elif token == IVAR:
+            children, class_name = self.read_value(path, start)
+            for x in range(self.read_long()):
+                name = self.symbol_name(self.skip_symbol())
+                if name.startswith("@"):
+                    children += self.walk(path + name)
+                else:
+                    self.skip()
+        elif token == STRING or token == FLOAT:
+            self.register_object(start)
+            self.skip_blob()
+        elif token == ARRAY:
+            self.register_object(start)
+            for x in range(self.read_long()):
+                children += self.walk(path + "[*]")
+        elif token == HASH or token == HASH_DEF:
+            self.register_object(start)
+            for x in range(self.read_long()):
+                key_start = self.position
+                key = self.read_key()
+                children += self.walk(path + key, self.position - key_start)
+            if token == HASH_DEF:
+                self.skip()
+        elif token == OBJECT or token == STRUCT:
+            self.register_object(start)
+            class_name = self.symbol_name(self.skip_symbol())
+            separator = "" if token == OBJECT else "."
+            for x in range(self.read_long()):
+                name = self.symbol_name(self.skip_symbol())
+                children += self.walk(path + separator + name)
+        elif token == USERDEF:
+            self.register_object(start)
+            class_name = self.symbol_name(self.skip_symbol())
+            self.skip_blob()
+        elif token == USRMARSHAL or token == DATA:
+            self.register_object(start)
+            class_name = self.symbol_name(self.skip_symbol())
+            children = self.walk(path + "<dump>")
+        elif token == UCLASS or token == EXTENDED:
+            name = self.symbol_name(self.skip_symbol())
+            children, class_name = self.read_value(path, start)
+            if token == UCLASS:
+                class_name = name
+        elif token == BIGNUM:
+            self.register_object(start)
+            self.read_byte()
+            self.skip_bytes(2 * self.read_long())
+        elif token == REGEXP:
+            self.register_object(start)
+            self.skip_blob()
+            self.read_byte()
+        elif token == CLASS or token == MODULE or token == MODULE_OLD:
+            self.register_object(start)
+            self.skip_blob()
+        else:
+            raise ValueError("token %r is not recognized" % bytes([token]))
+        return children, class_name
+
+    def read_key(self):
+        """read a hash key and return its label in paths"""
+        start = self.position
+        token = self.read_byte()
+        if token == SYMBOL or token == SYMLINK:
+            self.position = start
+            return "[:%s]" % self.symbol_name(self.skip_symbol())
+        elif token == FIXNUM:
+            return "[%d]" % self.read_long()
+        elif token == STRING or (token == IVAR and self.read_byte() == STRING):
+            self.register_object(start)
+            text = self.read_blob().decode("utf-8", "replace")
+            if token == IVAR:
+                self.skip_attributes()
+            return "[%s]" % json.dumps(text, ensure_ascii=False)
+        self.position = start
+        self.skip()
+        return "[*]"
+
+
+def analyze(buffer, offset=0):
+    """attribute the bytes of a document to the paths of its values
+
+    :param buffer: bytes-like object (`bytes`, `mmap`, ...)
+    :param offset: offset of the document (its `\\x04\\x08` header)
+    :rtype: :class:`SizeReport`
+    """
+    analyzer = SizeAnalyzer(buffer, skip_header(buffer, offset))
+    analyzer.walk("root", 2)
+    result = analyzer.result
+    result.size = analyzer.position - offset
+    result.symbol_count = len(analyzer.symbols)
+    result.symbol_size = sum(symbol_size(x) for x in analyzer.symbols)
+    return result
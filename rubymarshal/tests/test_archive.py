@@ -0,0 +1,84 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from rubymarshal.archive import Archive, ArchiveWriter, rebuild_index
+from rubymarshal.classes import RubyObject, Symbol
+from rubymarshal.writer import writes
+
+__author__ = "Matthieu Gallet"
+
+
+class TestArchive(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "records.bin")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_write_read(self):
+        with ArchiveWriter(self.path) as writer:
+            self.assertEqual(0, writer.append([1, 2]))
+            self.assertEqual(1, writer.append("text", key="k1"))
+            self.assertEqual(2, writer.append(Symbol("s"), key=3))
+        with Archive(self.path) as archive:
+            self.assertEqual(3, len(archive))
+            self.assertEqual([1, 2], archive.get(0))
+            self.assertEqual("text", archive[1])
+            self.assertEqual(Symbol("s"), archive[-1])
+            self.assertEqual("text", archive.lookup("k1"))
+            self.assertEqual(Symbol("s"), archive.lookup(3))
+            self.assertEqual([[1, 2], "text", Symbol("s")], list(archive))
+
+    def test_append(self):
+        with ArchiveWriter(self.path) as writer:
+            writer.append(1, key="a")
+        with ArchiveWriter(self.path) as writer:
+            self.assertEqual(1, writer.append(2, key="a"))
+            writer.append(3, key="b")
+        with Archive(self.path) as archive:
+            self.assertEqual([1, 2, 3], list(archive))
+            self.assertEqual(2, archive.lookup("a"))
+            self.assertEqual(3, archive.lookup("b"))
+
+    def test_failed_append(self):
+        with ArchiveWriter(self.path) as writer:
+            writer.append([0])
+            with self.assertRaises(ValueError):
+                writer.append([1, object()], key="bad")
+            self.assertEqual(1, writer.append("x"))
+        with Archive(self.path) as archive:
+            self.assertEqual([[0], "x"], list(archive))
+            self.assertEqual({}, archive.keys())
+
+    def test_empty(self):
+        ArchiveWriter(self.path).close()
+        with Archive(self.path) as archive:
+            self.assertEqual(0, len(archive))
+            self.assertEqual([], list(archive))
+
+    def test_rebuild_index(self):
+        with open(self.path, "wb") as fd:
+            for value in ([1], {2: 3}, "four"):
+                fd.write(writes(value))
+        self.assertEqual(3, rebuild_index(self.path, key=lambda x: len(x)))
+        with Archive(self.path) as archive:
+            self.assertEqual({2: 3}, archive[1])
+            self.assertEqual("four", archive.lookup(4))
+        with ArchiveWriter(self.path) as writer:
+            self.assertEqual(3, writer.append(None))
+
+    def test_rebuild_index_without_keys(self):
+        values = [[1, "two"], {Symbol("a"): 3.5}, RubyObject("Unknown", {"@b": 4})]
+        with open(self.path, "wb") as fd:
+            for value in values:
+                fd.write(writes(value))
+        self.assertEqual(3, rebuild_index(self.path))
+        self.assertFalse(os.path.exists(self.path + ".keys"))
+        with Archive(self.path) as archive:
+            self.assertEqual(values, list(archive))
+        with open(self.path, "ab") as fd:
+            fd.write(writes([1, 2])[:-1])
+        with self.assertRaises(ValueError):
+            rebuild_index(self.path)
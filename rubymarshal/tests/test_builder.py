@@ -0,0 +1,101 @@
+import io
+from unittest import TestCase
+
+from rubymarshal.builder import Builder
+from rubymarshal.classes import RubyObject, Symbol
+from rubymarshal.reader import loads
+from rubymarshal.writer import writes
+
+__author__ = "Matthieu Gallet"
+
+
+class TestBuilder(TestCase):
+    def setUp(self):
+        self.fd = io.BytesIO()
+        self.builder = Builder(self.fd)
+
+    def test_same_as_writer(self):
+        builder = self.builder
+        builder.begin_array(4)
+        builder.begin_hash(2)
+        builder.symbol("key")
+        builder.string("value")
+        builder.integer(2**70)
+        builder.float(1.5)
+        builder.end()
+        builder.begin_object("Point", 2)
+        builder.symbol("@x")
+        builder.integer(1)
+        builder.symbol("@y")
+        builder.nil()
+        builder.end()
+        builder.value([Symbol("key"), b"raw"])
+        builder.boolean(True)
+        builder.end()
+        builder.close()
+        value = [
+            {Symbol("key"): "value", 2**70: 1.5},
+            RubyObject("Point", {"@x": 1, "@y": None}),
+            [Symbol("key"), b"raw"],
+            True,
+        ]
+        self.assertEqual(writes(value), self.fd.getvalue())
+
+    def test_links(self):
+        builder = self.builder
+        builder.begin_array(4)
+        self.assertEqual(1, builder.string("text"))
+        self.assertEqual(2, builder.begin_array(0))
+        builder.end()
+        builder.link(2)
+        builder.link(1)
+        builder.end()
+        result = loads(self.fd.getvalue())
+        self.assertEqual(["text", [], [], "text"], result)
+        self.assertIs(result[1], result[2])
+
+    def test_temporary_values(self):
+        builder = self.builder
+        builder.begin_array(8)
+        for x in range(4):
+            builder.value([x])
+            builder.value({"k": [x]})
+        builder.end()
+        builder.close()
+        result = loads(self.fd.getvalue())
+        for x in range(4):
+            self.assertEqual([x], result[2 * x])
+            self.assertEqual({"k": [x]}, result[2 * x + 1])
+
+    def test_shared_value(self):
+        builder = self.builder
+        shared = [1]
+        builder.begin_array(2)
+        builder.value([shared, shared])
+        builder.value(shared)
+        builder.end()
+        result = loads(self.fd.getvalue())
+        self.assertEqual([[[1], [1]], [1]], result)
+        self.assertIs(result[0][0], result[0][1])
+
+    def test_invalid(self):
+        builder = self.builder
+        builder.begin_array(1)
+        with self.assertRaises(ValueError):
+            builder.end()
+        with self.assertRaises(ValueError):
+            builder.link(1)
+        with self.assertRaises(ValueError):
+            builder.close()
+        builder.begin_object("Point", 1)
+        with self.assertRaises(ValueError):
+            builder.integer(1)
+        builder.symbol("@x")
+        builder.integer(1)
+        with self.assertRaises(ValueError):
+            builder.integer(2)
+        builder.end()
+        builder.end()
+        builder.close()
+        with self.assertRaises(ValueError):
+            builder.nil()
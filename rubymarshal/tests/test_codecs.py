@@ -0,0 +1,111 @@
+import datetime
+import decimal
+import fractions
+from unittest import TestCase
+
+from rubymarshal.classes import ClassRegistry, Symbol
+from rubymarshal.codecs import CodecWriter, Range, install
+from rubymarshal.reader import loads
+from rubymarshal.writer import writes
+
+__author__ = "Matthieu Gallet"
+
+registry = ClassRegistry()
+install(registry)
+
+UTC = datetime.timezone.utc
+PLUS_2 = datetime.timezone(datetime.timedelta(hours=2))
+
+# bytes produced by Ruby 3.3
+SAMPLES = [
+    (
+        datetime.datetime(2024, 3, 5, 14, 7, 9, 123456, UTC),
+        b'\x04\bIu:\tTime\r\xae\b\x1f\xc0@\xe2\x91\x1c\x06:\tzoneI"\bUTC\x06:\x06EF',
+    ),
+    (
+        datetime.datetime(2024, 3, 5, 14, 7, 9, tzinfo=PLUS_2),
+        b"\x04\bIu:\tTime\r\xac\b\x1f\x80\x00\x00\x90\x1c\a:\voffseti\x02 \x1c:\tzone0",
+    ),
+    (decimal.Decimal("1"), b"\x04\bu:\x0fBigDecimal\r18:0.1e1"),
+    (decimal.Decimal("-123.456"), b"\x04\bu:\x0fBigDecimal\x1318:-0.123456e3"),
+    (decimal.Decimal("0"), b"\x04\bu:\x0fBigDecimal\v18:0.0"),
+    (
+        decimal.Decimal("12345678901234567890.5"),
+        b'\x04\bu:\x0fBigDecimal"36:0.123456789012345678905e20',
+    ),
+    (fractions.Fraction(1, 3), b"\x04\bU:\rRational[\ai\x06i\b"),
+    (range(1, 5), b"\x04\bo:\nRange\b:\texclT:\nbegini\x06:\bendi\n"),
+    ({1, 2}, b"\x04\bo:\bSet\x06:\n@hash}\ai\x06Ti\aTF"),
+    (
+        datetime.date(2024, 3, 5),
+        b"\x04\bU:\tDate[\vi\x00i\x03\xd7\x8a%i\x00i\x00i\x00f\f2299161",
+    ),
+]
+
+
+class TestCodecs(TestCase):
+    def test_read(self):
+        for value, data in SAMPLES:
+            result = loads(data, registry=registry)
+            self.assertEqual(value, result)
+            self.assertIs(type(value), type(result))
+
+    def test_write(self):
+        for value, data in SAMPLES:
+            self.assertEqual(data, writes(value, cls=CodecWriter))
+
+    def test_read_only(self):
+        self.assertEqual(
+            datetime.datetime(2024, 3, 5, 14, 7, 9, tzinfo=PLUS_2),
+            loads(
+                b"\x04\bU:\rDateTime[\vi\x00i\x03\xd7\x8a%i\x02m\xaai\x00i\x02 \x1cf\f2299161",
+                registry=registry,
+            ),
+        )
+        self.assertEqual(
+            complex(1, 2.5),
+            loads(b"\x04\bU:\fComplex[\ai\x06f\b2.5", registry=registry),
+        )
+        self.assertTrue(
+            loads(
+                writes(decimal.Decimal("NaN"), cls=CodecWriter), registry=registry
+            ).is_nan()
+        )
+
+    def test_round_trip(self):
+        shared = datetime.datetime(2024, 1, 1, tzinfo=UTC)
+        value = {
+            Symbol("created_at"): shared,
+            Symbol("updated_at"): shared,
+            Symbol("price"): decimal.Decimal("-0.001"),
+            Symbol("ratio"): fractions.Fraction(-2, 7),
+            Symbol("z"): complex(1.5, -2),
+            Symbol("tags"): frozenset(["a"]),
+        }
+        result = loads(writes(value, cls=CodecWriter), registry=registry)
+        self.assertEqual(value, result)
+        self.assertIs(result[Symbol("created_at")], result[Symbol("updated_at")])
+        naive = datetime.datetime(2024, 1, 1, 12)
+        self.assertEqual(
+            naive.replace(tzinfo=UTC),
+            loads(writes(naive, cls=CodecWriter), registry=registry),
+        )
+
+    def test_range(self):
+        # 1..5 has no `range` equivalent: `range(1, 6)` would be written as 1...6
+        data = b"\x04\bo:\nRange\b:\texclF:\nbegini\x06:\bendi\n"
+        value = loads(data, registry=registry)
+        self.assertIsInstance(value, Range)
+        self.assertEqual((1, 5, False), (value.begin, value.end, value.exclude_end))
+        self.assertEqual(data, writes(value, cls=CodecWriter))
+        value = loads(writes(slice(1.5, None), cls=CodecWriter), registry=registry)
+        self.assertIsInstance(value, Range)
+        self.assertEqual((1.5, None, True), (value.begin, value.end, value.exclude_end))
+        with self.assertRaises(ValueError):
+            writes(range(0, 10, 2), cls=CodecWriter)
+        with self.assertRaises(ValueError):
+            writes(object(), cls=CodecWriter)
+
+    def test_not_installed(self):
+        result = loads(SAMPLES[0][1])
+        self.assertEqual("Time", result.ruby_class_name)
@@ -0,0 +1,93 @@
+import io
+from unittest import TestCase
+
+from rubymarshal import events
+from rubymarshal.classes import RubyObject, Symbol, UserDef
+from rubymarshal.events import Event, iter_events
+from rubymarshal.writer import writes
+
+__author__ = "Matthieu Gallet"
+
+
+def kinds_values(data):
+    return [(x.kind, x.value) for x in iter_events(io.BytesIO(data))]
+
+
+class TestEvents(TestCase):
+    def test_scalars(self):
+        self.assertEqual([(events.NIL, None)], kinds_values(writes(None)))
+        self.assertEqual([(events.FIXNUM, -300)], kinds_values(writes(-300)))
+        self.assertEqual([(events.BIGNUM, -(2**80))], kinds_values(writes(-(2**80))))
+        self.assertEqual([(events.FLOAT, 1.5)], kinds_values(writes(1.5)))
+        self.assertEqual([(events.STRING, b"ab")], kinds_values(writes(b"ab")))
+
+    def test_string_ivars(self):
+        self.assertEqual(
+            [
+                Event(events.STRING, b"text", 0, 3),
+                Event(events.IVAR, 1, None, 9),
+                Event(events.SYMBOL, "E", 0, 10),
+                Event(events.TRUE, True, None, 13),
+                Event(events.END, None, None, 14),
+            ],
+            list(iter_events(io.BytesIO(writes("text")))),
+        )
+
+    def test_containers(self):
+        shared = [Symbol("a")]
+        data = writes({1: shared, 2: [shared, Symbol("a")], 3: []})
+        self.assertEqual(
+            [
+                (events.START_HASH, 3),
+                (events.FIXNUM, 1),
+                (events.START_ARRAY, 1),
+                (events.SYMBOL, "a"),
+                (events.END, None),
+                (events.FIXNUM, 2),
+                (events.START_ARRAY, 2),
+                (events.LINK, 1),
+                (events.SYMLINK, "a"),
+                (events.END, None),
+                (events.FIXNUM, 3),
+                (events.START_ARRAY, 0),
+                (events.END, None),
+                (events.END, None),
+            ],
+            kinds_values(data),
+        )
+
+    def test_objects(self):
+        user_def = UserDef("Time")
+        user_def._load(b"raw")
+        data = writes([RubyObject("Point", {"@x": 1}), RubyObject("Empty"), user_def])
+        self.assertEqual(
+            [
+                (events.START_ARRAY, 3),
+                (events.START_OBJECT, ("Point", 1)),
+                (events.SYMBOL, "@x"),
+                (events.FIXNUM, 1),
+                (events.END, None),
+                (events.START_OBJECT, ("Empty", 0)),
+                (events.END, None),
+                (events.USERDEF, ("Time", b"raw")),
+                (events.END, None),
+            ],
+            kinds_values(data),
+        )
+
+    def test_offsets(self):
+        fd = io.BytesIO(writes([1, "a"]) + b"trailing")
+        reader = events.EventReader(fd)
+        self.assertEqual(8, len(list(reader)))
+        self.assertEqual(15, reader.position)
+        self.assertEqual(b"trailing", fd.read())
+
+    def test_invalid(self):
+        for data in (
+            b"\x04\x08[\x07i\x06",
+            b"\x04\x08@\x00",
+            b"\x04\x08?",
+            b"\x04\x09",
+        ):
+            with self.assertRaises(ValueError):
+                list(iter_events(io.BytesIO(data)))
@@ -0,0 +1,90 @@
+from unittest import TestCase
+
+from rubymarshal.classes import RubyObject, RubyStruct, Symbol
+from rubymarshal.fingerprint import fingerprint
+from rubymarshal.reader import loads
+from rubymarshal.writer import CanonicalWriter, writes
+
+__author__ = "Matthieu Gallet"
+
+# s = "shared"; [{a: s, b: s, "k" => [1.5, 2**35, -2**70]}, :a, 0.1], dumped by Ruby 3.3
+RUBY_SAMPLE = (
+    b'\x04\b[\b{\b:\x06aI"\vshared\x06:\x06EF:\x06b@\aI"\x06k\x06;\x06F'
+    b"[\bf\b1.5l+\b\x00\x00\x00\x00\b\x00l-\n\x00\x00\x00\x00\x00\x00\x00\x00@\x00"
+    b";\x00f\b0.1"
+)
+
+
+class TestFingerprint(TestCase):
+    def test_layout(self):
+        value = loads(RUBY_SAMPLE)
+        expected = fingerprint(RUBY_SAMPLE)
+        # no links, fixnums instead of bignums, floats written with 20 digits
+        self.assertNotEqual(RUBY_SAMPLE, writes(value))
+        self.assertEqual(expected, fingerprint(writes(value)))
+        self.assertEqual(expected, fingerprint(writes(value, cls=CanonicalWriter)))
+        self.assertEqual(
+            fingerprint(b"\x04\b[\a:\x06a;\x00"), fingerprint(b"\x04\b[\a:\x06a:\x06a")
+        )
+        self.assertEqual(
+            fingerprint(writes(RubyObject("Foo", {"@a": 1, "@b": 2}))),
+            fingerprint(writes(RubyObject("Foo", {"@b": 2, "@a": 1}))),
+        )
+        self.assertEqual(32, len(expected))
+        self.assertEqual(16, len(fingerprint(RUBY_SAMPLE, digest_size=16)))
+
+    def test_order(self):
+        first = writes({1: "a", Symbol("b"): [2]})
+        second = writes({Symbol("b"): [2], 1: "a"})
+        self.assertEqual(fingerprint(first), fingerprint(second))
+        self.assertNotEqual(
+            fingerprint(first, ordered=True), fingerprint(second, ordered=True)
+        )
+        self.assertNotEqual(
+            fingerprint(writes(RubyStruct("Point", {"x": 1, "y": 2}))),
+            fingerprint(writes(RubyStruct("Point", {"y": 2, "x": 1}))),
+        )
+
+    def test_different_values(self):
+        values = [
+            None,
+            False,
+            1,
+            1.0,
+            2**80,
+            -(2**80),
+            "a",
+            b"a",
+            Symbol("a"),
+            [1],
+            [[1]],
+            [1, 1],
+            {1: 1},
+            {1: [1]},
+            "x" * 100,
+            "x" * 101,
+            RubyObject("Foo", {"@a": 1}),
+            RubyObject("Bar", {"@a": 1}),
+        ]
+        fingerprints = {fingerprint(writes(x)) for x in values}
+        self.assertEqual(len(values), len(fingerprints))
+
+    def test_cycles(self):
+        value = [1]
+        value.append(value)
+        data = writes(value)
+        self.assertEqual(fingerprint(data), fingerprint(writes(loads(data))))
+        self.assertNotEqual(fingerprint(data), fingerprint(writes([1, [1]])))
+
+    def test_invalid(self):
+        for data in [
+            b"\x04\b[\x07i\x06",
+            b"\x04\b[\x07@\x06i\x06",
+            b"\x04\b;\x00",
+            b"\x04\bX",
+            b"\x04\x09i\x06",
+            b'\x04\b"\x08ab',
+            b"\x04\bi\x02\x01",
+        ]:
+            with self.assertRaises(ValueError):
+                fingerprint(data)
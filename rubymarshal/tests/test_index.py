@@ -0,0 +1,69 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from rubymarshal.classes import RubyObject, Symbol
+from rubymarshal.index import IndexedDocument, build_index
+from rubymarshal.reader import loads
+from rubymarshal.writer import writes
+
+__author__ = "Matthieu Gallet"
+
+
+class TestIndexedDocument(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "document.bin")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_array(self):
+        shared = RubyObject("Shared", {"@name": Symbol("value")})
+        value = [[shared, Symbol("value")], "text", [Symbol("value"), shared], shared]
+        with open(self.path, "wb") as fd:
+            fd.write(writes(value))
+        with IndexedDocument(self.path) as document:
+            self.assertEqual(4, len(document))
+            self.assertEqual(value[2], document[2])
+            self.assertEqual(shared, document[-1])
+            self.assertIs(document[2][1], document[3])
+            self.assertEqual("text", document[1])
+        self.assertTrue(os.path.exists(self.path + ".index"))
+        with IndexedDocument(self.path) as document:
+            self.assertEqual(value, list(document))
+
+    def test_hash(self):
+        value = {Symbol("a"): [1], Symbol("b"): "text", 3: Symbol("a")}
+        with open(self.path, "wb") as fd:
+            fd.write(writes(value))
+        with IndexedDocument(self.path) as document:
+            self.assertEqual((3, Symbol("a")), document[2])
+            self.assertEqual(value, dict(document))
+
+    def test_stale_index(self):
+        with open(self.path, "wb") as fd:
+            fd.write(writes([1, "text", 3]))
+        with IndexedDocument(self.path) as document:
+            self.assertEqual("text", document[1])
+        with open(self.path, "wb") as fd:
+            fd.write(writes(["other", 2, 3]))
+        with self.assertRaises(ValueError):
+            IndexedDocument(self.path)
+        with self.assertRaises(ValueError):
+            IndexedDocument(self.path, index_path=self.path + ".index", offset=1)
+        os.remove(self.path + ".index")
+        with IndexedDocument(self.path) as document:
+            self.assertEqual("other", document[0])
+
+    def test_build_index(self):
+        data = b"prefix" + writes([1, [2], 3])
+        index = build_index(data, 6)
+        self.assertEqual(3, len(index))
+        self.assertEqual([10, 12, 16], list(index.offsets))
+        self.assertEqual([1, 1, 2], list(index.bases))
+        self.assertEqual(
+            [[2], 3], [loads(b"\x04\x08" + data[x:]) for x in index.offsets[1:]]
+        )
+        with self.assertRaises(ValueError):
+            build_index(writes("text"))
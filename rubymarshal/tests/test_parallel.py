@@ -0,0 +1,144 @@
+import os
+import pickle
+import tempfile
+from unittest import TestCase
+
+from rubymarshal.classes import DefaultHash, HashPairs, RubyObject, RubyString, Symbol
+from rubymarshal.parallel import (
+    LinkPlaceholder,
+    parallel_load,
+    parallel_writes,
+    resolve,
+)
+from rubymarshal.reader import loads
+from rubymarshal.tests.test_writer import Constant, ConstantWriter
+from rubymarshal.writer import writes
+
+__author__ = "Matthieu Gallet"
+
+
+class TestParallelLoad(TestCase):
+    def setUp(self):
+        self.shared = [1, 2]
+        self.value = [
+            {
+                Symbol("id"): x,
+                "name": "user %d" % x,
+                Symbol("shared"): self.shared,
+                "point": RubyObject("Point", {"@x": x, "@list": self.shared}),
+            }
+            for x in range(20)
+        ]
+        self.data = writes(self.value)
+
+    def check(self, result):
+        self.assertEqual(self.value, result)
+        for item in result:
+            self.assertIs(result[0][Symbol("shared")], item[Symbol("shared")])
+            self.assertIs(
+                result[0][Symbol("shared")], item["point"].attributes["@list"]
+            )
+
+    def test_bytes(self):
+        self.check(parallel_load(self.data, workers=2, chunk_size=3))
+
+    def test_path(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "data.bin")
+            with open(path, "wb") as fd:
+                fd.write(b"head" + self.data)
+            self.check(parallel_load(path, workers=2, offset=4))
+
+    def test_hash(self):
+        value = {x: [x, self.shared] for x in range(10)}
+        value[Symbol("a")] = self.shared
+        value["b"] = RubyString("text", {"E": False})
+        result = parallel_load(writes(value), workers=2, chunk_size=2)
+        self.assertEqual(value, result)
+        self.assertIs(result[0][1], result[9][1])
+
+    def test_unhashable_key(self):
+        # Ruby: {[1, 2] => "a", 3 => [4]}
+        data = b'\x04\b{\a[\ai\x06i\aI"\x06a\x06:\x06EFi\b[\x06i\t'
+        result = parallel_load(data, workers=2, chunk_size=1)
+        self.assertEqual({(1, 2): "a", 3: [4]}, result)
+        self.assertEqual(loads(data), result)
+
+    def test_link_to_top_level(self):
+        value = [1, [2]]
+        value.append(value)
+        value[1].append(value)
+        result = parallel_load(writes(value), workers=2, chunk_size=1)
+        self.assertEqual(1, result[0])
+        self.assertIs(result, result[2])
+        self.assertIs(result, result[1][1])
+        value = {"a": [1]}
+        value["b"] = value
+        result = parallel_load(writes(value), workers=2, chunk_size=1)
+        self.assertEqual([1], result["a"])
+        self.assertIs(result, result["b"])
+
+    def test_default_hash(self):
+        value = [self.shared, DefaultHash({1: 2}, default=self.shared), [self.shared]]
+        result = parallel_load(writes(value), workers=2, chunk_size=1)
+        self.assertEqual(value, result)
+        self.assertIs(result[0], result[1].default)
+        self.assertIs(result[0], result[2][0])
+
+    def test_resolve_hash_pairs(self):
+        target = RubyString("text", {"E": False})
+        value = HashPairs(
+            [(LinkPlaceholder(3), 1), (2, LinkPlaceholder(3))],
+            default=LinkPlaceholder(3),
+        )
+        # fill the cache, that must be rebuilt
+        self.assertIn(2, value)
+        result = resolve(value, {3: target}, set())
+        self.assertIs(value, result)
+        self.assertEqual([(target, 1), (2, target)], result.pairs)
+        self.assertIs(target, result.default)
+        self.assertIs(target, result[2])
+
+
+class TestPickle(TestCase):
+    def test_symbol(self):
+        self.assertIs(Symbol("a"), pickle.loads(pickle.dumps(Symbol("a"))))
+
+    def test_ruby_string(self):
+        value = RubyString("text", {"E": False})
+        self.assertEqual(value, pickle.loads(pickle.dumps(value)))
+
+
+class TestParallelWrites(TestCase):
+    def test_same_as_writes(self):
+        value = [
+            {
+                Symbol("id"): x,
+                "name": "user %d" % x,
+                "point": RubyObject("Point", {"@x": x, "@y": [x, 2**70, 1.5]}),
+            }
+            for x in range(20)
+        ]
+        for chunk_size in (1, 3, 50):
+            self.assertEqual(
+                writes(value), parallel_writes(value, workers=2, chunk_size=chunk_size)
+            )
+
+    def test_links(self):
+        shared = [1, 2]
+        value = [[shared, "a", shared, Symbol(str(x % 3))] for x in range(10)]
+        result = loads(parallel_writes(value, workers=2, chunk_size=3))
+        self.assertEqual(value, result)
+        self.assertIs(result[0][0], result[0][2])
+        self.assertIs(result[1][0], result[1][2])
+
+    def test_writer_class(self):
+        value = [Constant("a"), Constant("b"), Constant("a")]
+        self.assertEqual(
+            writes(value, cls=ConstantWriter),
+            parallel_writes(value, workers=2, chunk_size=1, cls=ConstantWriter),
+        )
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            parallel_writes({1: 2})
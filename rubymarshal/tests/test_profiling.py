@@ -0,0 +1,78 @@
+import json
+from unittest import TestCase
+
+from rubymarshal.classes import RubyObject, Symbol
+from rubymarshal.profiling import ProfilingReader, ProfilingWriter, Stats
+from rubymarshal.reader import LimitExceeded, Limits, loads
+from rubymarshal.writer import writes
+
+__author__ = "Matthieu Gallet"
+
+
+class TestProfiling(TestCase):
+    def setUp(self):
+        self.value = [
+            1,
+            "text",
+            b"raw",
+            RubyObject("Point", {"@x": 1, "@y": 2.5}),
+            {Symbol("key"): [None, True]},
+        ]
+        self.data = writes(self.value)
+
+    def test_reader(self):
+        documents = []
+        stats = Stats()
+        result = loads(
+            self.data, cls=ProfilingReader, stats=stats, callback=documents.append
+        )
+        self.assertEqual(self.value, result)
+        self.assertEqual([stats], documents)
+        self.assertEqual(1, stats.documents)
+        tokens = stats.tokens
+        # the top-level array and the 4 bytes of `[None, True]`
+        self.assertEqual(2, tokens["TYPE_ARRAY"].count)
+        self.assertEqual(len(self.data) - 2 + 4, tokens["TYPE_ARRAY"].size)
+        self.assertEqual(2, tokens["TYPE_FIXNUM"].count)
+        self.assertEqual(2, tokens["TYPE_STRING"].count)
+        self.assertEqual(1, tokens["TYPE_IVAR"].count)
+        self.assertEqual(1, stats.classes["Point"].count)
+        self.assertEqual(["Point"], list(stats.classes))
+        for counter in tokens.values():
+            self.assertLessEqual(counter.self_time, counter.time)
+
+    def test_limits(self):
+        stats = Stats()
+        limits = Limits(max_bytes=100)
+        result = loads(self.data, cls=ProfilingReader, stats=stats, limits=limits)
+        self.assertEqual(self.value, result)
+        self.assertEqual(len(self.data) - 2 + 4, stats.tokens["TYPE_ARRAY"].size)
+        with self.assertRaises(LimitExceeded):
+            loads(self.data, cls=ProfilingReader, limits=Limits(max_bytes=10))
+
+    def test_writer(self):
+        documents = []
+        data = writes(self.value, cls=ProfilingWriter, callback=documents.append)
+        self.assertEqual(self.data, data)
+        stats = documents[0]
+        self.assertEqual(len(data) - 2 + 4, stats.tokens["TYPE_ARRAY"].size)
+        self.assertEqual(2, stats.tokens["TYPE_ARRAY"].count)
+        self.assertEqual(2, stats.tokens["TYPE_FIXNUM"].count)
+        self.assertEqual(1, stats.tokens["TYPE_IVAR"].count)
+        self.assertEqual(1, stats.classes["Point"].count)
+
+    def test_merge(self):
+        stats = Stats()
+        loads(self.data, cls=ProfilingReader, stats=stats)
+        total = Stats()
+        total.merge(stats)
+        total.merge(stats)
+        self.assertEqual(2, total.documents)
+        self.assertEqual(4, total.tokens["TYPE_FIXNUM"].count)
+        self.assertEqual(
+            2 * stats.tokens["TYPE_ARRAY"].size, total.tokens["TYPE_ARRAY"].size
+        )
+        json.dumps(total.as_dict())
+        self.assertIn("TYPE_ARRAY", total.report())
+        total.reset()
+        self.assertEqual({}, total.tokens)
@@ -5,22 +5,38 @@ A complete documentation can be found at :mod:`unittest`.
 
 """
 
+import gzip
 import io
 import math
 import re
 import unittest
+import zlib
 from unittest.case import TestCase
 
 from rubymarshal.classes import (
     ClassRegistry,
+    DefaultHash,
+    HashPairs,
     Module,
+    RubyData,
     RubyObject,
     RubyString,
+    RubyStruct,
     Symbol,
+    UserClass,
     UsrMarshal,
     UserDef,
 )
-from rubymarshal.reader import load, loads
+from rubymarshal.profiling import ProfilingReader
+from rubymarshal.reader import (
+    DecompressingReader,
+    LimitExceeded,
+    Limits,
+    iter_load,
+    load,
+    loads,
+    loads_from,
+)
 from rubymarshal.writer import writes
 
 __author__ = "Matthieu Gallet"
@@ -333,6 +349,265 @@ class TestUsrMarshal(TestCase):
         self.assertEqual(loads(b'\x04\bU:\x11Gem::Version[\x06I"\n0.1.2\x06:\x06ET'), a)
 
 
+class Point(RubyStruct):
+    ruby_class_name = "Point"
+
+
+class MyString(UserClass):
+    ruby_class_name = "MyString"
+
+
+class TestStruct(TestCase):
+    data = b'\x04\bS:\nPoint\a:\x06xi\x06:\x06yI"\x06a\x06:\x06ET'
+
+    def test_struct(self):
+        result = loads(self.data)
+        self.assertEqual(RubyStruct("Point", {"x": 1, "y": "a"}), result)
+        self.assertEqual("Point", result.ruby_class_name)
+        self.assertEqual({}, result.attributes)
+
+    def test_registry(self):
+        struct_registry = ClassRegistry()
+        struct_registry.register(Point)
+        result = loads(self.data, registry=struct_registry)
+        self.assertIsInstance(result, Point)
+        self.assertEqual({"x": 1, "y": "a"}, result.members)
+        struct_registry.register(DemoString)
+        with self.assertRaises(ValueError):
+            loads(b"\x04\bS:\vString\x00", registry=struct_registry)
+
+
+class TestUserClass(TestCase):
+    def test_string(self):
+        result = loads(b'\x04\bIC:\rMyString"\babc\x06:\x06ET')
+        self.assertEqual(UserClass("MyString", "abc"), result)
+        self.assertEqual("MyString", result.ruby_class_name)
+
+    def test_containers(self):
+        self.assertEqual(
+            UserClass("MyArray", [1, 2]), loads(b"\x04\bC:\fMyArray[\ai\x06i\a")
+        )
+        self.assertEqual(
+            UserClass("MyHash", {1: 2}), loads(b"\x04\bC:\vMyHash{\x06i\x06i\a")
+        )
+        self.assertEqual(
+            UserClass("MyRe", re.compile("ab")),
+            loads(b"\x04\bIC:\tMyRe/\aab\x00\x06:\x06EF"),
+        )
+
+    def test_links(self):
+        result = loads(b"\x04\b[\tC:\fMyArray[\x06i\x06@\x06I\"\x06z\x06:\x06ET@\x06")
+        self.assertEqual(UserClass("MyArray", [1]), result[0])
+        self.assertIs(result[0], result[1])
+        self.assertIs(result[0], result[3])
+        self.assertEqual("z", result[2])
+
+    def test_registry(self):
+        string_registry = ClassRegistry()
+        string_registry.register(MyString)
+        result = loads(
+            b'\x04\b[\aIC:\rMyString"\x06x\x06:\x06ET@\x06', registry=string_registry
+        )
+        self.assertIsInstance(result[0], MyString)
+        self.assertIs(result[0], result[1])
+        self.assertEqual("x", result[0].value)
+
+
+class TestData(TestCase):
+    def test_data(self):
+        result = loads(b"\x04\bd:\x10OpenSSL::BN[\ai\x06i\a")
+        self.assertIsInstance(result, RubyData)
+        self.assertEqual("OpenSSL::BN", result.ruby_class_name)
+        self.assertEqual([1, 2], result._dump_data())
+
+
+class TestDefaultHash(TestCase):
+    def test_default(self):
+        result = loads(b"\x04\b}\x06i\x06i\ai\n")
+        self.assertIsInstance(result, DefaultHash)
+        self.assertEqual({1: 2}, result)
+        self.assertEqual(5, result.default)
+        self.assertEqual(DefaultHash({1: 2}, default=5), result)
+        self.assertNotEqual(DefaultHash({1: 2}, default=6), result)
+
+
+class TestCycles(TestCase):
+    # bytes produced by Ruby 3.3
+    def test_array(self):
+        result = loads(b"\x04\b[\ai\x06@\x00")
+        self.assertEqual(1, result[0])
+        self.assertIs(result, result[1])
+
+    def test_hash(self):
+        result = loads(b"\x04\b{\x06:\tself@\x00")
+        self.assertIs(result, result[Symbol("self")])
+
+    def test_parent(self):
+        root = loads(
+            b"\x04\bo:\tNode\a:\f@parent0:\x0e@children[\x06o;\x00\a;\x06@\x00;\a[\x00"
+        )
+        child = root.attributes["@children"][0]
+        self.assertIs(root, child.attributes["@parent"])
+        self.assertEqual([], child.attributes["@children"])
+
+    def test_struct(self):
+        result = loads(b"\x04\bS:\x06S\x06:\ame@\x00")
+        self.assertIs(result, result.members["me"])
+
+    def test_user_class(self):
+        result = loads(b"\x04\bC:\fMyArray[\x06@\x00")
+        self.assertIsInstance(result, UserClass)
+        self.assertIs(result, result.value[0])
+
+    def test_round_trip(self):
+        value = RubyObject("Node", {"@children": []})
+        value.attributes["@children"].append(RubyObject("Node", {"@parent": value}))
+        data = writes(value)
+        self.assertEqual(data, writes(loads(data)))
+        result = loads(data)
+        self.assertIs(result, result.attributes["@children"][0].attributes["@parent"])
+
+
+class TestHooks(TestCase):
+    def test_object_hook(self):
+        shared = RubyObject("Point", {"@x": 1, "@y": 2})
+        data = writes([shared, shared, RubyObject("Other")])
+        calls = []
+
+        def object_hook(class_name, attributes):
+            calls.append(class_name)
+            return (class_name, attributes)
+
+        result = loads(data, object_hook=object_hook)
+        self.assertEqual(("Point", {"@x": 1, "@y": 2}), result[0])
+        self.assertIs(result[0], result[1])
+        self.assertEqual(("Other", {}), result[2])
+        self.assertEqual(["Point", "Other"], calls)
+
+    def test_hash_hook(self):
+        shared = {Symbol("a"): 1}
+        result = loads(writes([shared, shared]), hash_hook=list)
+        self.assertEqual([(Symbol("a"), 1)], result[0])
+        self.assertIs(result[0], result[1])
+        # unhashable keys are kept as they are (`{[1, 2] => 3}` in Ruby)
+        result = loads(b"\x04\b{\x06[\ai\x06i\ai\b", hash_hook=list)
+        self.assertEqual([([1, 2], 3)], result)
+
+    def test_string_hook(self):
+        text = RubyString("abc", {"E": True, "@tag": 1})
+        data = writes(["abc", b"raw", text, text])
+        result = loads(data, string_hook=lambda x: ("string", x))
+        self.assertEqual(("string", "abc"), result[0])
+        self.assertEqual(("string", b"raw"), result[1])
+        self.assertEqual(("string", text), result[2])
+        self.assertIs(result[2], result[3])
+
+    def test_symbol_hook(self):
+        value = [Symbol("a"), Symbol("a"), RubyObject("Point", {"@x": Symbol("b")})]
+        result = loads(writes(value), symbol_hook=str)
+        self.assertEqual(["a", "a", RubyObject("Point", {"@x": "b"})], result)
+        self.assertEqual("Point", result[2].ruby_class_name)
+
+    def test_profiling(self):
+        result = loads(writes({1: "a"}), cls=ProfilingReader, hash_hook=dict)
+        self.assertEqual({1: "a"}, result)
+
+
+class TestSymbolsAsStr(TestCase):
+    def test_symbols(self):
+        value = {
+            Symbol("id"): 1,
+            Symbol("tags"): [Symbol("a"), Symbol("id")],
+            Symbol("point"): RubyObject("Point", {"@x": Symbol("a")}),
+        }
+        result = loads(writes(value), symbols_as_str=True)
+        self.assertEqual(
+            {"id": 1, "tags": ["a", "id"], "point": RubyObject("Point", {"@x": "a"})},
+            result,
+        )
+        self.assertIs(type(result["tags"][0]), str)
+        self.assertIs(result["tags"][1], list(result)[0])
+        self.assertEqual("Point", result["point"].ruby_class_name)
+
+    def test_round_trip(self):
+        data = writes({Symbol("id"): 1, "name": {Symbol("id"): 2}})
+        result = loads(data, symbols_as_str=True)
+        self.assertEqual({"id": 1, "name": {"id": 2}}, result)
+        self.assertEqual(data, writes(result, symbol_keys={"id"}))
+
+
+class TestHashPairs(TestCase):
+    def test_pairs(self):
+        result = loads(writes({Symbol("a"): 1, 2: [3]}), hash_pairs=True)
+        self.assertIsInstance(result, HashPairs)
+        self.assertEqual([(Symbol("a"), 1), (2, [3])], result.pairs)
+        self.assertEqual(1, result[Symbol("a")])
+        self.assertIn(2, result)
+        self.assertEqual({Symbol("a"): 1, 2: [3]}, result.to_dict())
+        self.assertEqual([Symbol("a"), 2], list(result))
+
+    def test_unhashable_keys(self):
+        # {[1, 2] => 3, {4 => 5} => 6} in Ruby
+        data = b"\x04\b{\a[\ai\x06i\ai\b{\x06i\ti\ni\v"
+        result = loads(data, hash_pairs=True)
+        self.assertEqual(
+            [([1, 2], 3), (HashPairs([(4, 5)]), 6)],
+            result.pairs,
+        )
+        self.assertEqual(data, writes(result))
+
+    def test_default(self):
+        data = b"\x04\b}\x06i\x06i\ai\n"
+        result = loads(data, hash_pairs=True)
+        self.assertEqual(HashPairs([(1, 2)], default=5), result)
+        self.assertEqual(data, writes(result))
+
+    def test_cycle(self):
+        result = loads(b"\x04\b{\x06:\tself@\x00", hash_pairs=True)
+        self.assertIs(result, result[Symbol("self")])
+
+    def test_user_class(self):
+        # subclass of Hash with an instance variable, dumped by Ruby 3.3
+        data = b"\x04\bIC:\vMyHash{\x06i\x06i\a\x06:\t@fooi\b"
+        result = loads(data, hash_pairs=True)
+        self.assertEqual(UserClass("MyHash", HashPairs([(1, 2)]), {"@foo": 3}), result)
+        self.assertEqual(data, writes(result))
+
+
+class TestCompression(TestCase):
+    def setUp(self):
+        self.value = [{Symbol("id"): x, "name": "item %d" % x} for x in range(5000)]
+        self.data = writes(self.value)
+
+    def test_zlib(self):
+        compressed = zlib.compress(self.data)
+        self.assertEqual(self.value, loads(compressed))
+        self.assertEqual(self.value, loads(compressed, compression="zlib"))
+        self.assertEqual(self.value, load(io.BytesIO(compressed)))
+
+    def test_gzip(self):
+        compressed = gzip.compress(self.data)
+        self.assertEqual(self.value, loads(compressed))
+        self.assertEqual(self.value, load(io.BytesIO(compressed), compression="gzip"))
+
+    def test_uncompressed(self):
+        self.assertEqual(self.value, loads(self.data, compression=None))
+        with self.assertRaises(ValueError):
+            loads(zlib.compress(self.data), compression=None)
+
+    def test_truncated(self):
+        with self.assertRaises(ValueError):
+            loads(zlib.compress(self.data)[:-100])
+
+    def test_reader(self):
+        fd = DecompressingReader(io.BytesIO(zlib.compress(self.data)))
+        fd.chunk_size = 1000
+        self.assertEqual(self.data[:3], fd.read(3))
+        self.assertEqual(self.data[3:2500], fd.read(2497))
+        self.assertEqual(self.data[2500:], fd.read())
+        self.assertEqual(b"", fd.read(1))
+
+
 class TestSymbol(TestCase):
     def test_symbol(self):
         self.assertEqual(loads(b"\x04\b:\x10test_symbol"), Symbol("test_symbol"))
@@ -557,5 +832,73 @@ class TestLink(TestCase):
         )
 
 
+class TestMultipleDocuments(TestCase):
+    def test_iter_load(self):
+        fd = io.BytesIO(b"\x04\bi\x06\x04\b[\x06:\x06a\x04\b:\x06a")
+        self.assertEqual([1, [Symbol("a")], Symbol("a")], list(iter_load(fd)))
+
+    def test_iter_load_empty(self):
+        self.assertEqual([], list(iter_load(io.BytesIO(b""))))
+
+    def test_iter_load_invalid(self):
+        with self.assertRaises(ValueError):
+            list(iter_load(io.BytesIO(b"\x04\bi\x06\x04")))
+
+    def test_loads_from(self):
+        data = b"header\x04\bi\x06\x04\b[\ai\x07Ttrailer"
+        self.assertEqual((1, 10), loads_from(data, 6))
+        self.assertEqual(([2, True], 17), loads_from(data, 10))
+        self.assertEqual(([2, True], 17), loads_from(bytearray(data), 10))
+        self.assertEqual(([2, True], 17), loads_from(memoryview(data), 10))
+        # compressed documents are rejected, instead of returning a wrong end offset
+        compressed = zlib.compress(writes(1))
+        data = compressed + writes(2)
+        with self.assertRaises(ValueError):
+            loads_from(data)
+        self.assertEqual((2, len(data)), loads_from(data, len(compressed)))
+
+
+class TestLimits(TestCase):
+    def test_valid(self):
+        value = [1, "text", {Symbol("a"): [2.5]}, RubyObject("Point", {"@x": 1})]
+        limits = Limits(
+            max_bytes=200,
+            max_objects=10,
+            max_depth=5,
+            max_string=10,
+            max_array=4,
+            max_hash=1,
+        )
+        self.assertEqual(value, loads(writes(value), limits=limits))
+
+    def test_exceeded(self):
+        cases = [
+            (Limits(max_bytes=5), [1, 2, 3, 4, 5]),
+            (Limits(max_objects=2), [[], []]),
+            (Limits(max_depth=3), [[[[]]]]),
+            (Limits(max_string=3), "text"),
+            (Limits(max_string=3), Symbol("text")),
+            (Limits(max_string=3), 2**70),
+            (Limits(max_array=2), [1, 2, 3]),
+            (Limits(max_hash=1), {1: 2, 3: 4}),
+            (Limits(max_hash=1), RubyObject("Point", {"@x": 1, "@y": 2})),
+        ]
+        for limits, value in cases:
+            with self.assertRaises(LimitExceeded):
+                loads(writes(value), limits=limits)
+
+    def test_fail_fast(self):
+        # a string that claims to be 1 GB long
+        data = b"\x04\b\"\x04\x00\x00\x00\x40"
+        with self.assertRaises(LimitExceeded):
+            loads(data, limits=Limits(max_bytes=1000))
+        with self.assertRaises(LimitExceeded):
+            loads(data, limits=Limits(max_string=1000))
+
+    def test_negative_length(self):
+        with self.assertRaises(ValueError):
+            loads(b"\x04\b\"\xfa")
+
+
 if __name__ == "__main__":
     unittest.main()
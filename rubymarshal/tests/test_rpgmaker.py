@@ -0,0 +1,79 @@
+from unittest import TestCase, skipIf
+
+from rubymarshal.classes import ClassRegistry
+from rubymarshal.reader import loads
+from rubymarshal.rpgmaker import Color, Table, Tone, install
+from rubymarshal.writer import writes
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = "Matthieu Gallet"
+
+registry = ClassRegistry()
+install(registry)
+
+# bytes produced by Ruby 3.3 (with minimal `Table`, `Color` and `Tone` classes)
+SAMPLE = (
+    b"\x04\x08[\x08u:\nTable)\x03\x00\x00\x00\x02\x00\x00\x00\x02\x00\x00\x00\x02\x00\x00\x00"
+    b"\x08\x00\x00\x00\x00\x00\x01\x00\xfe\xff\x03\x00\x90\x01\x05\x00\x00\x80\xff\x7f"
+    b"u:\nColor%\x00\x00\x00\x00\x00\xe0o@\x00\x00\x00\x00\x00\x00`@\x00\x00\x00\x00\x00\x00"
+    b"\x00\x00\x00\x00\x00\x00\x00\xe0o@"
+    b"u:\tTone%\x00\x00\x00\x00\x00\x00A\xc0\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+    b"\x00\x00Q@\x00\x00\x00\x00\x00\x801@"
+)
+VALUES = [0, 1, -2, 3, 400, 5, -32768, 32767]
+
+
+class TestRPGMaker(TestCase):
+    def test_read(self):
+        table, color, tone = loads(SAMPLE, registry=registry)
+        self.assertIsInstance(table, Table)
+        self.assertEqual(
+            (3, 2, 2, 2), (table.dimensions, table.xsize, table.ysize, table.zsize)
+        )
+        self.assertEqual(VALUES, table.values.tolist())
+        self.assertEqual(8, len(table))
+        self.assertEqual(-2, table[0, 1])
+        self.assertEqual(5, table[1, 0, 1])
+        self.assertEqual(32767, table[7])
+        self.assertEqual(Color.from_values(255, 128, 0, 255), color)
+        self.assertEqual((128.0, 255.0), (color.green, color.alpha))
+        self.assertEqual((-34.0, 17.5), (tone.red, tone.gray))
+        self.assertNotEqual(Color.from_values(-34, 0, 68, 17.5), tone)
+
+    def test_write(self):
+        value = [
+            Table.from_values(VALUES, 2, 2, 2),
+            Color.from_values(255, 128, 0, 255),
+            Tone.from_values(-34, 0, 68, 17.5),
+        ]
+        self.assertEqual(SAMPLE, writes(value))
+        self.assertEqual(value, loads(SAMPLE, registry=registry))
+
+    def test_no_copy(self):
+        data = bytearray(SAMPLE)
+        table = Table("Table")
+        table._load(data[13:49])
+        self.assertIs(table._private_data, table._dump())
+        self.assertEqual(VALUES, table.values.tolist())
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            Table.from_values(VALUES, 3, 3)
+        with self.assertRaises(ValueError):
+            loads(SAMPLE[:29] + b"\x07" + SAMPLE[30:], registry=registry)
+        with self.assertRaises(ValueError):
+            Table("Table")._load(b"\x01\x00")
+        with self.assertRaises(ValueError):
+            Color.from_values(1, 2, 3)
+
+    @skipIf(numpy is None, "NumPy is not installed")
+    def test_numpy(self):
+        table = loads(SAMPLE, registry=registry)[0]
+        array = table.to_numpy()
+        self.assertEqual((2, 2, 2), array.shape)
+        self.assertEqual(5, array[1, 0, 1])
+        self.assertEqual(VALUES, array.ravel().tolist())
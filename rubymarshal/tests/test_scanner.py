@@ -0,0 +1,83 @@
+import re
+from unittest import TestCase
+
+from rubymarshal import validate
+from rubymarshal.classes import Module, RubyObject, RubyString, Symbol, UserDef
+from rubymarshal.scanner import Scanner, Validation
+from rubymarshal.writer import writes
+
+__author__ = "Matthieu Gallet"
+
+
+class TestScanner(TestCase):
+    def test_skip(self):
+        shared = [1, 2]
+        data = writes([Symbol("a"), shared, "text", Symbol("a"), shared, 2**70])
+        scanner = Scanner(data, 2, record_offsets=True)
+        scanner.skip()
+        self.assertEqual(len(data), scanner.position)
+        self.assertEqual([b"a", b"E"], scanner.symbols)
+        self.assertEqual(4, scanner.object_count)
+        self.assertEqual({1}, scanner.link_targets)
+        self.assertEqual([2, 7, 13, 29], scanner.object_offsets)
+
+    def test_invalid(self):
+        for data in (b"[\x07i\x06", b"@\x00", b";\x00", b"?"):
+            with self.assertRaises(ValueError):
+                Scanner(data).skip()
+
+
+class TestValidate(TestCase):
+    def setUp(self):
+        shared = [1, 2]
+        raw = UserDef("Raw", {})
+        raw._load(b"raw data")
+        self.data = writes(
+            [
+                Symbol("a"),
+                shared,
+                "text",
+                Symbol("a"),
+                shared,
+                2**70,
+                -(2**40),
+                {1: [1.5, None, True, False]},
+                re.compile("ab", re.IGNORECASE),
+                RubyObject("Point", {"@x": 1, "@y": RubyString("y", {"E": False})}),
+                raw,
+                Module("Kernel", None),
+                b"x" * 300,
+            ]
+        )
+
+    def test_valid(self):
+        self.assertEqual(Validation(len(self.data), 14, 6, 1, 4), validate(self.data))
+        self.assertEqual(
+            Validation(len(self.data), 14, 6, 1, 4),
+            validate(b"head" + self.data, 4),
+        )
+        # array that contains itself
+        self.assertEqual(Validation(6, 1, 0, 1, 2), validate(b"\x04\b[\x06@\x00"))
+
+    def test_truncated(self):
+        for size in range(2, len(self.data)):
+            with self.assertRaises(ValueError):
+                validate(self.data[:size])
+
+    def test_trailing(self):
+        with self.assertRaises(ValueError):
+            validate(self.data + b"0")
+        self.assertEqual(len(self.data), validate(self.data + b"0", trailing=True).size)
+
+    def test_invalid(self):
+        for data in (
+            b"\x04\b[\x07i\x06",
+            b"\x04\b@\x00",
+            b"\x04\b;\x00",
+            b"\x04\b?",
+            b'\x04\b"\xfa',
+            b"\x04\b[\xfa",
+            b"\x04\a0",
+        ):
+            with self.assertRaises(ValueError):
+                validate(data)
@@ -0,0 +1,72 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from rubymarshal.classes import RubyObject, Symbol
+from rubymarshal.sizes import analyze, symbol_size
+from rubymarshal.writer import writes
+
+__author__ = "Matthieu Gallet"
+
+
+class TestSizes(TestCase):
+    def setUp(self):
+        items = [RubyObject("Item", {"@price": 1.5, "@name": "abc"}) for x in range(3)]
+        self.value = {Symbol("cart"): {"items": items, 2: None}}
+        self.data = writes(self.value)
+
+    def test_paths(self):
+        result = analyze(self.data)
+        paths = result.paths
+        self.assertEqual(len(self.data), result.size)
+        self.assertEqual(len(self.data), paths["root"].size)
+        self.assertEqual(
+            len(self.data), sum(usage.self_size for usage in paths.values())
+        )
+        self.assertEqual(3, paths['root[:cart]["items"][*]'].count)
+        self.assertEqual(3, paths['root[:cart]["items"][*]@price'].count)
+        # "i\x07" + "0"
+        self.assertEqual(3, paths["root[:cart][2]"].size)
+        self.assertEqual(3, result.classes["Item"].count)
+        self.assertEqual(
+            paths['root[:cart]["items"][*]'].size, result.classes["Item"].size
+        )
+        self.assertIn('root[:cart]["items"][*]@name', result.report())
+
+    def test_savings(self):
+        result = analyze(self.data)
+        # cart, E, Item, @price, @name
+        self.assertEqual(5, result.symbol_count)
+        self.assertEqual(
+            sum(symbol_size(x) for x in (b"cart", b"E", b"Item", b"@price", b"@name")),
+            result.symbol_size,
+        )
+        # Item, @price, @name (twice) and E (for each string but the first one)
+        self.assertEqual(9, result.symlink_count)
+        self.assertEqual(18, result.symlink_size)
+        items = [1, 2, 3]
+        result = analyze(writes([items, items]))
+        self.assertEqual(1, result.link_count)
+        self.assertEqual(2, result.link_size)
+        self.assertEqual(len(writes(items)) - 2 - 2, result.link_savings)
+        self.assertEqual(2, result.paths["root[*]"].count)
+
+    def test_symbol_size(self):
+        for size in (0, 5, 122, 123, 255, 256, 70000):
+            name = "a" * size
+            self.assertEqual(len(writes(Symbol(name))) - 2, symbol_size(name))
+
+    def test_cli(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "data.bin")
+            with open(path, "wb") as fd:
+                fd.write(self.data)
+            output = subprocess.check_output(
+                [sys.executable, "-m", "rubymarshal", "sizes", "--json", path]
+            )
+        result = json.loads(output)
+        self.assertEqual(len(self.data), result["size"])
+        self.assertEqual(3, result["classes"]["Item"]["count"])
@@ -0,0 +1,133 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from rubymarshal.classes import RubyObject, RubyString, Symbol, UserDef
+from rubymarshal.reader import iter_load, loads
+from rubymarshal.transcode import (
+    BINARY_LATIN1,
+    SYMBOLS_OBJECT,
+    json_to_marshal,
+    marshal_to_json,
+)
+from rubymarshal.writer import writes
+
+__author__ = "Matthieu Gallet"
+
+
+def to_json(data, **kwargs):
+    dst = io.StringIO()
+    marshal_to_json(io.BytesIO(data), dst, **kwargs)
+    return [json.loads(x) for x in dst.getvalue().splitlines()]
+
+
+class TestMarshalToJSON(TestCase):
+    def test_values(self):
+        value = {
+            Symbol("name"): "text",
+            "list": [1, 2**70, 1.5, None, True, False, Symbol("s")],
+            3: b"\xff",
+            Symbol("obj"): RubyObject("Point", {"@x": 1}),
+            Symbol("enc"): RubyString("\xe9", {"E": False}),
+        }
+        self.assertEqual(
+            [
+                {
+                    "name": "text",
+                    "list": [1, 2**70, 1.5, None, True, False, "s"],
+                    "3": {"$binary": "/w=="},
+                    "obj": {"$class": "Point", "@x": 1},
+                    "enc": "\xe9",
+                }
+            ],
+            to_json(writes(value)),
+        )
+
+    def test_options(self):
+        user_def = UserDef("Time", {"zone": "UTC"})
+        user_def._load(b"\x01")
+        data = writes([Symbol("s"), b"\xe9", user_def, RubyObject("Point", {"@x": 1})])
+        self.assertEqual(
+            [
+                {"$symbol": "s"},
+                "\xe9",
+                {"$data": "AQ==", "zone": "UTC"},
+                {"@x": 1},
+            ],
+            to_json(
+                data,
+                lines=True,
+                symbols=SYMBOLS_OBJECT,
+                binary=BINARY_LATIN1,
+                class_key=None,
+            ),
+        )
+
+    def test_documents(self):
+        shared = [1]
+        data = (
+            writes([shared, shared]) + writes({Symbol("a"): [shared, 2]}) + writes(None)
+        )
+        self.assertEqual([[[1], {"$link": 1}], {"a": [[1], 2]}, None], to_json(data))
+
+
+class TestJSONToMarshal(TestCase):
+    def test_round_trip(self):
+        src = io.StringIO(
+            '{"$class": "Point", "@x": {"$symbol": "s"}}\n\n'
+            '{"key": [1, 2.5, {"$binary": "/w=="}]}\n'
+        )
+        dst = io.BytesIO()
+        json_to_marshal(src, dst, symbol_keys=True)
+        dst.seek(0)
+        self.assertEqual(
+            [
+                RubyObject("Point", {"@x": Symbol("s")}),
+                {Symbol("key"): [1, 2.5, b"\xff"]},
+            ],
+            list(iter_load(dst)),
+        )
+
+    def test_lines(self):
+        dst = io.BytesIO()
+        json_to_marshal(io.StringIO('"a"\n1\n'), dst, lines=True)
+        self.assertEqual(["a", 1], loads(dst.getvalue()))
+        dst = io.BytesIO()
+        json_to_marshal(io.StringIO('"a"\n1\n[2]'), dst, lines=True, spool_size=4)
+        self.assertEqual(["a", 1, [2]], loads(dst.getvalue()))
+
+    def test_lines_containers(self):
+        src = "".join('[%d, {"k": %d}]\n' % (x, x) for x in range(50))
+        dst = io.BytesIO()
+        json_to_marshal(io.StringIO(src), dst, lines=True)
+        self.assertEqual([[x, {"k": x}] for x in range(50)], loads(dst.getvalue()))
+
+
+class TestCommandLine(TestCase):
+    def test_to_json(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "data.bin")
+            with open(path, "wb") as fd:
+                fd.write(writes([1, "a"]))
+            output = subprocess.check_output(
+                [sys.executable, "-m", "rubymarshal", "to-json", "--lines", path]
+            )
+        self.assertEqual(b'1\n"a"\n', output)
+
+    def test_from_json_stdin(self):
+        output = subprocess.check_output(
+            [sys.executable, "-m", "rubymarshal", "from-json", "--lines"],
+            input=b'"a"\n\n{"b": 1}\n[2]',
+        )
+        self.assertEqual(["a", {"b": 1}, [2]], loads(output))
+
+    def test_from_json_containers(self):
+        output = subprocess.check_output(
+            [sys.executable, "-m", "rubymarshal", "from-json", "--lines"],
+            input=b"".join(b'[%d, {"k": %d}]\n' % (x, x) for x in range(50)),
+        )
+        self.assertEqual([[x, {"k": x}] for x in range(50)], loads(output))
@@ -1,11 +1,32 @@
 import io
 import math
+import mmap
 import re
 from unittest import TestCase
 
-from rubymarshal.classes import Symbol, UsrMarshal
+from rubymarshal.classes import (
+    DefaultHash,
+    RubyData,
+    RubyObject,
+    RubyString,
+    RubyStruct,
+    Symbol,
+    UserClass,
+    UsrMarshal,
+)
+from rubymarshal.profiling import ProfilingWriter
 from rubymarshal.reader import loads
-from rubymarshal.writer import Writer, writes
+from rubymarshal.writer import (
+    CanonicalWriter,
+    Writer,
+    encoded_size,
+    float_text,
+    grow_bytearray,
+    long_size,
+    write_into,
+    writes,
+    writes_buffers,
+)
 
 __author__ = "Matthieu Gallet"
 
@@ -36,6 +57,117 @@ class CustomWriter(TestCase):
         self.assertEqual([Symbol("test")], read_constant)
 
 
+class TestObjectLinks(TestCase):
+    def test_links_after_unlinked_objects(self):
+        shared = [1, 2]
+        result = loads(writes(["a", b"b", 1.5, 2**70, re.compile("c"), shared, shared]))
+        self.assertEqual([1, 2], result[6])
+        self.assertIs(result[5], result[6])
+
+
+class TestEncodedSize(TestCase):
+    def test_values(self):
+        shared = [1, 2]
+        usr = UsrMarshal("Gem::Version")
+        usr.marshal_load(["0.1.2"])
+        values = [
+            None,
+            [shared, shared, Symbol("a"), Symbol("a")],
+            {"text": "\xe9t\xe9", 2**70: -(2**200), 1.5: re.compile("a")},
+            RubyObject("Point", {"@x": 1, "@y": RubyString("y", {"E": False})}),
+            usr,
+            list(range(-70000, 70000, 99)),
+            [0.1, 1e20, -0.0, 2**40, -(2**39), 2**41, b"\xff" * 200, "x" * 200],
+            [Symbol("\xe9"), Symbol("\xe9"), "\u2713", True, False],
+        ]
+        for value in values:
+            self.assertEqual(len(writes(value)), encoded_size(value))
+            self.assertEqual(
+                len(writes(value, cls=CanonicalWriter)),
+                encoded_size(value, cls=CanonicalWriter),
+            )
+
+    def test_writer_class(self):
+        value = [Constant("test"), Constant("test")]
+        self.assertEqual(
+            len(writes(value, cls=ConstantWriter)),
+            encoded_size(value, cls=ConstantWriter),
+        )
+        self.assertEqual(len(writes(value[:0])), encoded_size([], cls=ProfilingWriter))
+
+        class StringWriter(Writer):
+            def write_bytes(self, obj):
+                super().write_bytes(obj + b"!")
+
+        value = ["a", b"b", [Symbol("c")]]
+        self.assertEqual(
+            len(writes(value, cls=StringWriter)),
+            encoded_size(value, cls=StringWriter),
+        )
+
+    def test_long_size(self):
+        for value in (0, 1, 122, 123, -123, -124, 255, -256, -257, 2**16, -(2**16)):
+            self.assertEqual(len(long_write(value)), long_size(value), value)
+        for value in range(-(2**17), 2**17, 7):
+            self.assertEqual(len(long_write(value)), long_size(value), value)
+
+
+class TestWriteInto(TestCase):
+    def setUp(self):
+        self.value = [1, "text", b"x" * 1000, {Symbol("a"): 1.5}]
+        self.data = writes(self.value)
+
+    def test_bytearray(self):
+        buffer = bytearray(b"head" + bytes(len(self.data)))
+        self.assertEqual(len(buffer), write_into(buffer, self.value, 4))
+        self.assertEqual(b"head" + self.data, buffer)
+        view = memoryview(buffer)
+        self.assertEqual(len(self.data), write_into(view[4:], self.value))
+
+    def test_mmap(self):
+        buffer = mmap.mmap(-1, len(self.data) + 10)
+        end = write_into(buffer, self.value, 10)
+        self.assertEqual(self.data, buffer[10:end])
+        buffer.close()
+
+    def test_too_small(self):
+        with self.assertRaises(ValueError):
+            write_into(bytearray(10), self.value)
+
+    def test_grow(self):
+        buffer = bytearray(10)
+        end = write_into(buffer, self.value, 2, grow=grow_bytearray)
+        self.assertEqual(self.data, buffer[2:end])
+        buffers = []
+
+        def grow(old, size):
+            buffers.append(bytearray(size))
+            buffers[-1][: len(old)] = old
+            return buffers[-1]
+
+        end = write_into(bytearray(10), self.value, grow=grow)
+        self.assertEqual(self.data, buffers[-1][:end])
+
+
+class TestWritesBuffers(TestCase):
+    def test_large_blobs(self):
+        blob = b"x" * 10000
+        value = [1, blob, "text", b"small", blob, {Symbol("a"): blob}]
+        buffers = writes_buffers(value, threshold=1000)
+        self.assertEqual(writes(value), b"".join(buffers))
+        # bytes values are not linked, so the blob is written three times
+        self.assertEqual(6, len(buffers))
+        self.assertIs(blob, buffers[1])
+        self.assertIs(blob, buffers[5])
+        value = [blob, b"other" * 1000]
+        buffers = writes_buffers(value, threshold=1000)
+        self.assertEqual(writes(value), b"".join(buffers))
+        self.assertEqual(4, len(buffers))
+
+    def test_empty(self):
+        self.assertEqual([b"\x04\x080"], writes_buffers(None))
+
+
 class TestWriteLong(TestCase):
     def test_0(self):
         self.assertEqual(b"\x00", long_write(0))
@@ -257,6 +389,155 @@ class TestUsrMarshal(TestIdemPotent):
         self.read_write(a)
 
 
+class TestStruct(TestIdemPotent):
+    def test_struct(self):
+        value = RubyStruct("Point", {"x": 1, "y": "a"})
+        self.assertEqual(
+            b'\x04\bS:\nPoint\a:\x06xi\x06:\x06yI"\x06a\x06:\x06ET', writes(value)
+        )
+        self.read_write(value)
+        self.read_write(RubyStruct("Point", {"x": 1}, {"@z": 2}))
+
+
+class TestData(TestIdemPotent):
+    def test_data(self):
+        value = RubyData("OpenSSL::BN")
+        value._load_data([1, 2])
+        self.assertEqual(b"\x04\bd:\x10OpenSSL::BN[\ai\x06i\a", writes(value))
+        result = loads(writes(value))
+        self.assertEqual([1, 2], result._dump_data())
+
+
+class TestUserClass(TestIdemPotent):
+    def test_values(self):
+        # bytes produced by Ruby 3.3
+        for value, data in (
+            (UserClass("MyString", "abc"), b'\x04\bIC:\rMyString"\babc\x06:\x06ET'),
+            (UserClass("MyArray", [1, 2]), b"\x04\bC:\fMyArray[\ai\x06i\a"),
+            (UserClass("MyHash", {1: 2}), b"\x04\bC:\vMyHash{\x06i\x06i\a"),
+            (
+                UserClass("MyRe", re.compile("ab")),
+                b"\x04\bIC:\tMyRe/\aab\x00\x06:\x06EF",
+            ),
+        ):
+            self.assertEqual(data, writes(value))
+            self.read_write(value)
+
+    def test_links(self):
+        shared = UserClass("MyArray", [1])
+        self.assertEqual(
+            b'\x04\b[\tC:\fMyArray[\x06i\x06@\x06I"\x06z\x06:\x06ET@\x06',
+            writes([shared, shared, "z", shared]),
+        )
+        text = UserClass("MyString", "x")
+        result = loads(writes([text, 1.5, text, [2]]))
+        self.assertIs(result[0], result[2])
+        self.assertEqual([2], result[3])
+
+    def test_attributes(self):
+        self.read_write(UserClass("MyArray", [1], {"@a": 2}))
+        self.read_write(UserClass("MyString", RubyString("x", {"E": False})))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            writes(UserClass("MyInteger", 1))
+
+
+class TestDefaultHash(TestIdemPotent):
+    def test_default(self):
+        value = DefaultHash({1: 2}, default=5)
+        self.assertEqual(b"\x04\b}\x06i\x06i\ai\n", writes(value))
+        self.read_write(value)
+        # a nil default is not written
+        self.assertEqual(writes({1: 2}), writes(DefaultHash({1: 2})))
+
+
+class TestSymbolKeys(TestCase):
+    def test_all_keys(self):
+        self.assertEqual(
+            writes({Symbol("a"): 1, 2: "b"}), writes({"a": 1, 2: "b"}, symbol_keys=True)
+        )
+        self.assertEqual(
+            writes({Symbol("a"): {Symbol("a"): "a"}}),
+            writes({"a": {"a": "a"}}, symbol_keys=True),
+        )
+
+    def test_selected_keys(self):
+        self.assertEqual(
+            writes({Symbol("a"): 1, "b": 2}),
+            writes({"a": 1, "b": 2}, symbol_keys=frozenset(["a"])),
+        )
+        self.assertEqual(writes({"a": 1}), writes({"a": 1}))
+
+    def test_hash_items(self):
+        class ReversedWriter(Writer):
+            def hash_items(self, obj):
+                return reversed(list(super().hash_items(obj)))
+
+        self.assertEqual(
+            writes({2: "b", Symbol("a"): 1}),
+            writes({"a": 1, 2: "b"}, cls=ReversedWriter, symbol_keys=True),
+        )
+
+
+class TestCanonical(TestCase):
+    def test_float_text(self):
+        # texts written by Ruby 3.3
+        for value, text in [
+            (1.0, "1"),
+            (0.1, "0.1"),
+            (100.0, "1e2"),
+            (1e20, "1e20"),
+            (1.5e-7, "1.5e-7"),
+            (1e-5, "1e-5"),
+            (0.0001, "0.0001"),
+            (123456789.125, "123456789.125"),
+            (-2.5e300, "-2.5e300"),
+            (-0.0, "-0"),
+            (math.inf, "inf"),
+            (math.nan, "nan"),
+        ]:
+            self.assertEqual(text, float_text(value))
+        self.assertEqual(b"\x04\bf\b0.1", writes(0.1, cls=CanonicalWriter))
+
+    def test_order(self):
+        shared = "x"
+        first = {"b": [1.5, shared, shared], Symbol("a"): {2: 3, 1: 4}, 1: None}
+        second = {1: None, Symbol("a"): {1: 4, 2: 3}, "b": [1.5, "x", "x"]}
+        data = writes(first, cls=CanonicalWriter)
+        self.assertEqual(data, writes(second, cls=CanonicalWriter))
+        self.assertEqual(first, loads(data))
+        self.assertEqual(
+            writes(RubyObject("Foo", {"@b": 1, "@a": 2}), cls=CanonicalWriter),
+            writes(RubyObject("Foo", {"@a": 2, "@b": 1})),
+        )
+        # struct members keep their order
+        value = RubyStruct("Point", {"y": 1, "x": 2})
+        self.assertEqual(writes(value), writes(value, cls=CanonicalWriter))
+
+    def test_links(self):
+        shared = [1]
+        self.assertEqual(
+            writes([[1], [1]], cls=CanonicalWriter),
+            writes([shared, shared], cls=CanonicalWriter),
+        )
+        value = [1, shared]
+        value.append(value)
+        result = loads(writes(value, cls=CanonicalWriter))
+        self.assertIs(result, result[2])
+        self.assertEqual([1], result[1])
+        # links are numbered after the objects that are not tracked
+        value = ["a", 1.5, value]
+        result = loads(writes(value, cls=CanonicalWriter))
+        self.assertIs(result[2], result[2][2])
+
+    def test_symbol_keys(self):
+        self.assertEqual(
+            writes({Symbol("a"): 1, "b": 2}, cls=CanonicalWriter),
+            writes({"b": 2, "a": 1}, cls=CanonicalWriter, symbol_keys=["a"]),
+        )
+
+
 class TestSymbol(TestIdemPotent):
     def test_symbol(self):
         self.read_write("test_symbol")
@@ -0,0 +1,388 @@
+"""Streaming conversion between Marshal documents and JSON Lines.
+
+Marshal documents are converted from the events of :mod:`rubymarshal.events`, so the object graph is never built:
+memory usage only depends on the nesting depth and on the size of the largest string.
+Each document of the input (concatenated documents are allowed) gives a JSON line.
+
+Ruby values without JSON equivalent are mapped to JSON objects:
+
+  * symbols: plain strings, or `{"$symbol": name}` with `symbols=SYMBOLS_OBJECT`,
+  * strings without encoding: `{"$binary": base64}`, or Latin-1 strings with `binary=BINARY_LATIN1`,
+  * objects and structs: `{"$class": class name, "@ivar": value, ...}`,
+  * user-defined `_dump`: `{"$class": class name, "$data": base64}`,
+  * `marshal_dump` and other wrapped values: `{"$class": class name, "$value": value}`,
+  * regular expressions: `{"$regexp": source, "$options": options}`,
+  * classes and modules: `{"$ruby_class": name}` and `{"$ruby_module": name}`,
+  * links: `{"$link": object index}` (linked objects are not kept in memory).
+
+Hash keys are always converted to strings.
+"""
+
+import base64
+import io
+import json
+import re
+import tempfile
+
+from rubymarshal import events
+from rubymarshal.builder import Builder
+from rubymarshal.classes import Module, RubyObject, Symbol, UserDef, UsrMarshal
+from rubymarshal.writer import Writer, write
+
+__author__ = "Matthieu Gallet"
+
+SYMBOLS_STR = "str"
+SYMBOLS_OBJECT = "object"
+BINARY_BASE64 = "base64"
+BINARY_LATIN1 = "latin-1"
+
+_STARTS = {
+    events.START_ARRAY,
+    events.START_HASH,
+    events.START_HASH_DEF,
+    events.START_OBJECT,
+    events.START_STRUCT,
+    events.START_USRMARSHAL,
+    events.START_DATA,
+    events.START_UCLASS,
+    events.START_EXTENDED,
+    events.IVAR,
+}
+_WRAPPERS = {
+    events.START_USRMARSHAL,
+    events.START_DATA,
+    events.START_UCLASS,
+    events.START_EXTENDED,
+}
+
+
+class EventStream:
+    """iterator over events, with a single event of lookahead"""
+
+    def __init__(self, iterator):
+        self.iterator = iterator
+        self.next_event = None
+
+    def next(self):
+        if self.next_event is not None:
+            event, self.next_event = self.next_event, None
+            return event
+        return next(self.iterator)
+
+    def peek(self):
+        if self.next_event is None:
+            self.next_event = next(self.iterator, None)
+        return self.next_event
+
+
+class MarshalToJSON:
+    """write the JSON text of values given by a stream of events
+
+    :param dst: text file object
+    :param symbols: `SYMBOLS_STR` or `SYMBOLS_OBJECT`
+    :param binary: `BINARY_BASE64` or `BINARY_LATIN1`, for strings without encoding
+    :param class_key: key of the Ruby class name in JSON objects (`None` to drop class names)
+    """
+
+    def __init__(
+        self, dst, symbols=SYMBOLS_STR, binary=BINARY_BASE64, class_key="$class"
+    ):
+        self.dst = dst
+        self.symbols = symbols
+        self.binary = binary
+        self.class_key = class_key
+
+    def convert(self, stream, lines=False):
+        """convert a whole document; with `lines`, each element of a top-level array is written on its own line"""
+        event = stream.next()
+        if lines and event.kind == events.START_ARRAY:
+            for x in range(event.value):
+                self.value(stream, stream.next())
+                self.dst.write("\n")
+            stream.next()
+            self.skip_ivars(stream)
+        else:
+            self.value(stream, event)
+            self.dst.write("\n")
+
+    def value(self, stream, event):
+        write = self.dst.write
+        kind = event.kind
+        if kind == events.NIL:
+            write("null")
+        elif kind == events.TRUE:
+            write("true")
+        elif kind == events.FALSE:
+            write("false")
+        elif kind == events.FIXNUM or kind == events.BIGNUM:
+            write(str(event.value))
+        elif kind == events.FLOAT:
+            write(json.dumps(event.value))
+        elif kind == events.STRING:
+            self.string(event.value, self.read_ivars(stream))
+        elif kind == events.SYMBOL or kind == events.SYMLINK:
+            self.read_ivars(stream)
+            if self.symbols == SYMBOLS_OBJECT:
+                write('{"$symbol": %s}' % json.dumps(event.value))
+            else:
+                write(json.dumps(event.value))
+        elif kind == events.LINK:
+            write('{"$link": %d}' % event.value)
+        elif kind == events.START_ARRAY:
+            write("[")
+            for x in range(event.value):
+                if x:
+                    write(", ")
+                self.value(stream, stream.next())
+            write("]")
+            stream.next()
+            self.skip_ivars(stream)
+        elif kind == events.START_HASH or kind == events.START_HASH_DEF:
+            write("{")
+            for x in range(event.value):
+                if x:
+                    write(", ")
+                write(self.key(stream, stream.next()))
+                write(": ")
+                self.value(stream, stream.next())
+            if kind == events.START_HASH_DEF:
+                self.skip(stream, stream.next())
+            write("}")
+            stream.next()
+            self.skip_ivars(stream)
+        elif kind == events.START_OBJECT or kind == events.START_STRUCT:
+            class_name, count = event.value
+            self.begin_object(class_name)
+            self.attributes(stream, count, bool(self.class_key))
+            stream.next()
+            self.end_object(stream)
+        elif kind == events.USERDEF:
+            class_name, data = event.value
+            self.begin_object(class_name)
+            if self.class_key:
+                write(", ")
+            write('"$data": "%s"' % base64.b64encode(data).decode())
+            self.end_object(stream)
+        elif kind in _WRAPPERS:
+            self.begin_object(event.value)
+            if self.class_key:
+                write(", ")
+            write('"$value": ')
+            self.value(stream, stream.next())
+            stream.next()
+            self.end_object(stream)
+        elif kind == events.REGEXP:
+            source, options = event.value
+            attributes = self.read_ivars(stream)
+            write('{"$regexp": %s, ' % json.dumps(self.decode(source, attributes)))
+            write('"$options": %d}' % options)
+        elif kind == events.CLASS:
+            write('{"$ruby_class": %s}' % json.dumps(event.value))
+        elif kind == events.MODULE:
+            write('{"$ruby_module": %s}' % json.dumps(event.value))
+        else:
+            raise ValueError("unexpected event %r" % (event,))
+
+    def begin_object(self, class_name):
+        self.dst.write("{")
+        if self.class_key:
+            self.dst.write(
+                "%s: %s" % (json.dumps(self.class_key), json.dumps(class_name))
+            )
+
+    def end_object(self, stream):
+        """write the instance variables of the object (if any) and close it"""
+        event = stream.peek()
+        if event is not None and event.kind == events.IVAR:
+            stream.next()
+            self.attributes(stream, event.value, True)
+            stream.next()
+        self.dst.write("}")
+
+    def attributes(self, stream, count, comma):
+        for x in range(count):
+            if comma or x:
+                self.dst.write(", ")
+            name = stream.next()
+            if name.kind not in (events.SYMBOL, events.SYMLINK):
+                raise ValueError("invalid attribute name %r" % (name,))
+            self.dst.write("%s: " % json.dumps(name.value))
+            self.value(stream, stream.next())
+
+    def string(self, data, attributes):
+        if attributes:
+            text = self.decode(data, attributes)
+        elif self.binary == BINARY_LATIN1:
+            text = data.decode("latin-1")
+        else:
+            self.dst.write('{"$binary": "%s"}' % base64.b64encode(data).decode())
+            return
+        self.dst.write(json.dumps(text))
+
+    @staticmethod
+    def decode(data, attributes):
+        encoding = "latin-1"
+        if attributes.get("E") is True:
+            encoding = "utf-8"
+        elif isinstance(attributes.get("encoding"), bytes):
+            encoding = attributes["encoding"].decode()
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            return data.decode("unicode-escape")
+
+    def key(self, stream, event):
+        """return the JSON text of a hash key (always a string)"""
+        if event.kind in (events.SYMBOL, events.SYMLINK):
+            self.read_ivars(stream)
+            return json.dumps(event.value)
+        dst, self.dst = self.dst, io.StringIO()
+        try:
+            self.value(stream, event)
+            text = self.dst.getvalue()
+        finally:
+            self.dst = dst
+        if text.startswith('"'):
+            return text
+        return json.dumps(text)
+
+    def read_ivars(self, stream):
+        """return the instance variables of a scalar as a dict of simple values"""
+        event = stream.peek()
+        if event is None or event.kind != events.IVAR:
+            return {}
+        stream.next()
+        attributes = {}
+        for x in range(event.value):
+            name = stream.next().value
+            value = stream.next()
+            if value.kind in (events.NIL, events.TRUE, events.FALSE, events.FIXNUM):
+                attributes[name] = value.value
+            elif value.kind == events.STRING:
+                self.read_ivars(stream)
+                attributes[name] = value.value
+            else:
+                self.skip(stream, value)
+        stream.next()
+        return attributes
+
+    def skip_ivars(self, stream):
+        event = stream.peek()
+        if event is not None and event.kind == events.IVAR:
+            self.skip(stream, stream.next())
+
+    def skip(self, stream, event):
+        """skip all the events of a value"""
+        depth = 1 if event.kind in _STARTS else 0
+        while depth:
+            event = stream.next()
+            if event.kind in _STARTS:
+                depth += 1
+            elif event.kind == events.END:
+                depth -= 1
+        self.skip_ivars(stream)
+
+
+def marshal_to_json(src, dst, lines=False, **kwargs):
+    """convert all the Marshal documents of a binary file object to JSON Lines
+
+    :param src: binary file object, with one or more concatenated documents
+    :param dst: text file object
+    :param lines: write each element of top-level arrays on its own line
+    :param kwargs: options of :class:`MarshalToJSON`
+    """
+    converter = MarshalToJSON(dst, **kwargs)
+    while True:
+        header = src.read(2)
+        if header == b"":
+            return
+        if header != b"\x04\x08":
+            raise ValueError(r"Expected header \x04\x08")
+        converter.convert(
+            EventStream(iter(events.EventReader(src, header=False))), lines=lines
+        )
+
+
+def from_json(value, class_key="$class", symbol_keys=False):
+    """convert a decoded JSON value to the Python objects expected by :class:`rubymarshal.writer.Writer`
+
+    :param class_key: key of the Ruby class name in JSON objects
+    :param symbol_keys: convert the keys of JSON objects to symbols
+    """
+    kwargs = {"class_key": class_key, "symbol_keys": symbol_keys}
+    if isinstance(value, list):
+        return [from_json(x, **kwargs) for x in value]
+    elif not isinstance(value, dict):
+        return value
+    if len(value) == 1:
+        key, data = next(iter(value.items()))
+        if key == "$binary":
+            return base64.b64decode(data)
+        elif key == "$symbol":
+            return Symbol(data)
+        elif key == "$ruby_module":
+            return Module(data, None)
+        elif key == "$ruby_class":
+            return type(
+                data.rpartition(":")[2], (RubyObject,), {"ruby_class_name": data}
+            )
+        elif key == "$link":
+            raise ValueError("links cannot be converted back to Marshal")
+    if set(value) == {"$regexp", "$options"}:
+        flags = (re.IGNORECASE if value["$options"] & 1 else 0) | (
+            re.MULTILINE if value["$options"] & 4 else 0
+        )
+        return re.compile(value["$regexp"], flags)
+    if class_key and class_key in value:
+        attributes = {
+            k: from_json(v, **kwargs) for (k, v) in value.items() if k[:1] != "$"
+        }
+        if "$data" in value:
+            result = UserDef(value[class_key], attributes)
+            # noinspection PyProtectedMember
+            result._load(base64.b64decode(value["$data"]))
+        elif "$value" in value:
+            result = UsrMarshal(value[class_key], attributes)
+            result.marshal_load(from_json(value["$value"], **kwargs))
+        else:
+            result = RubyObject(value[class_key], attributes)
+        return result
+    return {
+        (Symbol(k) if symbol_keys else k): from_json(v, **kwargs)
+        for (k, v) in value.items()
+    }
+
+
+def json_to_marshal(
+    src, dst, lines=False, cls=Writer, spool_size=16 * 1024 * 1024, **kwargs
+):
+    """convert JSON Lines to Marshal documents, one line at a time
+
+    :param src: text file object, with one JSON value per line
+    :param dst: binary file object
+    :param lines: write a single document with a top-level array of all lines,
+        instead of a document per line
+    :param cls: Writer class to use
+    :param spool_size: with `lines`, maximum size of the lines that are kept in memory
+        (larger inputs are spooled to a temporary file)
+    :param kwargs: options of :func:`from_json`
+    """
+    if not lines:
+        for line in src:
+            if line.strip():
+                write(dst, from_json(json.loads(line), **kwargs), cls=cls)
+        return
+    # the lines are read twice: once to count them, once to convert them
+    with tempfile.SpooledTemporaryFile(max_size=spool_size, mode="w+") as spool:
+        count = 0
+        for line in src:
+            if line.strip():
+                spool.write(line if line.endswith("\n") else line + "\n")
+                count += 1
+        spool.seek(0)
+        builder = Builder(dst, cls=cls)
+        builder.begin_array(count)
+        for line in spool:
+            builder.value(from_json(json.loads(line), **kwargs))
+        builder.end()
+        builder.close()
@@ -3,10 +3,15 @@ import math
 import re
 
 from rubymarshal.classes import (
+    DefaultHash,
+    HashPairs,
     Module,
+    RubyData,
     RubyObject,
     RubyString,
+    RubyStruct,
     Symbol,
+    UserClass,
     UserDef,
     UsrMarshal,
 )
@@ -14,10 +19,12 @@ from rubymarshal.constants import (
     TYPE_ARRAY,
     TYPE_BIGNUM,
     TYPE_CLASS,
+    TYPE_DATA,
     TYPE_FALSE,
     TYPE_FIXNUM,
     TYPE_FLOAT,
     TYPE_HASH,
+    TYPE_HASH_DEF,
     TYPE_IVAR,
     TYPE_LINK,
     TYPE_MODULE,
@@ -25,9 +32,11 @@ from rubymarshal.constants import (
     TYPE_OBJECT,
     TYPE_REGEXP,
     TYPE_STRING,
+    TYPE_STRUCT,
     TYPE_SYMBOL,
     TYPE_SYMLINK,
     TYPE_TRUE,
+    TYPE_UCLASS,
     TYPE_USERDEF,
     TYPE_USRMARSHAL,
 )
@@ -40,10 +49,19 @@ simple_float_re = re.compile(r"^\d+\.\d*0+$")
 
 
 class Writer:
-    def __init__(self, fd):
+    """encode values to a document
+
+    :param fd: the file object
+    :param symbol_keys: `str` hash keys to write as symbols: `True` for all of them,
+      or a collection of names (like the keys decoded with `symbols_as_str`)
+    """
+
+    def __init__(self, fd, symbol_keys=None):
         self.symbols = {}
         self.objects = {}
+        self.object_count = 0
         self.fd = fd
+        self.symbol_keys = symbol_keys
 
     def write(self, obj):
         if obj is None:
@@ -60,6 +78,8 @@ class Writer:
             self.write_list(obj)
         elif isinstance(obj, dict):
             self.write_dict(obj)
+        elif isinstance(obj, HashPairs):
+            self.write_dict(obj)
         elif isinstance(obj, bytes):
             self.write_bytes(obj)
         elif isinstance(obj, str):
@@ -76,6 +96,12 @@ class Writer:
             self.write_usr_marshal(obj)
         elif isinstance(obj, UserDef):
             self.write_user_def(obj)
+        elif isinstance(obj, RubyStruct):
+            self.write_struct(obj)
+        elif isinstance(obj, RubyData):
+            self.write_data(obj)
+        elif isinstance(obj, UserClass):
+            self.write_user_class(obj)
         elif isinstance(obj, RubyObject):
             self.write_ruby_object(obj)
         elif isinstance(obj, type) and issubclass(obj, RubyObject):
@@ -97,6 +123,7 @@ class Writer:
         self.fd.write(TYPE_NIL)
 
     def write_class(self, obj):
+        self.count_object()
         self.fd.write(TYPE_CLASS)
         self.write_long(len(obj.ruby_class_name.encode()))
         self.fd.write(obj.ruby_class_name.encode())
@@ -133,51 +160,126 @@ class Writer:
             if obj.attributes:
                 self.write_attributes(obj.attributes)
 
+    def write_struct(self, obj):
+        if self.must_write(obj):
+            if obj.attributes:
+                self.fd.write(TYPE_IVAR)
+            self.fd.write(TYPE_STRUCT)
+            self.write(Symbol(obj.ruby_class_name))
+            self.write_attributes(obj.members)
+            if obj.attributes:
+                self.write_attributes(obj.attributes)
+
+    def write_data(self, obj):
+        if self.must_write(obj):
+            if obj.attributes:
+                self.fd.write(TYPE_IVAR)
+            self.fd.write(TYPE_DATA)
+            self.write(Symbol(obj.ruby_class_name))
+            # noinspection PyProtectedMember
+            self.write(obj._dump_data())
+            if obj.attributes:
+                self.write_attributes(obj.attributes)
+
+    def write_user_class(self, obj):
+        if id(obj) in self.objects:
+            # write the link
+            self.must_write(obj)
+            return
+        value = obj.value
+        if isinstance(value, str):
+            value = RubyString(value)
+        # the wrapper and the wrapped value share the same index
+        self.objects[id(obj)] = self.object_count
+        if isinstance(value, (RubyString, re_class)):
+            # the instance variables of the wrapped value are written after it
+            self.count_object()
+            self.fd.write(TYPE_IVAR)
+            self.fd.write(TYPE_UCLASS)
+            self.write(Symbol(obj.ruby_class_name))
+            if isinstance(value, RubyString):
+                self.write_string_body(value, {**value.attributes, **obj.attributes})
+            else:
+                self.write_regexp_body(value)
+                self.write_attributes({"E": False, **obj.attributes})
+        elif isinstance(value, (list, dict, HashPairs)):
+            if obj.attributes:
+                self.fd.write(TYPE_IVAR)
+            self.fd.write(TYPE_UCLASS)
+            self.write(Symbol(obj.ruby_class_name))
+            self.write(value)
+            if obj.attributes:
+                self.write_attributes(obj.attributes)
+        else:
+            raise ValueError(
+                "%r: value of a user class must be a string, a regexp, a list or a dict"
+                % obj
+            )
+
     def write_module(self, obj):
+        self.count_object()
         self.fd.write(TYPE_MODULE)
         self.write_long(len(obj.ruby_class_name.encode()))
         self.fd.write(obj.ruby_class_name.encode())
 
     def write_regexp(self, obj):
+        self.count_object()
+        self.fd.write(TYPE_IVAR)
+        self.write_regexp_body(obj)
+        self.write_long(1)
+        self.write(Symbol("E"))
+        self.write(False)
+
+    def write_regexp_body(self, obj):
+        """write a regexp without its TYPE_IVAR prefix and its attributes"""
         flags = 0
         if obj.flags & re.IGNORECASE:
             flags += 1
         if obj.flags & re.MULTILINE:
             flags += 4
-        self.fd.write(TYPE_IVAR)
         self.fd.write(TYPE_REGEXP)
         pattern = obj.pattern.encode("utf-8")
         self.write_long(len(pattern))
         self.fd.write(pattern)
         write_ubyte(self.fd, flags)
-        self.write_long(1)
-        self.write(Symbol("E"))
-        self.write(False)
 
-    def write_float(self, obj):
+    def format_float(self, obj):
+        """return the text of a float, as bytes"""
         obj = "%.20g" % obj
         if simple_float_re.match(obj):
             while obj.endswith("0"):
                 obj = obj[:-1]
-        obj = obj.encode("utf-8")
+        return obj.encode("utf-8")
+
+    def write_float(self, obj):
+        obj = self.format_float(obj)
+        self.count_object()
         self.fd.write(TYPE_FLOAT)
         self.write_long(len(obj))
         self.fd.write(obj)
 
     def write_ruby_string(self, obj):
         if self.must_write(obj):
-            encoding = "utf-8"
-            attributes = obj.attributes
-            if "E" in attributes and not attributes["E"]:
-                encoding = "latin-1"
-            elif "encoding" in attributes:
-                encoding = attributes["encoding"].decode()
-            else:
-                attributes["E"] = True
-            encoded = obj.encode(encoding)
             self.fd.write(TYPE_IVAR)
-            self.write_bytes(encoded)
-            self.write_attributes(attributes)
+            self.write_string_body(obj, obj.attributes)
+
+    def write_string_body(self, obj, attributes):
+        """write a string without its TYPE_IVAR prefix
+
+        :param attributes: instance variables, including the encoding
+        """
+        encoding = "utf-8"
+        if "E" in attributes and not attributes["E"]:
+            encoding = "latin-1"
+        elif "encoding" in attributes:
+            encoding = attributes["encoding"].decode()
+        else:
+            attributes["E"] = True
+        encoded = obj.encode(encoding)
+        self.fd.write(TYPE_STRING)
+        self.write_long(len(encoded))
+        self.fd.write(encoded)
+        self.write_attributes(attributes)
 
     def write_string(self, obj):
         obj = obj.encode("utf-8")
@@ -188,17 +290,39 @@ class Writer:
         self.write(True)
 
     def write_bytes(self, obj):
+        self.count_object()
         self.fd.write(TYPE_STRING)
         self.write_long(len(obj))
         self.fd.write(obj)
 
     def write_dict(self, obj):
         if self.must_write(obj):
-            self.fd.write(TYPE_HASH)
+            default = obj.default if isinstance(obj, (DefaultHash, HashPairs)) else None
+            self.fd.write(TYPE_HASH if default is None else TYPE_HASH_DEF)
             self.write_long(len(obj))
-            for key, value in obj.items():
+            for key, value in self.hash_items(obj):
                 self.write(key)
                 self.write(value)
+            if default is not None:
+                self.write(default)
+
+    def hash_items(self, obj):
+        """return the pairs of a hash, in the order they must be written
+
+        `str` keys that must be written as symbols (see `symbol_keys`) are converted to :class:`Symbol`.
+        """
+        symbol_keys = self.symbol_keys
+        if symbol_keys is None:
+            return obj.items()
+        return [
+            (
+                Symbol(key)
+                if isinstance(key, str) and (symbol_keys is True or key in symbol_keys)
+                else key,
+                value,
+            )
+            for key, value in obj.items()
+        ]
 
     def write_list(self, obj):
         if self.must_write(obj):
@@ -225,6 +349,7 @@ class Writer:
             # noinspection PyTypeChecker
             self.write_long(obj)
         else:
+            self.count_object()
             self.fd.write(TYPE_BIGNUM)
             if obj < 0:
                 self.fd.write(b"-")
@@ -278,29 +403,368 @@ class Writer:
             self.write_long(self.objects[id(obj)])
             return False
         else:
-            link_index = len(self.objects)
-            self.objects[id(obj)] = link_index
+            self.objects[id(obj)] = self.object_count
+            self.object_count += 1
             return True
 
+    def count_object(self):
+        """reserve a link index for an object whose identity is not tracked (strings, floats, bignums, ...)
+
+        Ruby numbers these objects like any other one, so following links must take them into account."""
+        self.object_count += 1
+
+
+def float_text(obj):
+    """return the shortest text of a float, formatted like Ruby's `Marshal.dump`"""
+    if obj != obj:
+        return "nan"
+    elif obj in (math.inf, -math.inf):
+        return "inf" if obj > 0 else "-inf"
+    elif obj == 0:
+        return "-0" if math.copysign(1.0, obj) < 0 else "0"
+    sign = "-" if obj < 0 else ""
+    mantissa, __, exponent = repr(abs(obj)).partition("e")
+    integer, __, fraction = mantissa.partition(".")
+    digits = (integer + fraction).lstrip("0")
+    # position of the decimal point relative to the first significant digit
+    decpt = len(integer) + int(exponent or 0) - (len(integer + fraction) - len(digits))
+    digits = digits.rstrip("0")
+    if decpt < -3 or decpt > len(digits):
+        text = digits[0]
+        if len(digits) > 1:
+            text += "." + digits[1:]
+        text += "e%d" % (decpt - 1)
+    elif decpt > 0:
+        text = digits[:decpt]
+        if len(digits) > decpt:
+            text += "." + digits[decpt:]
+    else:
+        text = "0." + "0" * -decpt + digits
+    return sign + text
+
+
+class CanonicalWriter(Writer):
+    """Writer whose output only depends on the written values, so that equal values give identical bytes
+
+    * hash keys are sorted by their own encoding, instance variables are sorted by name
+      (struct members keep their order),
+    * floats are written with their shortest text, like Ruby does,
+    * shared objects are written again at each occurrence: links are only used for cycles.
+    """
+
+    def write(self, obj):
+        key = id(obj)
+        fresh = key not in self.objects
+        super().write(obj)
+        if fresh:
+            # the object is no longer an ancestor of the next values
+            self.objects.pop(key, None)
+
+    def format_float(self, obj):
+        return float_text(obj).encode()
+
+    def hash_items(self, obj):
+        return sorted(super().hash_items(obj), key=lambda x: self.sort_key(x[0]))
+
+    def sort_key(self, key):
+        """return the bytes that order a hash key, independent of the previous values"""
+        if isinstance(key, Symbol):
+            return b":" + key.name.encode("utf-8")
+        fd = io.BytesIO()
+        self.__class__(fd, symbol_keys=self.symbol_keys).write(key)
+        return fd.getvalue()
+
+    def write_struct(self, obj):
+        if self.must_write(obj):
+            if obj.attributes:
+                self.fd.write(TYPE_IVAR)
+            self.fd.write(TYPE_STRUCT)
+            self.write(Symbol(obj.ruby_class_name))
+            super().write_attributes(obj.members)
+            if obj.attributes:
+                self.write_attributes(obj.attributes)
+
+    def write_attributes(self, attributes):
+        super().write_attributes(dict(sorted(attributes.items())))
+
+
+def long_size(obj):
+    """return the number of bytes written by :meth:`Writer.write_long`"""
+    if -124 < obj < 123:
+        return 1
+    size = int(math.ceil(obj.bit_length() / 8.0))
+    if size > 5:
+        raise ValueError("%d too long for serialization" % obj)
+    if obj < 0 and obj == -(256**size):
+        size -= 1
+    return 1 + size
+
+
+class SizeCounter:
+    """file object that only counts the bytes that are written to it"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+class BufferWriter:
+    """file object that writes into a writable bytes-like object (`bytearray`, `mmap`, `memoryview`, ...)
+
+    :param buffer: the writable buffer
+    :param offset: position of the first written byte
+    :param grow: function `grow(buffer, size)` called when the buffer is too small,
+        that must return a buffer with the same content and at least `size` bytes
+        (a `ValueError` is raised if not provided)
+    """
+
+    def __init__(self, buffer, offset=0, grow=None):
+        self.buffer = buffer
+        self.position = offset
+        self.grow = grow
+
+    def write(self, data):
+        start = self.position
+        end = start + len(data)
+        if end > len(self.buffer):
+            if self.grow is None:
+                raise ValueError("buffer too small: %d bytes are required" % end)
+            self.buffer = self.grow(self.buffer, end)
+            if end > len(self.buffer):
+                raise ValueError("buffer too small: %d bytes are required" % end)
+        self.buffer[start:end] = data
+        self.position = end
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+
+def grow_bytearray(buffer, size):
+    """`grow` function for :class:`BufferWriter`, that enlarges a `bytearray` in place (at least doubling its size)"""
+    buffer.extend(bytes(max(size, 2 * len(buffer)) - len(buffer)))
+    return buffer
+
+
+class GatherBuffer:
+    """file object that collects small writes in a `bytearray`, but keeps large blobs by reference
+
+    :param threshold: minimum size of the blobs that are not copied
+    """
+
+    def __init__(self, threshold=4096):
+        self.threshold = threshold
+        self.buffers = []
+        self.current = bytearray()
+
+    def write(self, data):
+        if len(data) >= self.threshold:
+            if self.current:
+                self.buffers.append(self.current)
+                self.current = bytearray()
+            self.buffers.append(data)
+        else:
+            self.current += data
+        return len(data)
+
+    def getbuffers(self):
+        """return the list of written buffers"""
+        if self.current:
+            self.buffers.append(self.current)
+            self.current = bytearray()
+        return self.buffers
+
+
+class SizeMixin:
+    """methods of :class:`Writer` that add the size of the encoded values to `size` instead of writing them
+
+    :func:`encoded_size` only uses the methods that are not overridden by the Writer class.
+    """
+
+    size = 0
+
+    def write_long(self, obj):
+        self.size += long_size(obj)
+
+    def write_short(self, obj):
+        self.size += 2
+
+    def write_none(self):
+        self.size += 1
+
+    write_true = write_false = write_none
+
+    def write_int(self, obj):
+        if obj.bit_length() <= 5 * 8:
+            self.size += 1 + long_size(obj)
+        else:
+            self.count_object()
+            size = int(math.ceil(obj.bit_length() / 16.0))
+            self.size += 2 + long_size(size) + 2 * size
+
+    def write_symbol(self, obj):
+        symbol_index = self.symbols.get(obj.name)
+        if symbol_index is not None:
+            self.size += 1 + long_size(symbol_index)
+        else:
+            self.symbols[obj.name] = len(self.symbols)
+            size = len(obj.name.encode("utf-8"))
+            self.size += 1 + long_size(size) + size
+
+    def write_bytes(self, obj):
+        self.count_object()
+        self.size += 1 + long_size(len(obj)) + len(obj)
 
-def write(fd, obj, cls=Writer):
+    def write_string(self, obj):
+        size = len(obj) if obj.isascii() else len(obj.encode("utf-8"))
+        self.count_object()
+        # TYPE_IVAR, TYPE_STRING, length, content and the number of attributes
+        self.size += 3 + long_size(size) + size
+        self.write_symbol(Symbol("E"))
+        self.write_true()
+
+    def write_float(self, obj):
+        size = len(self.format_float(obj))
+        self.count_object()
+        self.size += 1 + long_size(size) + size
+
+    def write_list(self, obj):
+        if self.must_write(obj):
+            self.size += 1 + long_size(len(obj))
+            for x in obj:
+                self.write(x)
+
+    def write(self, obj):
+        # the most frequent types skip the isinstance() checks of Writer.write
+        method = self.size_dispatch.get(type(obj))
+        if method is None:
+            Writer.write(self, obj)
+        else:
+            method(self, obj)
+
+    def must_write(self, obj):
+        object_index = self.objects.get(id(obj))
+        if object_index is not None:
+            self.size += 1 + long_size(object_index)
+            return False
+        self.objects[id(obj)] = self.object_count
+        self.object_count += 1
+        return True
+
+
+# methods of SizeMixin that also require other methods of Writer
+_size_dependencies = {
+    "write": ("write_python_object",),
+    "write_string": ("write_bytes",),
+}
+# method that Writer.write calls for each exact type
+_size_dispatch = {
+    int: "write_int",
+    float: "write_float",
+    str: "write_string",
+    bytes: "write_bytes",
+    list: "write_list",
+    dict: "write_dict",
+    Symbol: "write_symbol",
+}
+_size_classes = {}
+
+
+def size_class(cls):
+    """return a subclass of `cls` with the methods of :class:`SizeMixin` that `cls` does not override"""
+    size_cls = _size_classes.get(cls)
+    if size_cls is None:
+        methods = {}
+        if (
+            cls.write_long is Writer.write_long
+            and cls.write_short is Writer.write_short
+        ):
+            methods["size"] = 0
+            for name, method in vars(SizeMixin).items():
+                if not callable(method):
+                    continue
+                required = (name,) + _size_dependencies.get(name, ())
+                if all(getattr(cls, x) is getattr(Writer, x) for x in required):
+                    methods[name] = method
+        size_cls = _size_classes[cls] = type(cls.__name__, (cls,), methods)
+        size_cls.size_dispatch = {
+            python_type: getattr(size_cls, name)
+            for python_type, name in _size_dispatch.items()
+        }
+    return size_cls
+
+
+def encoded_size(obj, cls=Writer, **kwargs):
+    """return the size of `writes(obj, cls=cls)`, without building the output
+
+    Sizes of the most frequent values are added directly; only the methods overridden
+    by `cls` write (to a :class:`SizeCounter`).
+
+    :param obj: the object to serialize
+    :param cls: Writer class to use
+    :param kwargs: extra arguments of the Writer class
+    """
+    fd = SizeCounter()
+    writer = size_class(cls)(fd, **kwargs)
+    writer.write(obj)
+    return 2 + fd.size + getattr(writer, "size", 0)
+
+
+def write(fd, obj, cls=Writer, **kwargs):
     """write an Python object to a file descriptor
 
     :param fd: the file descriptor
     :param obj: the object to serialize
     :param cls: Writer class to use. Subclass it to serialize new Python classes
+    :param kwargs: extra arguments of the Writer class
     """
     fd.write(b"\x04\x08")
-    writer = cls(fd)
+    writer = cls(fd, **kwargs)
     writer.write(obj)
 
 
-def writes(obj, cls=Writer):
+def write_into(buffer, obj, offset=0, cls=Writer, grow=None, **kwargs):
+    """write an Python object directly into a writable buffer, without intermediate copy
+
+    :param buffer: `bytearray`, `mmap`, `memoryview` (e.g. the `buf` of a `multiprocessing.shared_memory.SharedMemory`)
+    :param obj: the object to serialize
+    :param offset: position of the document in the buffer
+    :param cls: Writer class to use. Subclass it to serialize new Python classes
+    :param grow: function called when the buffer is too small (see :class:`BufferWriter`)
+    :param kwargs: extra arguments of the Writer class
+    :return: the position just after the document
+    """
+    fd = BufferWriter(buffer, offset, grow=grow)
+    write(fd, obj, cls=cls, **kwargs)
+    return fd.position
+
+
+def writes_buffers(obj, cls=Writer, threshold=4096, **kwargs):
+    """write an Python object to a list of buffers, without copying large `bytes` values
+
+    The result can be given to `os.writev` or `socket.sendmsg` (mind their limit on the number of buffers),
+    or joined with `b"".join`.
+
+    :param obj: the object to serialize
+    :param cls: Writer class to use. Subclass it to serialize new Python classes
+    :param threshold: minimum size of the `bytes` values that are kept by reference
+    :param kwargs: extra arguments of the Writer class
+    """
+    fd = GatherBuffer(threshold)
+    write(fd, obj, cls=cls, **kwargs)
+    return fd.getbuffers()
+
+
+def writes(obj, cls=Writer, **kwargs):
     """write an Python object to a bytes string
 
     :param obj: the object to serialize
     :param cls: Writer class to use. Subclass it to serialize new Python classes
+    :param kwargs: extra arguments of the Writer class
     """
     fd = io.BytesIO()
-    write(fd, obj, cls=cls)
+    write(fd, obj, cls=cls, **kwargs)
     return fd.getvalue()